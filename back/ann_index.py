@@ -0,0 +1,138 @@
+"""可插拔的FAISS索引类型
+
+每个知识库可以选择以下索引类型（保存在清单中）：
+- flat      暴力搜索，结果精确，适合小知识库
+- hnsw      HNSW图索引，无需训练，内存占用较大
+- ivf_flat  倒排索引 + 原始向量，需要训练
+- ivf_pq    倒排索引 + 乘积量化，需要训练，内存最小但结果有损
+- auto      文档数低于KB_ANN_MIN_DOCUMENTS时使用flat，超过后自动训练ivf_flat
+
+需要训练的索引把训练好的空索引（聚类中心、码本）单独保存，
+重建索引时复制一份再加入全部向量即可，不需要重新训练。
+
+所有索引都使用内积度量，向量加入前已L2归一化，搜索得到的分数即余弦相似度。
+"""
+import numpy as np
+import faiss
+from config import Config
+
+INDEX_TYPES = ('auto', 'flat', 'hnsw', 'ivf_flat', 'ivf_pq')
+TRAINED_INDEX_TYPES = ('ivf_flat', 'ivf_pq')
+
+# 每个聚类中心至少需要的训练向量数（低于该值faiss会给出警告，聚类质量变差）
+MIN_POINTS_PER_CENTROID = 39
+# 每个聚类中心最多使用的训练向量数（超过部分faiss也会自行采样）
+MAX_POINTS_PER_CENTROID = 256
+# 乘积量化每个子空间的码本有2^8个中心，同样需要足够的训练向量
+PQ_NBITS = 8
+
+
+def resolve_index_type(index_type, count):
+    """把auto解析为实际的索引类型"""
+    if index_type == 'auto':
+        return 'ivf_flat' if count >= Config.KB_ANN_MIN_DOCUMENTS else 'flat'
+    return index_type
+
+
+def default_nlist(count):
+    """倒排列表数量的经验值：约4*sqrt(N)，同时保证每个聚类有足够的训练向量"""
+    return max(1, min(int(4 * np.sqrt(count)), count // MIN_POINTS_PER_CENTROID))
+
+
+def _pq_m(dimension, pq_m):
+    """乘积量化的子空间数必须整除维度，取不超过pq_m的最大因子"""
+    pq_m = max(1, min(pq_m, dimension))
+    while dimension % pq_m != 0:
+        pq_m -= 1
+    return pq_m
+
+
+def can_train(index_type, count, params=None):
+    """向量数是否足够训练该类型的索引"""
+    if index_type not in TRAINED_INDEX_TYPES:
+        return True
+    params = params or {}
+    nlist = params.get('nlist') or default_nlist(count)
+    min_count = nlist * MIN_POINTS_PER_CENTROID
+    if index_type == 'ivf_pq':
+        min_count = max(min_count, MIN_POINTS_PER_CENTROID * 2 ** PQ_NBITS)
+    return count >= min_count
+
+
+def create_index(index_type, dimension, count=0, params=None):
+    """创建空索引（需要训练的类型返回未训练的索引）
+
+    count: 用于推算nlist的向量数
+    params: 知识库的索引参数（nlist、hnsw_m、pq_m），未给出的使用默认值
+    """
+    params = params or {}
+    metric = faiss.METRIC_INNER_PRODUCT
+    if index_type == 'flat':
+        return faiss.IndexFlatIP(dimension)
+    if index_type == 'hnsw':
+        return faiss.index_factory(dimension, f"HNSW{params.get('hnsw_m') or Config.KB_HNSW_M}", metric)
+
+    nlist = params.get('nlist') or default_nlist(count)
+    if index_type == 'ivf_flat':
+        return faiss.index_factory(dimension, f'IVF{nlist},Flat', metric)
+    if index_type == 'ivf_pq':
+        pq_m = _pq_m(dimension, params.get('pq_m') or Config.KB_PQ_M)
+        return faiss.index_factory(dimension, f'IVF{nlist},PQ{pq_m}x{PQ_NBITS}', metric)
+    raise ValueError(f'不支持的索引类型: {index_type}')
+
+
+def train_index(index, vectors):
+    """用给定向量训练索引（向量过多时随机采样）"""
+    vectors = np.asarray(vectors, dtype='float32')
+    max_points = faiss.extract_index_ivf(index).nlist * MAX_POINTS_PER_CENTROID
+    if len(vectors) > max_points:
+        sample = np.random.default_rng(0).choice(len(vectors), max_points, replace=False)
+        vectors = vectors[np.sort(sample)]
+    index.train(np.ascontiguousarray(vectors))
+    return index
+
+
+def supports_range_search(index):
+    """索引是否支持范围搜索（HNSW不支持，只能取前k个后按阈值过滤）"""
+    return not isinstance(index, faiss.IndexHNSW)
+
+
+def index_type_of(index):
+    """索引实例对应的索引类型名称"""
+    if isinstance(index, faiss.IndexIVFPQ):
+        return 'ivf_pq'
+    if isinstance(index, faiss.IndexIVF):
+        return 'ivf_flat'
+    if isinstance(index, faiss.IndexHNSW):
+        return 'hnsw'
+    return 'flat'
+
+
+def index_bytes(index):
+    """索引常驻内存的估算大小"""
+    if index is None:
+        return 0
+    if isinstance(index, faiss.IndexIVFPQ):
+        return index.ntotal * (index.pq.code_size + 8)
+    if isinstance(index, faiss.IndexHNSW):
+        return index.ntotal * (index.d * 4 + index.hnsw.nb_neighbors(0) * 4)
+    return index.ntotal * index.d * 4
+
+
+def search_parameters(index, selector=None, nprobe=None, ef_search=None):
+    """构造搜索参数：有效位图选择器 + 倒排索引的nprobe / HNSW的efSearch
+
+    不需要任何参数时返回None。
+    """
+    kwargs = {}
+    if selector is not None:
+        kwargs['sel'] = selector
+    if isinstance(index, faiss.IndexIVF):
+        kwargs['nprobe'] = int(nprobe or Config.KB_IVF_NPROBE)
+        return faiss.SearchParametersIVF(**kwargs)
+    if isinstance(index, faiss.IndexHNSW):
+        kwargs['efSearch'] = int(ef_search or Config.KB_HNSW_EF_SEARCH)
+        return faiss.SearchParametersHNSW(**kwargs)
+    if kwargs:
+        return faiss.SearchParameters(**kwargs)
+    return None
@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
 from flask_mail import Mail
 from config import Config
@@ -12,10 +12,17 @@ from utils import (
     verify_token
 )
 from knowledge_base import KnowledgeBase
+from kb_pool import get_knowledge_base
+from federated_search import federated_search, iter_federated_search
+from metadata_filter import MetadataFilter, parse_tags
+from result_sets import ResultSet, result_sets, result_set_key, encode_cursor, decode_cursor
+from ann_index import INDEX_TYPES
 from ollama_client import OllamaClient
 from news_crawler import NewsCrawler
 from scheduler import NewsScheduler
 from web_search import WebSearcher
+from web_summary import summarize_web_results
+from context_builder import build_context, truncate_to_tokens
 from file_processor import FileProcessor
 from openpyxl import Workbook
 from io import BytesIO
@@ -23,6 +30,7 @@ from datetime import datetime
 from werkzeug.utils import secure_filename
 from pathlib import Path
 import os
+import json
 import logging
 import re
 from collections import Counter
@@ -217,172 +225,239 @@ def verify_user_token():
         return jsonify({'error': f'服务器错误: {str(e)}'}), 500
 
 
+def _resolve_search_filter(filter_expression, kb_names):
+    """解析搜索的过滤条件，tags通过FileMetadata转换为文件名条件，格式错误时抛出ValueError"""
+    if not filter_expression:
+        return None
+    if not isinstance(filter_expression, dict):
+        raise ValueError('过滤条件必须是对象')
+    
+    filter_expression = dict(filter_expression)
+    tags = filter_expression.pop('tags', None)
+    if tags:
+        from models import FileMetadata
+        wanted = parse_tags(tags)
+        records = FileMetadata.query.filter(FileMetadata.kb_name.in_(kb_names)).all()
+        file_names = {record.filename for record in records if parse_tags(record.tags) & wanted}
+        # 与已有的文件名条件取交集（标签按文件名匹配，不同知识库中的同名文件一并命中）
+        if 'file_name' in filter_expression:
+            requested = filter_expression['file_name']
+            requested = set(requested) if isinstance(requested, list) else {requested}
+            file_names &= {str(name) for name in requested}
+        filter_expression['file_name'] = sorted(file_names)
+    return MetadataFilter.parse(filter_expression)
+
+
+def _decorate_kb_results(kb_results):
+    """为知识库结果添加来源标记，用户知识库的结果优先（稳定排序，保持重排后的相对顺序）"""
+    for result in kb_results:
+        kb_name = result['kb_name']
+        result['from_user_kb'] = (kb_name != 'default')
+        # 确保有来源信息：如果没有source，使用知识库名称
+        if not result.get('metadata'):
+            result['metadata'] = {}
+        if not result['metadata'].get('source'):
+            result['metadata']['source'] = f'知识库: {kb_name}'
+        # 如果没有title，使用知识库名称
+        if not result['metadata'].get('title'):
+            result['metadata']['title'] = f'来自知识库 {kb_name}'
+    
+    kb_results.sort(key=lambda x: not x.get('from_user_kb', False))
+    return kb_results
+
+
+def _web_snippet_result(web_result):
+    """联网搜索的原始结果（未经 Ollama 总结）"""
+    return {
+        'text': web_result['content'],
+        'metadata': {
+            'title': web_result['title'],
+            'source': web_result['source'],
+            'link': web_result.get('link', ''),
+            'published': datetime.now().isoformat(),
+        },
+        'similarity': 0.7,
+        'rank': web_result.get('rank', 1),
+        'from_web': True
+    }
+
+
+def _summarized_web_result(web_result, summary):
+    """经 Ollama 推理和总结后的联网搜索结果"""
+    return {
+        'text': summary,
+        'metadata': {
+            'title': web_result['title'],
+            'source': web_result['source'],
+            'link': web_result.get('link', ''),
+            'published': datetime.now().isoformat(),
+            'original_content': web_result['content'],
+        },
+        'similarity': 0.8,  # 联网搜索结果默认相似度
+        'rank': web_result.get('rank', 1),
+        'from_web': True  # 标记来自联网搜索
+    }
+
+
+def _search_events(query, kbs_to_search, metadata_filter, per_kb_top_k):
+    """检索选定的知识库并逐步产出搜索事件；知识库没有结果时联网搜索
+    
+    事件依次为：每个知识库完成时的 kb_results（未重排），联网搜索的 web_results（原始摘要），
+    每条联网结果总结完成时的 web_summary（按完成顺序，超时的结果没有该事件），最后是带完整结果集的 done。
+    """
+    per_kb_top_k = min(per_kb_top_k, Config.KB_RESULT_SET_MAX_CANDIDATES)
+    
+    # 并行搜索选定的知识库（共用一个查询向量），合并后统一重排；
+    # 相似度为余弦相似度，低于0.05的结果基本无关，不再用0阈值重搜一遍
+    for event in iter_federated_search(
+        query, kbs_to_search, top_k=per_kb_top_k, similarity_threshold=0.05,
+        metadata_filter=metadata_filter
+    ):
+        if event[0] == 'kb':
+            _, kb_name, results = event
+            yield {'type': 'kb_results', 'kb_name': kb_name, 'results': _decorate_kb_results(results)}
+    _, kb_results, kb_results_by_source = event
+    _decorate_kb_results(kb_results)
+    
+    # 记录搜索统计信息
+    total_kb_docs = sum(kb_results_by_source.values())
+    logger.info(f"知识库搜索完成: 查询='{query}', 选择的知识库={kbs_to_search}, 找到结果数={total_kb_docs}")
+    
+    # 如果知识库没有结果，触发联网搜索（带过滤条件时联网结果无法满足条件，不触发）
+    web_results = []
+    used_web_search = False
+    if len(kb_results) == 0 and not metadata_filter:
+        logger.info(f"知识库无结果，触发联网搜索: {query}")
+        used_web_search = True
+        
+        # 联网搜索（使用真实搜索API，不返回虚拟内容）
+        web_search_results = web_searcher.search(query, max_results=3)
+        if web_search_results:
+            web_results = [_web_snippet_result(r) for r in web_search_results]
+            yield {'type': 'web_results', 'results': list(web_results)}
+            # 并发总结，截止时间内未完成或失败的结果保留原始摘要
+            for index, summary in summarize_web_results(ollama_client, query, web_search_results):
+                if summary:
+                    web_results[index] = _summarized_web_result(web_search_results[index], summary)
+                    yield {'type': 'web_summary', 'index': index, 'result': web_results[index]}
+        else:
+            logger.warning(f"联网搜索未找到真实结果，不返回虚拟内容")
+    
+    # 每个知识库取回的结果都不足per_kb_top_k时，说明已经没有更多候选
+    exhausted = (
+        used_web_search
+        or per_kb_top_k >= Config.KB_RESULT_SET_MAX_CANDIDATES
+        or all(count < per_kb_top_k for count in kb_results_by_source.values())
+    )
+    
+    # 合并结果：优先显示知识库结果，然后是联网搜索结果
+    yield {'type': 'done', 'result_set': ResultSet(
+        query, kbs_to_search, metadata_filter, kb_results + web_results, per_kb_top_k, exhausted,
+        info={
+            'kb_results_count': len(kb_results),
+            'web_results_count': len(web_results),
+            'kb_results_by_source': kb_results_by_source,
+            'used_web_search': used_web_search
+        }
+    )}
+
+
+def _create_result_set(query, kbs_to_search, metadata_filter, per_kb_top_k):
+    """检索选定的知识库，生成结果集"""
+    for event in _search_events(query, kbs_to_search, metadata_filter, per_kb_top_k):
+        pass
+    return event['result_set']
+
+
+def _extend_result_set(result_set, needed):
+    """翻页超出已有候选时扩大每个知识库的候选数重新检索，把新增结果追加到末尾（已返回的顺序不变）"""
+    with result_set.lock:
+        while len(result_set) < needed and not result_set.exhausted:
+            per_kb_top_k = min(max(result_set.per_kb_top_k * 2, needed), Config.KB_RESULT_SET_MAX_CANDIDATES)
+            kb_results, kb_results_by_source = federated_search(
+                result_set.query, result_set.kb_names, top_k=per_kb_top_k, similarity_threshold=0.05,
+                metadata_filter=result_set.metadata_filter
+            )
+            seen = {(result.get('kb_name'), result.get('chunk_id')) for result in result_set.results}
+            new_results = [result for result in kb_results if (result['kb_name'], result['chunk_id']) not in seen]
+            result_set.results.extend(_decorate_kb_results(new_results))
+            result_set.per_kb_top_k = per_kb_top_k
+            result_set.exhausted = (
+                not new_results
+                or per_kb_top_k >= Config.KB_RESULT_SET_MAX_CANDIDATES
+                or all(count < per_kb_top_k for count in kb_results_by_source.values())
+            )
+            result_set.info['kb_results_count'] += len(new_results)
+            result_set.info['kb_results_by_source'] = kb_results_by_source
+            logger.info(f"结果集扩充: 查询='{result_set.query}', 每库候选数={per_kb_top_k}, 新增={len(new_results)}")
+
+
 @app.route('/api/knowledge/search', methods=['POST'])
 def search_knowledge():
-    """搜索知识库，如果无结果则联网搜索"""
+    """搜索知识库，如果无结果则联网搜索
+    
+    第一页的检索结果保存为服务端结果集并返回next_cursor；传入cursor时只对结果集切片，
+    翻到已有候选之外时自动扩充候选（extend=false时不扩充）。
+    """
     try:
         data = request.get_json()
         query = data.get('query', '')
         page = int(data.get('page', 1))
         page_size = int(data.get('page_size', 10))
         selected_kbs = data.get('selected_kbs', [])  # 用户选择的知识库列表
+        # 可选的元数据过滤条件：source、file_type、file_name、published（{"from", "to"}）、tags
+        filter_expression = data.get('filter')
+        cursor = data.get('cursor')
+        extend = data.get('extend', True)
         
-        if not query:
-            return jsonify({'error': '搜索关键词不能为空'}), 400
-        
-        # 获取所有知识库列表
-        uploads_dir = file_processor.upload_dir
-        all_kbs = []
-        if uploads_dir.exists():
-            for item in uploads_dir.iterdir():
-                if item.is_dir():
-                    all_kbs.append(item.name)
-        
-        # 确定要搜索的知识库
-        kbs_to_search = []
-        if selected_kbs and len(selected_kbs) > 0:
-            # 使用用户选择的知识库（最多5个）
-            kbs_to_search = selected_kbs[:5]
+        if cursor:
+            # 翻页：直接使用游标对应的结果集
+            try:
+                set_id, start = decode_cursor(cursor)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            result_set = result_sets.get(set_id)
+            if result_set is None:
+                return jsonify({'error': '搜索结果已过期，请重新搜索', 'expired': True}), 410
+            query = result_set.query
+            kbs_to_search = result_set.kb_names
+            page = start // page_size + 1
         else:
-            # 如果没有选择知识库，搜索默认知识库（包含定时任务采集的新闻）
-            kbs_to_search = ['default']
-        
-        # 从多个知识库搜索并合并结果
-        kb_results = []
-        kb_results_by_source = {}  # 记录每个知识库的结果数量
-        
-        if kbs_to_search:
-            # 搜索选定的知识库
-            for kb_name in kbs_to_search:
-                try:
-                    # default知识库使用不同的路径
-                    if kb_name == 'default':
-                        kb_instance = KnowledgeBase(db_path='instance/faiss_index_default')
-                    else:
-                        kb_instance = KnowledgeBase(db_path=f'instance/faiss_index_{kb_name}')
-                    
-                    # 检查知识库是否有数据
-                    kb_stats = kb_instance.get_stats()
-                    logger.info(f"知识库 {kb_name} 统计: {kb_stats}")
-                    
-                    if kb_stats['total_documents'] == 0:
-                        logger.warning(f"知识库 {kb_name} 为空，没有可搜索的内容")
-                        kb_results_by_source[kb_name] = 0
-                        del kb_instance
-                        continue
-                    
-                    # 进一步降低相似度阈值，让更多结果能够返回（从0.1降到0.05）
-                    # 同时增加搜索数量，确保能找到相关内容
-                    results = kb_instance.search(query, top_k=page_size * 5, similarity_threshold=0.05)
-                    logger.info(f"知识库 {kb_name} 搜索 '{query}' 找到 {len(results)} 条结果")
-                    
-                    # 如果仍然没有结果，尝试更宽松的搜索（不设阈值）
-                    if len(results) == 0:
-                        logger.info(f"知识库 {kb_name} 使用更宽松的搜索策略")
-                        results = kb_instance.search(query, top_k=page_size * 5, similarity_threshold=0.0)
-                        logger.info(f"知识库 {kb_name} 宽松搜索找到 {len(results)} 条结果")
-                    
-                    # 为结果添加知识库来源标记
-                    for result in results:
-                        result['kb_name'] = kb_name
-                        result['from_user_kb'] = (kb_name != 'default')
-                        # 确保有来源信息：如果没有source，使用知识库名称
-                        if not result.get('metadata'):
-                            result['metadata'] = {}
-                        if not result['metadata'].get('source'):
-                            result['metadata']['source'] = f'知识库: {kb_name}'
-                        # 如果没有title，使用知识库名称
-                        if not result['metadata'].get('title'):
-                            result['metadata']['title'] = f'来自知识库 {kb_name}'
-                    
-                    kb_results.extend(results)
-                    kb_results_by_source[kb_name] = len(results)
-                    del kb_instance
-                except Exception as e:
-                    logger.error(f"搜索知识库 {kb_name} 失败: {e}", exc_info=True)
-                    kb_results_by_source[kb_name] = 0
+            if not query:
+                return jsonify({'error': '搜索关键词不能为空'}), 400
             
-            # 按相似度排序（优先显示用户创建的知识库的结果）
-            kb_results.sort(key=lambda x: (
-                not x.get('from_user_kb', False),  # 用户创建的知识库优先
-                -x.get('similarity', 0)  # 然后按相似度降序
-            ))
-        
-        # 如果知识库没有结果，触发联网搜索
-        web_results = []
-        used_web_search = False
-        
-        # 记录搜索统计信息
-        total_kb_docs = sum(kb_results_by_source.values())
-        logger.info(f"知识库搜索完成: 查询='{query}', 选择的知识库={kbs_to_search}, 找到结果数={total_kb_docs}")
-        
-        # 如果知识库没有结果，触发联网搜索
-        if len(kb_results) == 0:
-            logger.info(f"知识库无结果，触发联网搜索: {query}")
-            used_web_search = True
+            # 确定要搜索的知识库
+            kbs_to_search = []
+            if selected_kbs and len(selected_kbs) > 0:
+                # 使用用户选择的知识库（最多5个）
+                kbs_to_search = selected_kbs[:5]
+            else:
+                # 如果没有选择知识库，搜索默认知识库（包含定时任务采集的新闻）
+                kbs_to_search = ['default']
             
-            # 联网搜索（使用真实搜索API，不返回虚拟内容）
-            web_search_results = web_searcher.search(query, max_results=3)
+            try:
+                metadata_filter = _resolve_search_filter(filter_expression, kbs_to_search)
+            except ValueError as e:
+                return jsonify({'error': f'过滤条件无效: {e}'}), 400
             
-            if web_search_results:
-                # 使用 Ollama 对联网搜索结果进行推理和总结
-                for web_result in web_search_results:
-                    try:
-                        # 使用 Ollama 生成摘要和推理
-                        context = f"标题：{web_result['title']}\n内容：{web_result['content']}"
-                        summary = ollama_client.answer_question(
-                            question=query,
-                            context=context
-                        )
-                        
-                        # 构建结果
-                        web_results.append({
-                            'text': summary,
-                            'metadata': {
-                                'title': web_result['title'],
-                                'source': web_result['source'],
-                                'link': web_result.get('link', ''),
-                                'published': datetime.now().isoformat(),
-                                'original_content': web_result['content'],
-                            },
-                            'similarity': 0.8,  # 联网搜索结果默认相似度
-                            'rank': web_result.get('rank', 1),
-                            'from_web': True  # 标记来自联网搜索
-                        })
-                    except Exception as e:
-                        logger.error(f"Ollama处理搜索结果失败: {e}")
-                        # 如果 Ollama 处理失败，直接使用原始结果
-                        web_results.append({
-                            'text': web_result['content'],
-                            'metadata': {
-                                'title': web_result['title'],
-                                'source': web_result['source'],
-                                'link': web_result.get('link', ''),
-                                'published': datetime.now().isoformat(),
-                            },
-                            'similarity': 0.7,
-                            'rank': web_result.get('rank', 1),
-                            'from_web': True
-                        })
-            else:
-                logger.warning(f"联网搜索未找到真实结果，不返回虚拟内容")
-        
-        # 合并结果：优先显示知识库结果，然后是联网搜索结果
-        all_results = kb_results + web_results
-        total = len(all_results)
-        
-        # 添加搜索统计信息到响应中
-        search_info = {
-            'kb_results_count': len(kb_results),
-            'web_results_count': len(web_results),
-            'kb_results_by_source': kb_results_by_source,
-            'used_web_search': used_web_search
-        }
-        
-        # 分页
-        start = (page - 1) * page_size
+            # 只传page的翻页请求复用相同条件的结果集，第一页总是重新检索
+            start = (page - 1) * page_size
+            key = result_set_key(query, kbs_to_search, metadata_filter)
+            result_set = result_sets.find(key) if page > 1 else None
+            if result_set is None:
+                result_set = result_sets.add(key, _create_result_set(
+                    query, kbs_to_search, metadata_filter, max(page_size * 5, start + page_size)
+                ))
+        
+        # 分页：结果集的切片，不足一页时按需扩充候选
         end = start + page_size
+        if extend and len(result_set) < end:
+            _extend_result_set(result_set, end)
+        all_results = result_set.results
         paginated_results = all_results[start:end]
+        total = len(all_results)
+        used_web_search = result_set.info['used_web_search']
+        next_cursor = encode_cursor(result_set.id, end) if result_set.has_more(end) else None
         
         # 尝试发送邮件通知给当前登录用户（只有用户明确选择时才发送）
         email_sent = False
@@ -455,8 +530,6 @@ def search_knowledge():
                                     if send_notification_email(mail, user_email, subject, html_content):
                                         email_sent = True
                                         logger.info(f"搜索结果邮件已发送到: {user_email}")
-                                else:
-                                    logger.warning(f"跳过发送邮件到admin邮箱或无效邮箱: {user_email}")
                                 except Exception as e:
                                     logger.error(f"发送邮件失败 {user_email}: {e}")
                             else:
@@ -470,11 +543,13 @@ def search_knowledge():
             'page': page,
             'page_size': page_size,
             'total_pages': (total + page_size - 1) // page_size,
+            'next_cursor': next_cursor,  # 下一页的游标，没有更多结果时为None
+            'has_more': next_cursor is not None,
             'email_sent': email_sent if send_email else None,  # 如果用户未选择发送邮件，返回None
             'used_web_search': used_web_search,
-            'kb_results_count': len(kb_results),
-            'web_results_count': len(web_results),
-            'kb_results_by_source': kb_results_by_source,  # 每个知识库的结果数量
+            'kb_results_count': result_set.info['kb_results_count'],
+            'web_results_count': result_set.info['web_results_count'],
+            'kb_results_by_source': result_set.info['kb_results_by_source'],  # 每个知识库的结果数量
             'searched_kbs': kbs_to_search  # 实际搜索的知识库列表
         })
     except Exception as e:
@@ -482,6 +557,133 @@ def search_knowledge():
         return jsonify({'error': f'搜索失败: {str(e)}'}), 500
 
 
+
+def _format_stream_event(event, sse=False):
+    """把搜索事件序列化为一行NDJSON，或一条SSE消息（事件名为type）"""
+    payload = json.dumps(event, ensure_ascii=False, default=str)
+    if sse:
+        return f"event: {event['type']}\ndata: {payload}\n\n"
+    return payload + '\n'
+
+
+@app.route('/api/knowledge/search/stream', methods=['POST'])
+def search_knowledge_stream():
+    """流式搜索知识库：每个知识库检索完成后立即返回其结果，最后返回重排后的第一页
+    
+    默认返回NDJSON（每行一个事件）；format=sse 或 Accept 包含 text/event-stream 时返回SSE。
+    事件类型：kb_results（单个知识库的结果，未经合并重排）、web_results（联网搜索原始摘要）、
+    web_summary（单条联网结果的总结）、done（第一页、next_cursor等，与普通搜索接口一致）、error。
+    """
+    data = request.get_json() or {}
+    query = data.get('query', '')
+    page_size = int(data.get('page_size', 10))
+    selected_kbs = data.get('selected_kbs', [])
+    filter_expression = data.get('filter')
+    sse = data.get('format') == 'sse' or 'text/event-stream' in request.headers.get('Accept', '')
+    
+    if not query:
+        return jsonify({'error': '搜索关键词不能为空'}), 400
+    kbs_to_search = selected_kbs[:5] if selected_kbs else ['default']
+    try:
+        metadata_filter = _resolve_search_filter(filter_expression, kbs_to_search)
+    except ValueError as e:
+        return jsonify({'error': f'过滤条件无效: {e}'}), 400
+    
+    def generate():
+        try:
+            for event in _search_events(query, kbs_to_search, metadata_filter, page_size * 5):
+                if event['type'] != 'done':
+                    yield _format_stream_event(event, sse)
+            
+            # 保存结果集，之后的翻页使用普通搜索接口的cursor
+            key = result_set_key(query, kbs_to_search, metadata_filter)
+            result_set = result_sets.add(key, event['result_set'])
+            next_cursor = encode_cursor(result_set.id, page_size) if result_set.has_more(page_size) else None
+            yield _format_stream_event({
+                'type': 'done',
+                'results': result_set.results[:page_size],
+                'total': len(result_set),
+                'page_size': page_size,
+                'next_cursor': next_cursor,
+                'has_more': next_cursor is not None,
+                'used_web_search': result_set.info['used_web_search'],
+                'kb_results_count': result_set.info['kb_results_count'],
+                'web_results_count': result_set.info['web_results_count'],
+                'kb_results_by_source': result_set.info['kb_results_by_source'],
+                'searched_kbs': kbs_to_search
+            }, sse)
+        except Exception as e:
+            logger.error(f"流式搜索失败: {e}")
+            yield _format_stream_event({'type': 'error', 'error': f'搜索失败: {str(e)}'}, sse)
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream' if sse else 'application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.route('/api/knowledge/generate/stream', methods=['POST'])
+def generate_stream():
+    """流式问答/摘要（SSE）：模型每生成一段文本就推送一个token事件，最后推送done
+    
+    task=answer：回答question，未提供context时用选定知识库的检索结果按token预算构建上下文；
+    task=summarize：为text生成摘要（max_length字以内）。
+    客户端断开连接时生成器被关闭，随之关闭与Ollama的连接，停止生成。
+    """
+    data = request.get_json() or {}
+    task = data.get('task', 'answer')
+    
+    if task == 'answer':
+        question = data.get('question', '')
+        if not question:
+            return jsonify({'error': '问题不能为空'}), 400
+        context = data.get('context')
+        sources = []
+        if context:
+            context = truncate_to_tokens(context, Config.CONTEXT_MAX_TOKENS)
+        else:
+            # 重排后的检索结果去除近似重复，按分数装入token预算
+            kbs_to_search = (data.get('selected_kbs') or ['default'])[:5]
+            hits, _ = federated_search(question, kbs_to_search, top_k=10, similarity_threshold=0.05, limit=10)
+            context, sources = build_context(hits)
+        chunks = ollama_client.answer_question_stream(question, context)
+        first_event = {'type': 'sources', 'results': _decorate_kb_results(sources)}
+    elif task == 'summarize':
+        text = data.get('text', '')
+        if not text:
+            return jsonify({'error': '文本不能为空'}), 400
+        text = truncate_to_tokens(text, Config.SUMMARY_MAX_INPUT_TOKENS)
+        chunks = ollama_client.summarize_stream(text, max_length=int(data.get('max_length', 200)))
+        first_event = None
+    else:
+        return jsonify({'error': f'不支持的任务类型: {task}'}), 400
+    
+    def generate():
+        generated = []
+        try:
+            if first_event:
+                yield _format_stream_event(first_event, sse=True)
+            for chunk in chunks:
+                generated.append(chunk)
+                yield _format_stream_event({'type': 'token', 'text': chunk}, sse=True)
+            if not generated:
+                yield _format_stream_event({'type': 'error', 'error': 'Ollama不可用，无法生成文本'}, sse=True)
+                return
+            yield _format_stream_event({'type': 'done', 'text': ''.join(generated)}, sse=True)
+        except Exception as e:
+            logger.error(f"流式生成失败: {e}")
+            yield _format_stream_event({'type': 'error', 'error': f'生成失败: {str(e)}'}, sse=True)
+        finally:
+            # 客户端断开时Werkzeug关闭本生成器，这里同时关闭模型的流式输出
+            chunks.close()
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/knowledge/upload', methods=['POST'])
 def upload_file():
     """上传文件到知识库"""
@@ -561,13 +763,9 @@ def upload_file():
             metadata_list = metadata_list[:1000]
         
         # 添加到知识库（使用指定的知识库）
-        # 注意：这里需要确保知识库实例正确初始化
-        kb_instance = KnowledgeBase(db_path=f'instance/faiss_index_{kb_name}')
+        kb_instance = get_knowledge_base(kb_name)
         kb_instance.add_documents(texts, metadata_list)
         
-        # 关闭知识库实例（避免资源占用）
-        del kb_instance
-        
         # 文件上传不需要发送邮件（根据需求，只在搜索到结果时发送邮件）
         
         return jsonify({
@@ -600,9 +798,7 @@ def add_to_knowledge():
             metadata_list = [{}] * len(texts)
         
         # 添加到default知识库（保持兼容性）
-        default_kb = KnowledgeBase(db_path='instance/faiss_index_default')
-        default_kb.add_documents(texts, metadata_list)
-        del default_kb
+        get_knowledge_base('default').add_documents(texts, metadata_list)
         
         # 同时添加到全局kb实例
         kb.add_documents(texts, metadata_list)
@@ -647,7 +843,7 @@ def export_to_excel():
                 result.get('text', '')[:500],  # 限制内容长度
                 metadata.get('source', ''),
                 metadata.get('link', ''),
-                f"{result.get('similarity', 0):.2%}",
+                f"{result['similarity']:.2%}" if result.get('similarity') is not None else '',
                 metadata.get('published', '')
             ])
         
@@ -678,11 +874,9 @@ def get_knowledge_stats():
         
         # 统计default知识库
         try:
-            default_kb = KnowledgeBase(db_path='instance/faiss_index_default')
-            default_stats = default_kb.get_stats()
+            default_stats = get_knowledge_base('default').get_stats()
             total_docs += default_stats.get('total_documents', 0)
             total_index_size += default_stats.get('index_size', 0)
-            del default_kb
         except:
             pass
         
@@ -692,17 +886,21 @@ def get_knowledge_stats():
             for item in uploads_dir.iterdir():
                 if item.is_dir() and item.name != 'default':
                     try:
-                        user_kb = KnowledgeBase(db_path=f'instance/faiss_index_{item.name}')
-                        user_stats = user_kb.get_stats()
+                        user_stats = get_knowledge_base(item.name).get_stats()
                         total_docs += user_stats.get('total_documents', 0)
                         total_index_size += user_stats.get('index_size', 0)
-                        del user_kb
                     except:
                         pass
         
         return jsonify({
             'total_documents': total_docs,
-            'index_size': total_index_size
+            'index_size': total_index_size,
+            # 大模型生成结果缓存的命中统计
+            'llm_cache': ollama_client.cache.get_stats() if ollama_client.cache is not None else None,
+            # Ollama生成请求的并发统计（占用数、排队数、峰值、等待时间）
+            'ollama': ollama_client.get_stats(),
+            # 联网搜索各搜索源的耗时与错误统计（按当前的查询顺序）
+            'web_search': web_searcher.get_stats()
         })
     except Exception as e:
         logger.error(f"获取统计失败: {e}")
@@ -827,14 +1025,21 @@ def delete_file(kb_name, filename):
             logger.error(f"文件删除失败，文件仍存在: {file_path}")
             return jsonify({'error': '文件删除失败'}), 500
         
-        # 注意：从向量数据库中删除数据比较复杂，这里只删除文件
-        # 实际应用中，可以通过重建索引或标记删除来处理
         logger.info(f"文件已删除: {file_path}, 大小: {file_size / 1024 / 1024:.2f}MB")
         
+        # 从向量数据库中删除该文件的文档（只写删除标记，不重建索引）
+        deleted_chunks = 0
+        try:
+            deleted_chunks = get_knowledge_base(kb_name).delete_documents_by_filename(filename)
+            logger.info(f"已从知识库 {kb_name} 删除 {deleted_chunks} 个文档块")
+        except Exception as e:
+            logger.error(f"从知识库删除文档失败: {e}", exc_info=True)
+        
         return jsonify({
             'message': '文件删除成功',
             'filename': filename,
-            'file_deleted': True  # 标记文件已删除
+            'file_deleted': True,  # 标记文件已删除
+            'deleted_chunks': deleted_chunks
         })
     except Exception as e:
         logger.error(f"删除文件失败: {e}", exc_info=True)
@@ -895,6 +1100,7 @@ def move_file(kb_name, filename):
             }), 400
         
         # 目标文件路径
+        source_filename = filename
         target_file_path = target_kb_dir / filename
         # 如果目标文件已存在，添加时间戳
         if target_file_path.exists():
@@ -931,13 +1137,15 @@ def move_file(kb_name, filename):
                 
                 if texts:
                     # 添加到目标知识库
-                    target_kb_instance = KnowledgeBase(db_path=f'instance/faiss_index_{target_kb}')
-                    target_kb_instance.add_documents(texts, metadata_list)
-                    del target_kb_instance
+                    get_knowledge_base(target_kb).add_documents(texts, metadata_list)
                     
                     logger.info(f"文件已添加到目标知识库向量数据库: {target_kb}, {len(texts)}条数据")
                 else:
                     logger.warning(f"文件处理后没有提取到文本: {filename}")
+                
+                # 从源知识库删除（只写删除标记）
+                deleted = get_knowledge_base(kb_name).delete_documents_by_filename(source_filename)
+                logger.info(f"已从源知识库 {kb_name} 删除 {deleted} 个文档块")
             except Exception as e:
                 logger.error(f"更新向量数据库失败: {e}", exc_info=True)
         
@@ -945,9 +1153,6 @@ def move_file(kb_name, filename):
         thread = threading.Thread(target=process_vector_db, daemon=True)
         thread.start()
         
-        # 注意：从源知识库删除向量数据比较复杂，这里只移动文件
-        # 实际应用中，可以通过重建索引或标记删除来处理
-        
         return jsonify({
             'message': '文件移动成功，正在后台处理向量数据库',
             'filename': filename,
@@ -1052,15 +1257,15 @@ def move_files_batch():
                     continue
                 
                 # 处理向量数据库（异步处理，避免超时）
-                def process_vector_db_async(file_path, file_name, kb_name):
+                def process_vector_db_async(file_path, file_name, kb_name, source_kb, source_file_name):
                     try:
                         logger.info(f"开始处理文件向量数据库: {file_name}")
                         texts, metadata_list = file_processor.process_file(file_path, file_name)
                         if texts:
-                            kb_instance = KnowledgeBase(db_path=f'instance/faiss_index_{kb_name}')
-                            kb_instance.add_documents(texts, metadata_list)
-                            del kb_instance
+                            get_knowledge_base(kb_name).add_documents(texts, metadata_list)
                             logger.info(f"文件已添加到知识库向量数据库: {kb_name}, {len(texts)}条数据")
+                        # 从源知识库删除（只写删除标记）
+                        get_knowledge_base(source_kb).delete_documents_by_filename(source_file_name)
                     except Exception as e:
                         logger.error(f"更新向量数据库失败: {e}", exc_info=True)
                 
@@ -1068,7 +1273,7 @@ def move_files_batch():
                 import threading
                 thread = threading.Thread(
                     target=process_vector_db_async,
-                    args=(target_file_path, filename, target_kb),
+                    args=(target_file_path, filename, target_kb, file_info['source_kb'], file_info['filename']),
                     daemon=True
                 )
                 thread.start()
@@ -1360,6 +1565,10 @@ def create_kb():
         if not re.match(r'^[\w\u4e00-\u9fa5]+$', kb_name):
             return jsonify({'error': '知识库名称只能包含字母、数字、下划线和中文'}), 400
         
+        index_type = data.get('index_type')
+        if index_type and index_type not in INDEX_TYPES:
+            return jsonify({'error': f"不支持的索引类型，可选: {', '.join(INDEX_TYPES)}"}), 400
+        
         # 检查是否已存在
         kb_dir = file_processor.upload_dir / kb_name
         if kb_dir.exists():
@@ -1369,14 +1578,22 @@ def create_kb():
         kb_dir.mkdir(parents=True, exist_ok=True)
         
         # 创建对应的知识库索引（初始化即可）
-        kb_instance = KnowledgeBase(db_path=f'instance/faiss_index_{kb_name}')
+        kb_instance = get_knowledge_base(kb_name)
+        # 可选：指定索引类型及参数，默认使用KB_INDEX_TYPE
+        if index_type:
+            index_params = data.get('index_params') or {}
+            kb_instance.set_index_type(index_type, **{
+                key: int(index_params[key])
+                for key in ('nlist', 'hnsw_m', 'pq_m', 'nprobe', 'ef_search')
+                if index_params.get(key)
+            })
         # 保存索引以确保创建成功
         kb_instance.save_index()
-        del kb_instance
         
         return jsonify({
             'message': '知识库创建成功',
-            'kb_name': kb_name
+            'kb_name': kb_name,
+            'index_type': kb_instance.get_stats()['index_type']
         })
     except Exception as e:
         logger.error(f"创建知识库失败: {e}")
@@ -1529,9 +1746,7 @@ def manual_crawl():
                 })
             
             # 添加到default知识库（确保手动采集的新闻可以被搜索到）
-            default_kb = KnowledgeBase(db_path='instance/faiss_index_default')
-            default_kb.add_documents(texts, metadata_list)
-            del default_kb
+            get_knowledge_base('default').add_documents(texts, metadata_list)
             
             # 同时添加到全局kb实例（保持兼容）
             kb.add_documents(texts, metadata_list)
@@ -1903,10 +2118,7 @@ def run_analysis_task(task_id, task_type, kb_name, filename=None):
         elif task_type == 'knowledge_base':
             # 分析整个知识库
             update_progress(0.1, '加载知识库...')
-            if kb_name == 'default':
-                kb_instance = KnowledgeBase(db_path='instance/faiss_index_default')
-            else:
-                kb_instance = KnowledgeBase(db_path=f'instance/faiss_index_{kb_name}')
+            kb_instance = get_knowledge_base(kb_name)
             
             documents = kb_instance.documents
             if len(documents) == 0:
@@ -1918,7 +2130,6 @@ def run_analysis_task(task_id, task_type, kb_name, filename=None):
                         'clusters': []
                     }
                     analysis_tasks[task_id]['progress'] = 1.0
-                del kb_instance
                 return
             
             update_progress(0.2, '提取关键词...')
@@ -1928,8 +2139,6 @@ def run_analysis_task(task_id, task_type, kb_name, filename=None):
             update_progress(0.4, '执行聚类分析...')
             clusters = fast_cluster_documents(documents, update_progress)
             
-            del kb_instance
-            
             # 生成聚类分析结论
             cluster_summary = generate_cluster_summary(clusters, len(documents), top_keywords)
             
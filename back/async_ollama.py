@@ -0,0 +1,270 @@
+"""基于asyncio的Ollama客户端
+
+直接调用Ollama的HTTP接口（/api/tags、/api/chat），所有请求共用一个httpx连接池。
+同时进行的生成请求数不超过max_in_flight，超出的请求按到达顺序排队（先到先得），
+流式生成在整个生成过程中占用名额，提前关闭时断开连接，Ollama随即停止生成。
+
+OllamaRuntime 在后台线程中运行事件循环，为同步代码（Flask请求线程、定时任务）提供阻塞接口；
+同一个Ollama地址在进程内只有一个运行时，并发上限对整个进程生效。
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import deque
+import httpx
+from config import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = 'http://127.0.0.1:11434'
+
+
+class OllamaError(Exception):
+    """Ollama返回错误"""
+
+
+def normalize_host(host):
+    """补全协议和端口，如 127.0.0.1:11434 -> http://127.0.0.1:11434"""
+    host = (host or DEFAULT_HOST).strip().rstrip('/')
+    if '://' not in host:
+        host = 'http://' + host
+    scheme, address = host.split('://', 1)
+    if ':' not in address.split('/')[0]:
+        address = address.split('/')[0] + ':11434'
+    return f'{scheme}://{address}'
+
+
+class FairLimiter:
+    """先到先得的并发上限（只能在同一个事件循环中使用）
+
+    名额释放时直接交给排在最前面的等待者，新到的请求不能插队。
+    """
+
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self._waiters = deque()
+        self.peak_in_flight = 0
+        self.total = 0
+        self.queued = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def waiting(self):
+        return sum(1 for future in self._waiters if not future.done())
+
+    async def acquire(self):
+        """取得一个名额，没有空闲名额时排队等待"""
+        start = time.monotonic()
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+        else:
+            self.queued += 1
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # 名额已经交过来，但请求被取消了，交给下一个等待者
+                    self.release()
+                elif future in self._waiters:
+                    self._waiters.remove(future)
+                raise
+        wait = time.monotonic() - start
+        self.total += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def release(self):
+        """释放名额：有等待者时直接交给最早的等待者（占用数不变）"""
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+    def get_stats(self):
+        """并发统计信息"""
+        return {
+            'max_in_flight': self.max_in_flight,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'peak_in_flight': self.peak_in_flight,
+            'total': self.total,
+            'queued': self.queued,
+            'avg_wait_ms': round(self.total_wait / self.total * 1000, 2) if self.total else 0.0,
+            'max_wait_ms': round(self.max_wait * 1000, 2),
+        }
+
+
+class AsyncOllamaClient:
+    """Ollama异步客户端，共用连接池，生成请求受并发上限约束"""
+
+    def __init__(self, host=DEFAULT_HOST, max_in_flight=10, timeout=120):
+        self.host = normalize_host(host)
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.limiter = FairLimiter(max_in_flight)
+        self._http = None
+
+    def _client(self):
+        # 在事件循环中第一次使用时创建（连接池绑定到该事件循环）
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                base_url=self.host,
+                timeout=httpx.Timeout(self.timeout, connect=5),
+                limits=httpx.Limits(
+                    max_connections=self.max_in_flight + 2,
+                    max_keepalive_connections=self.max_in_flight
+                )
+            )
+        return self._http
+
+    async def list_models(self, timeout=None):
+        """已安装的模型名称列表"""
+        response = await self._client().get('/api/tags', timeout=timeout or httpx.USE_CLIENT_DEFAULT)
+        self._raise_for_status(response)
+        return [model.get('name', '') for model in response.json().get('models', [])]
+
+    async def chat(self, model, messages, options=None):
+        """对话，返回生成的完整文本"""
+        async with self.limiter:
+            response = await self._client().post('/api/chat', json={
+                'model': model,
+                'messages': messages,
+                'options': options or {},
+                'stream': False,
+            })
+            self._raise_for_status(response)
+            payload = response.json()
+        if payload.get('error'):
+            raise OllamaError(payload['error'])
+        return payload.get('message', {}).get('content', '')
+
+    async def chat_stream(self, model, messages, options=None):
+        """流式对话，逐段产出生成的文本；提前关闭时断开连接"""
+        async with self.limiter:
+            async with self._client().stream('POST', '/api/chat', json={
+                'model': model,
+                'messages': messages,
+                'options': options or {},
+                'stream': True,
+            }) as response:
+                if response.status_code >= 400:
+                    await response.aread()
+                    self._raise_for_status(response)
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    part = json.loads(line)
+                    if part.get('error'):
+                        raise OllamaError(part['error'])
+                    content = part.get('message', {}).get('content', '')
+                    if content:
+                        yield content
+                    if part.get('done'):
+                        break
+
+    @staticmethod
+    def _raise_for_status(response):
+        if response.status_code >= 400:
+            try:
+                message = response.json().get('error', response.text)
+            except ValueError:
+                message = response.text
+            raise OllamaError(f'{response.status_code}: {message}')
+
+    async def aclose(self):
+        """关闭连接池"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def get_stats(self):
+        """并发统计信息"""
+        return dict(self.limiter.get_stats(), host=self.host)
+
+
+class OllamaRuntime:
+    """在后台线程的事件循环中运行AsyncOllamaClient，为同步代码提供阻塞接口"""
+
+    def __init__(self, client):
+        self.client = client
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='ollama-loop', daemon=True)
+        self._thread.start()
+
+    def _run(self, coroutine, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result(timeout)
+
+    def list_models(self, timeout=None):
+        return self._run(self.client.list_models(timeout=timeout))
+
+    def chat(self, model, messages, options=None):
+        return self._run(self.client.chat(model, messages, options))
+
+    def chat_stream(self, model, messages, options=None, deadline=None):
+        """同步生成器，关闭时同时关闭异步生成器（断开与Ollama的连接）
+
+        deadline: time.monotonic()的截止时刻；等待下一个片段（包括排队和第一个片段）超过该时刻时
+        断开连接并抛出TimeoutError
+        """
+        stream = self.client.chat_stream(model, messages, options)
+
+        async def next_chunk():
+            if deadline is None:
+                return await stream.__anext__()
+            try:
+                return await asyncio.wait_for(stream.__anext__(), max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                raise TimeoutError('等待Ollama生成超过截止时间') from None
+
+        try:
+            while True:
+                try:
+                    chunk = self._run(next_chunk())
+                except StopAsyncIteration:
+                    return
+                yield chunk
+        finally:
+            self._run(stream.aclose())
+
+    def get_stats(self):
+        return self.client.get_stats()
+
+    def close(self):
+        """关闭连接池并停止事件循环"""
+        self._run(self.client.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+_runtimes = {}
+_runtimes_lock = threading.Lock()
+
+
+def get_runtime(host=DEFAULT_HOST):
+    """同一个Ollama地址共用的运行时（并发上限和连接池对整个进程生效）"""
+    host = normalize_host(host)
+    with _runtimes_lock:
+        runtime = _runtimes.get(host)
+        if runtime is None:
+            runtime = OllamaRuntime(AsyncOllamaClient(
+                host, max_in_flight=Config.OLLAMA_MAX_IN_FLIGHT, timeout=Config.OLLAMA_TIMEOUT
+            ))
+            _runtimes[host] = runtime
+        return runtime
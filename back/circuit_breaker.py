@@ -0,0 +1,70 @@
+"""熔断器
+
+连续失败达到阈值后断开（open），断开期间的调用直接失败，不再等待超时；
+经过reset_timeout秒后进入半开状态（half_open），只放行一个试探调用：
+试探成功则恢复（closed），失败则重新断开并重新计时。
+"""
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """线程安全的熔断器"""
+
+    def __init__(self, failure_threshold=3, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.rejected = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """是否放行本次调用（半开状态下同时只放行一个试探调用）"""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        """调用成功：恢复并清零失败计数"""
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def release(self):
+        """调用没有得出结果（如还没收到响应就被取消）：不改变状态，只释放半开状态的试探名额"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        """调用失败：半开状态或连续失败达到阈值时断开"""
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def get_stats(self):
+        """熔断器状态"""
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'rejected': self.rejected,
+            }
@@ -48,4 +48,107 @@ class Config:
     
     # 验证码有效期（分钟）
     VERIFICATION_CODE_EXPIRY = 10
-
+    
+    # 嵌入/重排模型（进程内共享，见model_registry.py）
+    EMBEDDING_MODEL_NAME = os.environ.get('EMBEDDING_MODEL_NAME') or 'all-MiniLM-L6-v2'
+    RERANK_MODEL_NAME = os.environ.get('RERANK_MODEL_NAME') or 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+    RERANK_FALLBACK_MODEL_NAME = os.environ.get('RERANK_FALLBACK_MODEL_NAME') or 'sentence-transformers/ms-marco-MiniLM-L-6-v2'
+    
+    # 知识库实例池（见kb_pool.py）
+    KB_POOL_MAX_ITEMS = int(os.environ.get('KB_POOL_MAX_ITEMS') or 8)
+    KB_POOL_MAX_MB = int(os.environ.get('KB_POOL_MAX_MB') or 1024)
+    
+    # 知识库段的后台合并（见KnowledgeBase._plan_compaction）：大小相差不超过KB_TIER_RATIO倍的相邻段
+    # 达到KB_MERGE_FACTOR个时合并为一个段（按大小分层，写入量与新增数据量成正比摊销）
+    KB_MERGE_FACTOR = int(os.environ.get('KB_MERGE_FACTOR') or 4)
+    KB_TIER_RATIO = float(os.environ.get('KB_TIER_RATIO') or 4)
+    # 单个段中已删除文本块占比达到该值时在后台重写该段，物理清除
+    KB_MAX_DELETED_RATIO = float(os.environ.get('KB_MAX_DELETED_RATIO') or 0.2)
+    # 新写入的向量先放在增量部分（暴力搜索），不复制已有索引；增量达到KB_DELTA_MIN_ROWS条
+    # 且达到已建索引向量数的KB_DELTA_RATIO倍时在后台并入主索引（每条向量被复制的次数摊销为常数）
+    KB_DELTA_MIN_ROWS = int(os.environ.get('KB_DELTA_MIN_ROWS') or 2000)
+    KB_DELTA_RATIO = float(os.environ.get('KB_DELTA_RATIO') or 0.1)
+    
+    # 知识库索引类型（见ann_index.py）：auto/flat/hnsw/ivf_flat/ivf_pq，可在创建知识库时单独指定
+    KB_INDEX_TYPE = os.environ.get('KB_INDEX_TYPE') or 'auto'
+    # auto类型下文档数达到该值时自动训练倒排索引
+    KB_ANN_MIN_DOCUMENTS = int(os.environ.get('KB_ANN_MIN_DOCUMENTS') or 20000)
+    # 文档数增长到上次训练时的该倍数后重新训练
+    KB_ANN_RETRAIN_GROWTH = float(os.environ.get('KB_ANN_RETRAIN_GROWTH') or 4)
+    # 搜索时的默认参数：倒排索引探查的列表数、HNSW的候选队列长度
+    KB_IVF_NPROBE = int(os.environ.get('KB_IVF_NPROBE') or 16)
+    KB_HNSW_M = int(os.environ.get('KB_HNSW_M') or 32)
+    KB_HNSW_EF_SEARCH = int(os.environ.get('KB_HNSW_EF_SEARCH') or 64)
+    KB_PQ_M = int(os.environ.get('KB_PQ_M') or 48)
+    
+    # 重排：每个查询只重排相似度最高的前N条，超过时间预算（毫秒，0为不限）后剩余结果按相似度排序
+    KB_RERANK_DEPTH = int(os.environ.get('KB_RERANK_DEPTH') or 50)
+    KB_RERANK_BUDGET_MS = int(os.environ.get('KB_RERANK_BUDGET_MS') or 500)
+    KB_RERANK_BATCH_SIZE = int(os.environ.get('KB_RERANK_BATCH_SIZE') or 32)
+    # 重排分数缓存条数（按 查询 + 文本块 缓存，翻页和重复查询不再调用重排模型）
+    KB_RERANK_CACHE_SIZE = int(os.environ.get('KB_RERANK_CACHE_SIZE') or 20000)
+    # 查询向量缓存条数（按 嵌入模型 + 规范化后的查询 缓存，所有知识库共享）
+    KB_QUERY_CACHE_SIZE = int(os.environ.get('KB_QUERY_CACHE_SIZE') or 2048)
+    # 跨知识库并行搜索的线程数（见federated_search.py）
+    KB_SEARCH_WORKERS = int(os.environ.get('KB_SEARCH_WORKERS') or 5)
+    # 知识库存储模式：separate（每个知识库一个索引）/ unified（所有知识库共用一个索引，按kb_name分区）
+    KB_STORAGE_MODE = os.environ.get('KB_STORAGE_MODE') or 'separate'
+    
+    # 混合检索（见lexical_index.py）：每个段写入时生成jieba分词的BM25倒排表，与向量检索结果按RRF融合
+    KB_LEXICAL_ENABLED = (os.environ.get('KB_LEXICAL_ENABLED') or 'true').lower() in ('1', 'true', 'yes')
+    KB_BM25_K1 = float(os.environ.get('KB_BM25_K1') or 1.2)
+    KB_BM25_B = float(os.environ.get('KB_BM25_B') or 0.75)
+    # RRF融合常数：融合分数为 sum(1 / (KB_RRF_K + 排名))
+    KB_RRF_K = int(os.environ.get('KB_RRF_K') or 60)
+    # 关键词快速路径：查询词不超过该数量且BM25结果足够明确时只用倒排索引，不调用嵌入和重排模型
+    KB_LEXICAL_FAST_MAX_TERMS = int(os.environ.get('KB_LEXICAL_FAST_MAX_TERMS') or 4)
+    KB_LEXICAL_MIN_SCORE = float(os.environ.get('KB_LEXICAL_MIN_SCORE') or 2.0)
+    KB_LEXICAL_DECISIVE_RATIO = float(os.environ.get('KB_LEXICAL_DECISIVE_RATIO') or 1.5)
+    
+    # 搜索结果集（见result_sets.py）：翻页时直接切片，过期时间（秒）和最多保存的结果集数
+    KB_RESULT_SET_TTL = int(os.environ.get('KB_RESULT_SET_TTL') or 600)
+    KB_RESULT_SET_MAX_ITEMS = int(os.environ.get('KB_RESULT_SET_MAX_ITEMS') or 256)
+    # 翻页超出候选结果时按倍数扩充每个知识库的候选数，最多扩充到该值
+    KB_RESULT_SET_MAX_CANDIDATES = int(os.environ.get('KB_RESULT_SET_MAX_CANDIDATES') or 1000)
+    
+    # 联网搜索结果总结（见web_summary.py）：并发总结的线程数（所有请求共享）和整体截止时间（秒），超时的结果使用原始摘要
+    WEB_SUMMARY_WORKERS = int(os.environ.get('WEB_SUMMARY_WORKERS') or 3)
+    WEB_SUMMARY_DEADLINE = float(os.environ.get('WEB_SUMMARY_DEADLINE') or 8)
+    
+    # 大模型生成结果缓存（见llm_cache.py）：按 模型 + 提示词哈希 + 生成参数 缓存到SQLite文件，
+    # 有效期（秒，0为不过期）和最多保存的条目数（超出时淘汰最久未使用的条目）
+    LLM_CACHE_ENABLED = (os.environ.get('LLM_CACHE_ENABLED') or 'true').lower() in ('1', 'true', 'yes')
+    LLM_CACHE_PATH = os.environ.get('LLM_CACHE_PATH') or 'instance/llm_cache.sqlite3'
+    LLM_CACHE_TTL = int(os.environ.get('LLM_CACHE_TTL') or 7 * 24 * 3600)
+    LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES') or 20000)
+    
+    # Ollama生成请求（见async_ollama.py）：同时进行的生成请求上限（超出的按到达顺序排队）和单次请求超时（秒）
+    OLLAMA_MAX_IN_FLIGHT = int(os.environ.get('OLLAMA_MAX_IN_FLIGHT') or 10)
+    OLLAMA_TIMEOUT = float(os.environ.get('OLLAMA_TIMEOUT') or 120)
+    
+    # Ollama连接探测（后台线程，不阻塞启动）：重新探测间隔和单次探测超时（秒）
+    OLLAMA_PROBE_INTERVAL = float(os.environ.get('OLLAMA_PROBE_INTERVAL') or 30)
+    OLLAMA_PROBE_TIMEOUT = float(os.environ.get('OLLAMA_PROBE_TIMEOUT') or 2)
+    # 生成请求熔断：连续失败次数达到阈值后断开，断开期间直接返回；经过恢复时间（秒）后放行一个试探请求
+    OLLAMA_BREAKER_FAILURES = int(os.environ.get('OLLAMA_BREAKER_FAILURES') or 3)
+    OLLAMA_BREAKER_RESET = float(os.environ.get('OLLAMA_BREAKER_RESET') or 30)
+    
+    # 问答上下文（见context_builder.py）：用生成模型同系列的分词器计算token数，
+    # 检索结果去除近似重复后按分数装入上下文预算，摘要的输入原文也按token数截断
+    CONTEXT_TOKENIZER_NAME = os.environ.get('CONTEXT_TOKENIZER_NAME') or 'Qwen/Qwen2.5-0.5B-Instruct'
+    CONTEXT_MAX_TOKENS = int(os.environ.get('CONTEXT_MAX_TOKENS') or 1500)
+    # 两个文本块的字符三元组Jaccard相似度不低于该值时视为近似重复，只保留分数高的
+    CONTEXT_DEDUP_THRESHOLD = float(os.environ.get('CONTEXT_DEDUP_THRESHOLD') or 0.8)
+    SUMMARY_MAX_INPUT_TOKENS = int(os.environ.get('SUMMARY_MAX_INPUT_TOKENS') or 800)
+    
+    # 联网搜索（见web_search.py）：各搜索源按统计的期望耗时排序后对冲查询，
+    # 单个搜索源的超时、整体截止时间、启动下一个搜索源前等待的对冲延迟（秒，0为同时查询所有搜索源），
+    # 第一个结果返回后继续等待其他搜索源并合并结果的窗口（秒，0为第一个结果胜出）
+    WEB_SEARCH_TIMEOUT = float(os.environ.get('WEB_SEARCH_TIMEOUT') or 5)
+    WEB_SEARCH_DEADLINE = float(os.environ.get('WEB_SEARCH_DEADLINE') or 6)
+    WEB_SEARCH_HEDGE_DELAY = float(os.environ.get('WEB_SEARCH_HEDGE_DELAY') or 0.3)
+    WEB_SEARCH_MERGE_WINDOW = float(os.environ.get('WEB_SEARCH_MERGE_WINDOW') or 0)
+    # 查询线程数（所有搜索请求共享，被取消的查询在读取到下一个数据块或超时后才释放线程）
+    WEB_SEARCH_WORKERS = int(os.environ.get('WEB_SEARCH_WORKERS') or 8)
+    WEB_SEARCH_DUCKDUCKGO_URL = os.environ.get('WEB_SEARCH_DUCKDUCKGO_URL') or 'https://api.duckduckgo.com/'
+    WEB_SEARCH_BAIDU_URL = os.environ.get('WEB_SEARCH_BAIDU_URL') or 'https://www.baidu.com/s'
@@ -0,0 +1,98 @@
+"""检索增强问答的上下文构建
+
+提示词长度是CPU上生成延迟的主要因素，上下文按token预算装填：
+- 用与生成模型同系列的分词器计算token数（加载失败时按字符估算：中文每字约1个token，其他字符约4个1个token）
+- 去除近似重复的文本块（字符三元组的Jaccard相似度，保留分数高的）
+- 按分数从高到低装入，放不下的文本块截断到剩余预算（剩余太少时不再装入）
+"""
+import math
+import re
+from config import Config
+from knowledge_base import retrieval_score
+from model_registry import get_context_tokenizer
+
+SEPARATOR = '\n\n'
+# 剩余预算少于该token数时，不再截断装入放不下的文本块
+MIN_TRUNCATED_TOKENS = 64
+
+_CJK = re.compile(r'[\u2e80-\u9fff\uf900-\ufaff\u3000-\u303f\uff00-\uffef]')
+
+
+def _char_costs(text):
+    """按字符估算的token数（中文字符和全角标点每个1个token，其他字符每个0.25个token）"""
+    return [1.0 if _CJK.match(ch) else 0.25 for ch in text]
+
+
+def count_tokens(text):
+    """文本的token数"""
+    tokenizer = get_context_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, add_special_tokens=False))
+    return math.ceil(sum(_char_costs(text)))
+
+
+def truncate_to_tokens(text, max_tokens):
+    """截断文本，使token数不超过max_tokens"""
+    if max_tokens <= 0:
+        return ''
+    tokenizer = get_context_tokenizer()
+    if tokenizer is not None:
+        ids = tokenizer.encode(text, add_special_tokens=False)
+        if len(ids) <= max_tokens:
+            return text
+        return tokenizer.decode(ids[:max_tokens])
+    total = 0.0
+    for i, cost in enumerate(_char_costs(text)):
+        total += cost
+        if total > max_tokens:
+            return text[:i]
+    return text
+
+
+def _shingles(text, n=3):
+    text = re.sub(r'\s+', '', text)
+    if len(text) <= n:
+        return {text}
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def _score(result):
+    # 重排过的结果（final_score）排在未重排的结果之前，与rerank_results的顺序一致
+    if 'final_score' in result:
+        return (1, result['final_score'])
+    return (0, retrieval_score(result))
+
+
+def dedupe_results(results, threshold=None):
+    """按分数从高到低排序并去除近似重复的文本块"""
+    threshold = Config.CONTEXT_DEDUP_THRESHOLD if threshold is None else threshold
+    kept, kept_shingles = [], []
+    for result in sorted(results, key=_score, reverse=True):
+        shingles = _shingles(result['text'])
+        if any(len(shingles & other) / len(shingles | other) >= threshold for other in kept_shingles):
+            continue
+        kept.append(result)
+        kept_shingles.append(shingles)
+    return kept
+
+
+def build_context(results, max_tokens=None):
+    """把检索结果装入token预算，返回 (上下文, 装入的结果列表)"""
+    max_tokens = Config.CONTEXT_MAX_TOKENS if max_tokens is None else max_tokens
+    separator_tokens = count_tokens(SEPARATOR)
+    parts, used = [], []
+    remaining = max_tokens
+    for result in dedupe_results(results):
+        if parts:
+            remaining -= separator_tokens
+        tokens = count_tokens(result['text'])
+        if tokens <= remaining:
+            parts.append(result['text'])
+            used.append(result)
+            remaining -= tokens
+            continue
+        if remaining >= MIN_TRUNCATED_TOKENS:
+            parts.append(truncate_to_tokens(result['text'], remaining))
+            used.append(result)
+        break
+    return SEPARATOR.join(parts), used
@@ -0,0 +1,280 @@
+"""列式文档存储
+
+一个存储目录包含：
+- texts.bin      所有文本块的UTF-8编码依次拼接
+- offsets.npy    int64数组，第i个文本块为 texts.bin[offsets[i]:offsets[i+1]]
+- meta_ids.npy   int32数组，第i个文本块的元数据在元数据表中的下标
+- metadata.json  去重后的元数据表（同一文件的所有文本块共用一条）
+- ids.npy        int64数组，每个文本块的稳定ID（合并段、删除文档后保持不变）
+- vectors.npy    float32矩阵，每个文本块的原始向量（重建索引时直接使用，不重新生成）
+
+打开时texts.bin和各个数组都使用mmap，只有元数据表常驻内存；
+读取某条文档时才解码对应的文本。
+"""
+import bisect
+import json
+import mmap
+import os
+from pathlib import Path
+import numpy as np
+
+TEXTS_FILE = 'texts.bin'
+OFFSETS_FILE = 'offsets.npy'
+META_IDS_FILE = 'meta_ids.npy'
+METADATA_FILE = 'metadata.json'
+IDS_FILE = 'ids.npy'
+VECTORS_FILE = 'vectors.npy'
+
+
+def _metadata_key(metadata):
+    return json.dumps(metadata or {}, ensure_ascii=False, sort_keys=True, default=str)
+
+
+class DocumentStore:
+    """只读的列式文档存储，支持len()、下标访问和迭代，元素为 {'text', 'metadata'} 字典"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+        self._offsets = np.load(self.path / OFFSETS_FILE, mmap_mode='r')
+        self._meta_ids = np.load(self.path / META_IDS_FILE, mmap_mode='r')
+        self._ids = np.load(self.path / IDS_FILE, mmap_mode='r')
+        self._vectors = None
+        if (self.path / VECTORS_FILE).exists():
+            self._vectors = np.load(self.path / VECTORS_FILE, mmap_mode='r')
+        with open(self.path / METADATA_FILE, 'r', encoding='utf-8') as f:
+            self._metadata = json.load(f)
+
+        self._texts_file = None
+        self._texts = b''
+        if (self.path / TEXTS_FILE).stat().st_size > 0:
+            # 空文件无法mmap
+            self._texts_file = open(self.path / TEXTS_FILE, 'rb')
+            self._texts = mmap.mmap(self._texts_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self._meta_ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('document index out of range')
+        return {'text': self.text(i), 'metadata': self.metadata(i)}
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def text(self, i):
+        """第i个文本块"""
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return self._texts[start:end].decode('utf-8')
+
+    def metadata(self, i):
+        """第i个文本块的元数据（返回副本，调用方可以自由修改）"""
+        return dict(self._metadata[int(self._meta_ids[i])])
+
+    @property
+    def metadata_table(self):
+        """去重后的元数据表"""
+        return self._metadata
+
+    @property
+    def meta_ids(self):
+        """每个文本块对应的元数据表下标"""
+        return self._meta_ids
+
+    @property
+    def ids(self):
+        """每个文本块的稳定ID"""
+        return self._ids
+
+    @property
+    def vectors(self):
+        """每个文本块的原始向量，未保存向量时为None"""
+        return self._vectors
+
+    def positions_where(self, predicate):
+        """元数据满足predicate的文本块下标
+
+        只对去重后的元数据表逐条求值，再按meta_ids展开，不需要读取文本。
+        """
+        matched = [i for i, metadata in enumerate(self._metadata) if predicate(metadata)]
+        if not matched:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(np.isin(self._meta_ids, matched))
+
+    def resident_bytes(self):
+        """常驻内存的估算大小（不含按需换入的mmap页）"""
+        return (self.path / METADATA_FILE).stat().st_size
+
+    def close(self):
+        """释放mmap（Windows下删除或替换文件前必须先关闭）"""
+        if self._texts_file is not None:
+            self._texts.close()
+            self._texts_file.close()
+            self._texts_file = None
+        self._texts = b''
+        self._offsets = None
+        self._meta_ids = None
+        self._ids = None
+        self._vectors = None
+
+    @staticmethod
+    def write_vectors(path, vectors):
+        """写入（或补写）存储目录中的向量文件"""
+        path = Path(path)
+        tmp_file = path / (VECTORS_FILE + '.tmp')
+        with open(tmp_file, 'wb') as f:
+            np.save(f, np.ascontiguousarray(vectors, dtype=np.float32))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, path / VECTORS_FILE)
+
+    @staticmethod
+    def write(path, documents, ids, vectors=None):
+        """把文档写入存储目录（流式写入，不需要把全部文本载入内存）
+
+        documents: 可迭代的 {'text', 'metadata'} 字典（也可以是另一个DocumentStore）
+        ids: 与documents一一对应的文本块ID
+        vectors: 与documents一一对应的向量矩阵（可选）
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+
+        offsets = [0]
+        meta_ids = []
+        metadata_table = []
+        metadata_index = {}
+
+        with open(path / TEXTS_FILE, 'wb') as f:
+            for doc in documents:
+                data = (doc.get('text') or '').encode('utf-8')
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+
+                metadata = doc.get('metadata') or {}
+                key = _metadata_key(metadata)
+                if key not in metadata_index:
+                    metadata_index[key] = len(metadata_table)
+                    metadata_table.append(metadata)
+                meta_ids.append(metadata_index[key])
+            f.flush()
+            os.fsync(f.fileno())
+
+        np.save(path / OFFSETS_FILE, np.asarray(offsets, dtype=np.int64))
+        np.save(path / META_IDS_FILE, np.asarray(meta_ids, dtype=np.int32))
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) != len(meta_ids):
+            raise ValueError(f'ids数量({len(ids)})与文档数量({len(meta_ids)})不一致')
+        np.save(path / IDS_FILE, ids)
+        if vectors is not None:
+            if len(vectors) != len(meta_ids):
+                raise ValueError(f'向量数量({len(vectors)})与文档数量({len(meta_ids)})不一致')
+            DocumentStore.write_vectors(path, vectors)
+        with open(path / METADATA_FILE, 'w', encoding='utf-8') as f:
+            json.dump(metadata_table, f, ensure_ascii=False, default=str)
+
+        return DocumentStore(path)
+
+
+class SegmentedDocuments:
+    """把多个DocumentStore（段）按顺序拼接成一个只读序列，下标在各段之间连续编号"""
+
+    def __init__(self, stores=()):
+        self.stores = list(stores)
+        self._starts = [0]
+        for store in self.stores:
+            self._starts.append(self._starts[-1] + len(store))
+
+    def __len__(self):
+        return self._starts[-1]
+
+    def _locate(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('document index out of range')
+        segment = bisect.bisect_right(self._starts, i) - 1
+        return self.stores[segment], i - self._starts[segment]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        store, local = self._locate(i)
+        return store[local]
+
+    def __iter__(self):
+        for store in self.stores:
+            yield from store
+
+    def text(self, i):
+        """第i个文本块"""
+        store, local = self._locate(i)
+        return store.text(local)
+
+    def metadata(self, i):
+        """第i个文本块的元数据"""
+        store, local = self._locate(i)
+        return store.metadata(local)
+
+    @property
+    def ids(self):
+        """所有文本块的稳定ID（按下标顺序）"""
+        if not self.stores:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([np.asarray(store.ids) for store in self.stores])
+
+    def vectors(self):
+        """所有文本块的向量（按下标顺序拼接），有段未保存向量时返回None"""
+        if not self.stores or any(store.vectors is None for store in self.stores):
+            return None
+        return np.concatenate([store.vectors for store in self.stores])
+
+    def vectors_at(self, positions):
+        """指定下标的文本块的向量（只读取这些行）"""
+        rows = [self._locate(int(i)) for i in positions]
+        if not rows:
+            return np.zeros((0, 0), dtype='float32')
+        return np.stack([store.vectors[local] for store, local in rows])
+
+    def positions_where(self, predicate):
+        """元数据满足predicate的文本块下标（全局编号）"""
+        positions = [
+            store.positions_where(predicate) + start
+            for store, start in zip(self.stores, self._starts)
+        ]
+        if not positions:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(positions)
+
+    def resident_bytes(self):
+        """常驻内存的估算大小"""
+        return sum(store.resident_bytes() for store in self.stores)
+
+
+class DocumentSubset:
+    """文档序列按给定下标取出的子集视图（例如排除已删除的文本块）"""
+
+    def __init__(self, documents, positions):
+        self.documents = documents
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self.documents[int(self.positions[i])]
+
+    def __iter__(self):
+        for position in self.positions:
+            yield self.documents[int(position)]
+
+    def resident_bytes(self):
+        """常驻内存的估算大小"""
+        return self.documents.resident_bytes() + self.positions.nbytes
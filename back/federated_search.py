@@ -0,0 +1,118 @@
+"""跨知识库并行搜索
+
+各知识库在线程池中并行搜索（FAISS搜索时释放GIL），共用同一个查询向量
+（查询向量在第一个需要它的知识库中生成并缓存，关键词快速路径命中时不生成）；
+每个知识库返回按召回分数排序的前k条，用堆合并后统一重排一次，
+总耗时取决于最慢的知识库而不是所有知识库之和。
+
+统一存储模式下所有知识库共用一个索引，每个知识库同样单独搜索（按各自分区的位图），
+保证每个知识库都取回自己的前k条，不会被结果多的知识库挤出候选集。
+"""
+import heapq
+import itertools
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from config import Config
+from kb_pool import get_knowledge_base, physical_index_path
+from knowledge_base import rerank_results, retrieval_score
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=Config.KB_SEARCH_WORKERS, thread_name_prefix='kb-search')
+
+
+def _search_one(kb_name, query, query_embedding, top_k, similarity_threshold, metadata_filter=None):
+    """搜索单个知识库（不重排），结果标记所属知识库"""
+    kb = get_knowledge_base(kb_name)
+    if kb.get_stats()['total_documents'] == 0:
+        logger.warning(f"知识库 {kb_name} 为空，没有可搜索的内容")
+        return []
+
+    results = kb.search(
+        query, top_k=top_k, similarity_threshold=similarity_threshold,
+        query_embedding=query_embedding, rerank=False, metadata_filter=metadata_filter
+    )
+    for result in results:
+        result['kb_name'] = kb_name
+    logger.info(f"知识库 {kb_name} 搜索 '{query}' 找到 {len(results)} 条结果")
+    return results
+
+
+def iter_kb_results(query, kb_names, top_k=10, similarity_threshold=0.05, query_embedding=None,
+                    metadata_filter=None):
+    """并行搜索各知识库，按完成顺序逐个产出 (知识库名称, 结果列表)
+
+    结果未重排，按相似度降序；搜索失败的知识库产出空列表。
+    metadata_filter: 元数据过滤条件，对每个知识库都生效
+    """
+    kb_names = list(dict.fromkeys(kb_names))
+
+    # 统一存储模式下get_knowledge_base返回分区视图，搜索只在该知识库的分区内进行
+    futures = {
+        _executor.submit(
+            _search_one, kb_name, query, query_embedding, top_k, similarity_threshold, metadata_filter
+        ): kb_name
+        for kb_name in kb_names
+    }
+    for future in as_completed(futures):
+        kb_name = futures[future]
+        try:
+            results = future.result()
+        except Exception as e:
+            logger.error(f"搜索知识库 {kb_name} 失败: {e}", exc_info=True)
+            results = []
+        yield kb_name, results
+
+
+def merge_results(results_lists, limit=None):
+    """用堆合并多个按召回分数降序排列的结果列表，取前limit条（None为全部）"""
+    merged = heapq.merge(*results_lists, key=lambda result: -retrieval_score(result))
+    return list(itertools.islice(merged, limit))
+
+
+def rerank_merged(query, results):
+    """对合并后的跨知识库结果统一重排一次（重排分数缓存与单个知识库搜索共用）
+
+    全部结果都来自关键词快速路径时不调用重排模型。
+    """
+    if all(result.get('retrieval') == 'lexical' for result in results):
+        return results
+    rerank_results([query], [results], lambda result: str(Path(physical_index_path(result['kb_name']))))
+    return results
+
+
+def iter_federated_search(query, kb_names, top_k=10, similarity_threshold=0.05, limit=None, metadata_filter=None):
+    """逐步产出跨知识库搜索的过程，参数同federated_search
+
+    每个知识库完成时产出 ('kb', 知识库名称, 该库结果)（未重排），
+    最后产出 ('merged', 合并重排后的结果列表, {知识库名称: 结果数})。
+    """
+    results_by_kb = {}
+    for kb_name, results in iter_kb_results(
+        query, kb_names, top_k, similarity_threshold, metadata_filter=metadata_filter
+    ):
+        results_by_kb[kb_name] = results
+        yield 'kb', kb_name, results
+
+    merged = merge_results(results_by_kb.values(), limit)
+    rerank_merged(query, merged)
+
+    counts = {kb_name: len(results_by_kb.get(kb_name, [])) for kb_name in kb_names}
+    logger.info(f"跨知识库搜索完成: 查询='{query}', 知识库={list(kb_names)}, 合并结果数={len(merged)}")
+    yield 'merged', merged, counts
+
+
+def federated_search(query, kb_names, top_k=10, similarity_threshold=0.05, limit=None, metadata_filter=None):
+    """跨知识库搜索：并行检索、堆合并、统一重排
+
+    top_k: 每个知识库最多取回的结果数
+    limit: 合并后最多保留的结果数（None为全部）
+    metadata_filter: 元数据过滤条件（见metadata_filter.py）
+    返回 (结果列表, {知识库名称: 结果数})
+    """
+    for event in iter_federated_search(query, kb_names, top_k, similarity_threshold, limit, metadata_filter):
+        pass
+    _, merged, counts = event
+    return merged, counts
@@ -0,0 +1,182 @@
+"""知识库实例池：按索引路径缓存已加载的KnowledgeBase，LRU淘汰"""
+import atexit
+import threading
+import logging
+import weakref
+from collections import OrderedDict
+from pathlib import Path
+from config import Config
+from knowledge_base import KnowledgeBase, KnowledgeBasePartition
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# 统一存储的索引目录，不在 faiss_index_<名称> 的命名空间内，不会与名为unified的知识库冲突
+UNIFIED_INDEX_PATH = 'instance/unified_index'
+
+
+def kb_index_path(kb_name):
+    """知识库名称对应的索引目录（分开存储模式）"""
+    return f'instance/faiss_index_{kb_name}'
+
+
+def is_unified():
+    """是否为统一存储模式"""
+    return Config.KB_STORAGE_MODE == 'unified'
+
+
+def physical_index_path(kb_name):
+    """知识库实际所在的索引目录"""
+    return UNIFIED_INDEX_PATH if is_unified() else kb_index_path(kb_name)
+
+
+class KnowledgeBasePool:
+    """已加载知识库的有界池
+
+    按数量和估算内存两个维度做LRU淘汰；每次取用时检查磁盘版本，
+    磁盘上的索引被其他实例修改过时在原实例上重新加载。
+    同一路径只有一个实例：被淘汰但仍被调用方引用的实例再次取用时直接复用，
+    不会为仍在使用的路径创建第二个写入实例。
+    """
+
+    def __init__(self, max_items=8, max_bytes=1024 * 1024 * 1024):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # 索引绝对路径 -> KnowledgeBase
+        self._live = weakref.WeakValueDictionary()  # 索引绝对路径 -> 仍被引用的实例（含已淘汰的）
+        self._lock = threading.Lock()
+        self._path_locks = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(db_path):
+        return str(Path(db_path).resolve())
+
+    def get(self, db_path):
+        """获取知识库实例，未加载或已过期时从磁盘加载"""
+        key = self._key(db_path)
+
+        with self._lock:
+            kb = self._entries.get(key)
+            if kb is not None and not kb.is_stale():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return kb
+            path_lock = self._path_locks.setdefault(key, threading.Lock())
+
+        # 同一路径只加载一次，不同路径的加载互不阻塞
+        with path_lock:
+            with self._lock:
+                kb = self._entries.get(key) or self._live.get(key)
+
+            loaded = kb is None
+            if loaded:
+                logger.info(f"知识库池未命中，加载知识库: {db_path}")
+                kb = KnowledgeBase(db_path=db_path)
+            elif kb.is_stale():
+                kb.refresh()
+
+            with self._lock:
+                if loaded:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                self._entries[key] = kb
+                self._entries.move_to_end(key)
+                self._live[key] = kb
+                self._evict()
+            return kb
+
+    def _evict(self):
+        """淘汰最久未使用的实例，直到数量和内存都在限制内（至少保留最新的一个）"""
+        total_bytes = sum(kb.memory_bytes() for kb in self._entries.values())
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_items or total_bytes > self.max_bytes
+        ):
+            key, kb = self._entries.popitem(last=False)
+            total_bytes -= kb.memory_bytes()
+            logger.info(f"知识库池淘汰: {key}")
+
+    def invalidate(self, db_path):
+        """移除指定路径的实例（例如索引目录被删除后）"""
+        with self._lock:
+            self._entries.pop(self._key(db_path), None)
+            self._live.pop(self._key(db_path), None)
+
+    def clear(self):
+        """清空池"""
+        with self._lock:
+            self._entries.clear()
+            self._live.clear()
+
+    def close(self):
+        """等待所有仍在使用的实例的后台维护结束并清空池（进程退出时调用）"""
+        with self._lock:
+            instances = list(self._live.values())
+            self._entries.clear()
+            self._live.clear()
+        for kb in instances:
+            kb.close()
+
+    def get_stats(self):
+        """池统计信息"""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_items': self.max_items,
+                'memory_bytes': sum(kb.memory_bytes() for kb in self._entries.values()),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+kb_pool = KnowledgeBasePool(
+    max_items=Config.KB_POOL_MAX_ITEMS,
+    max_bytes=Config.KB_POOL_MAX_MB * 1024 * 1024
+)
+# 退出前等待后台的段合并、索引训练完成（后台线程为守护线程，不等待会在写入中途被终止）
+atexit.register(kb_pool.close)
+
+
+_migrated = set()
+_migrate_lock = threading.Lock()
+
+
+def _migrate_to_unified(kb, kb_name):
+    """把分开存储的知识库导入统一存储（只在该分区为空时执行一次，复用已保存的向量）
+
+    导入失败时不记为已导入，下次访问该知识库时重试。
+    """
+    with _migrate_lock:
+        if kb_name in _migrated:
+            return
+        source_path = Path(kb_index_path(kb_name))
+        if source_path.exists() and len(kb.partition_documents(kb_name)) == 0:
+            try:
+                count = kb.import_documents(kb_pool.get(str(source_path)), partition=kb_name)
+                logger.info(f"知识库 {kb_name} 已导入统一存储: {count} 个文档块")
+            except Exception as e:
+                logger.error(f"知识库 {kb_name} 导入统一存储失败，下次访问时重试: {e}", exc_info=True)
+                return
+        _migrated.add(kb_name)
+
+
+def get_unified_knowledge_base():
+    """统一存储模式下所有知识库共用的物理知识库"""
+    return kb_pool.get(UNIFIED_INDEX_PATH)
+
+
+def get_knowledge_base(kb_name):
+    """从全局池获取指定名称的知识库
+
+    统一存储模式下返回共用索引中该知识库分区的视图，
+    首次访问时把原有的分开存储数据导入统一存储。
+    """
+    if not is_unified():
+        return kb_pool.get(kb_index_path(kb_name))
+    kb = get_unified_knowledge_base()
+    _migrate_to_unified(kb, kb_name)
+    return KnowledgeBasePartition(kb, kb_name)
@@ -1,22 +1,240 @@
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer, CrossEncoder
+from sentence_transformers import CrossEncoder
 import pickle
 import os
+import json
+import shutil
 from pathlib import Path
 # 使用sentence-transformers直接实现，不依赖langchain
 import logging
-
-# 尝试导入win32api（Windows系统）
-try:
-    import win32api
-    HAS_WIN32API = True
-except ImportError:
-    HAS_WIN32API = False
+import threading
+import time
+from model_registry import get_embedding_model, get_rerank_model
+from document_store import DocumentStore, SegmentedDocuments, DocumentSubset
+from metadata_filter import MetadataFilter, AttributeIndex
+from lexical_index import SegmentLexicon, LexicalIndex, query_terms, is_decisive
+import ann_index
+from lru_cache import LRUCache
+from single_flight import SingleFlight, Abandoned
+from config import Config
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+MANIFEST_FILE = 'manifest.json'
+# 提交时清单被其他进程更新，重新加载后重试的次数
+COMMIT_RETRIES = 3
+# 统一存储模式下标记文本块所属知识库（分区）的元数据字段
+PARTITION_FIELD = 'kb_name'
+
+# 重排分数缓存：(重排模型, 知识库路径, 文本块ID, 查询) -> 分数，进程内所有知识库共享
+_rerank_cache = LRUCache(Config.KB_RERANK_CACHE_SIZE)
+# 查询向量缓存：(嵌入模型, 规范化后的查询) -> 归一化向量，进程内所有知识库共享
+_query_embedding_cache = LRUCache(Config.KB_QUERY_CACHE_SIZE)
+# 未命中缓存的查询按缓存键合并：多个知识库并行搜索同一查询时只编码一次，不同查询可以同时编码
+_encode_flights = SingleFlight()
+# 各索引目录的写锁：进程内指向同一目录的所有实例共用，提交前的清单版本检查在锁内进行
+_write_locks = {}
+_write_locks_lock = threading.Lock()
+
+
+class ManifestConflict(Exception):
+    """提交时磁盘上的清单版本与本实例加载的版本不一致（被其他进程修改）"""
+
+
+def _write_lock(path):
+    """索引目录对应的写锁（按绝对路径共享）"""
+    key = str(Path(path).resolve())
+    with _write_locks_lock:
+        return _write_locks.setdefault(key, threading.RLock())
+
+
+def _write_faiss_index(index, path):
+    """写入FAISS索引文件
+
+    先序列化再由Python写文件，避免faiss.write_index在Windows下无法处理中文路径。
+    """
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(faiss.serialize_index(index).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _read_faiss_index(path):
+    """读取FAISS索引文件（同样绕开faiss对路径编码的限制）"""
+    return faiss.deserialize_index(np.fromfile(str(path), dtype=np.uint8))
+
+
+def _normalize(vectors):
+    """返回L2归一化后的向量副本（归一化向量的内积即余弦相似度）"""
+    vectors = np.array(vectors, dtype='float32', order='C', copy=True)
+    if len(vectors) > 0:
+        faiss.normalize_L2(vectors)
+    return vectors
+
+
+def _normalize_query(query):
+    """查询缓存键：合并多余空白"""
+    return ' '.join(str(query).split())
+
+
+def encode_queries(queries, model_name=None):
+    """生成查询向量（L2归一化），同一查询在进程内只编码一次，多个知识库共享
+    
+    未命中缓存的查询合并为一次编码；其他线程正在编码的相同查询等待其结果，不同查询互不等待。
+    model_name: 嵌入模型，默认为当前配置的模型（重新生成向量完成前，知识库用其原模型编码查询）
+    """
+    model_name = model_name or Config.EMBEDDING_MODEL_NAME
+    keys = [(model_name, _normalize_query(query)) for query in queries]
+    vectors = {key: _query_embedding_cache.get(key) for key in keys}
+    missing = [key for key, vector in vectors.items() if vector is None]
+    while missing:
+        # 本线程负责编码的键合并为一次编码；其他线程正在编码的键等待其结果
+        leading = []
+        waiting = []
+        for key in missing:
+            future, leader = _encode_flights.begin(key)
+            if not leader:
+                waiting.append((key, future))
+                continue
+            # 登记之前其他线程可能刚编码完成同一查询
+            vector = _query_embedding_cache.get(key)
+            if vector is None:
+                leading.append((key, future))
+            else:
+                vectors[key] = vector
+                _encode_flights.finish(key, future, vector)
+        if leading:
+            try:
+                embeddings = get_embedding_model(model_name).encode(
+                    [query for (_, query), _ in leading], show_progress_bar=False, batch_size=32
+                )
+            except BaseException as e:
+                error = e if isinstance(e, Exception) else Abandoned()
+                for key, future in leading:
+                    _encode_flights.finish(key, future, error=error)
+                raise
+            # 先完成自己负责的键再等待其他线程，避免互相等待
+            for (key, future), vector in zip(leading, _normalize(embeddings)):
+                vector.setflags(write=False)
+                _query_embedding_cache.put(key, vector)
+                vectors[key] = vector
+                _encode_flights.finish(key, future, vector)
+        missing = []
+        for key, future in waiting:
+            try:
+                vectors[key] = future.result()
+            except Abandoned:
+                # 负责编码的线程没有完成，下一轮重新登记
+                missing.append(key)
+    vectors = [vectors[key] for key in keys]
+    if not vectors:
+        return np.zeros((0, 0), dtype='float32')
+    return np.stack(vectors)
+
+
+def retrieval_score(result):
+    """召回阶段的排序分数：混合检索的结果为RRF融合分数，否则为余弦相似度"""
+    return result.get('fused_score', result.get('similarity', 0))
+
+
+def _rerank_scores(rerank_model, queries, texts):
+    """为 (queries[i], texts[i]) 逐对打分"""
+    if isinstance(rerank_model, CrossEncoder):
+        # CrossEncoder直接接受(query, document)对，返回相关性分数
+        return np.asarray(rerank_model.predict(list(zip(queries, texts)))).reshape(-1)
+    
+    # SentenceTransformer：相同查询只编码一次，余弦相似度作为重排分数
+    unique_queries = list(dict.fromkeys(queries))
+    query_embs = _normalize(rerank_model.encode(unique_queries))
+    doc_embs = _normalize(rerank_model.encode(list(texts)))
+    owners = [unique_queries.index(query) for query in queries]
+    return np.einsum('ij,ij->i', query_embs[owners], doc_embs)
+
+
+def rerank_results(queries, results_list, cache_scope):
+    """用重排模型为各查询的结果重新打分并排序（原地修改results_list中的各个列表）
+    
+    每个查询只重排召回分数（见retrieval_score）最高的KB_RERANK_DEPTH条；已缓存的分数直接使用，
+    其余按召回分数从高到低分批打分，超出KB_RERANK_BUDGET_MS后停止。没有重排分数的结果按召回分数排在重排结果之后。
+    
+    cache_scope: 函数，返回结果所属知识库的标识，与文本块ID一起作为重排分数缓存的键
+    """
+    for results in results_list:
+        results.sort(key=retrieval_score, reverse=True)
+    
+    rerank_model = get_rerank_model()
+    depth = Config.KB_RERANK_DEPTH
+    if not rerank_model or depth <= 0:
+        logger.info("📊 未使用重排模型，按相似度排序")
+        return
+    
+    # 收集需要打分的 (查询, 结果)，缓存命中的直接取分数
+    pending = []
+    for i, results in enumerate(results_list):
+        for result in results[:depth]:
+            key = (Config.RERANK_MODEL_NAME, cache_scope(result), result['chunk_id'], queries[i])
+            rerank_score = _rerank_cache.get(key)
+            if rerank_score is None:
+                pending.append((queries[i], result, key))
+            else:
+                result['rerank_score'] = rerank_score
+    cached_count = sum(min(len(results), depth) for results in results_list) - len(pending)
+    logger.info(f"🔄 开始重排序，待打分: {len(pending)}，缓存命中: {cached_count}")
+    
+    # 召回分数高的先打分，时间预算用完时优先保证排在前面的结果
+    pending.sort(key=lambda item: retrieval_score(item[1]), reverse=True)
+    budget = Config.KB_RERANK_BUDGET_MS / 1000
+    deadline = time.monotonic() + budget if budget > 0 else None
+    batch_size = max(1, Config.KB_RERANK_BATCH_SIZE)
+    scored_count = 0
+    try:
+        for start in range(0, len(pending), batch_size):
+            if start > 0 and deadline is not None and time.monotonic() > deadline:
+                logger.info(f"⏱️ 重排超出时间预算，剩余 {len(pending) - start} 条按相似度排序")
+                break
+            batch = pending[start:start + batch_size]
+            rerank_scores = _rerank_scores(
+                rerank_model, [query for query, _, _ in batch], [result['text'] for _, result, _ in batch]
+            )
+            for (_, result, key), rerank_score in zip(batch, rerank_scores):
+                result['rerank_score'] = float(rerank_score)
+                _rerank_cache.put(key, float(rerank_score))
+            scored_count += len(batch)
+    except Exception as e:
+        logger.warning(f"重排序失败: {e}，未打分的结果使用原始相似度排序")
+        import traceback
+        traceback.print_exc()
+    
+    for results in results_list:
+        reranked = []
+        rest = []
+        for result in results:
+            if 'rerank_score' in result:
+                # 使用重排分数和原始相似度的加权平均（重排分数权重更高）
+                # 关键词快速路径的结果可能没有余弦相似度（见_lexical_results），此时只用重排分数
+                similarity = result.get('similarity')
+                if similarity is None:
+                    result['final_score'] = result['rerank_score']
+                else:
+                    result['final_score'] = 0.6 * result['rerank_score'] + 0.4 * similarity
+                reranked.append(result)
+            else:
+                rest.append(result)
+        # 按最终分数排序
+        reranked.sort(key=lambda x: x['final_score'], reverse=True)
+        results[:] = reranked + rest
+    
+    logger.info(f"✅ 重排序完成，打分 {scored_count} 条")
+    if results_list and results_list[0]:
+        # 显示第一个查询前3条结果的分数
+        for i, r in enumerate(results_list[0][:3]):
+            logger.info(f"  排名 {i+1}: similarity={r.get('similarity') or 0:.4f}, final_score={r.get('final_score', 0):.4f}")
+
 
 class SimpleTextSplitter:
     """简单的文本分割器"""
@@ -56,30 +274,92 @@ class SimpleTextSplitter:
         return chunks if chunks else [text]
 
 
+class IndexState:
+    """某一时刻的搜索状态：文档存储、文本块ID、FAISS索引及增量向量、删除标记及有效位图、元数据属性数组
+    
+    创建后不再修改。写操作构造新的状态后一次赋值给KnowledgeBase的_state，搜索开始时取一次引用并只读这个对象，
+    文档存储、索引和位图始终来自同一时刻，不会出现新文档存储配旧索引或旧位图的情况。
+    
+    FAISS索引包含前index.ntotal个文本块的向量，之后追加的文本块的向量按写入批次保存在delta中（已归一化），
+    搜索时暴力计算；追加只需构造新的delta，不复制已有索引。
+    """
+    
+    def __init__(self, store, index, tombstones, attributes=None, delta=()):
+        self.store = store
+        self.ids = store.ids
+        self.index = index
+        self.delta = tuple(delta)
+        self.indexed = index.ntotal if index is not None else 0
+        self.delta_count = sum(len(vectors) for vectors in self.delta)
+        # 删除标记只保留仍在段中的文本块ID
+        tombstones = np.asarray(tombstones, dtype=np.int64)
+        self.tombstones = tombstones[np.isin(tombstones, self.ids)]
+        self.deleted = np.isin(self.ids, self.tombstones)
+        # 位图中第i位为1表示FAISS中第i个向量有效（IDSelectorBitmap的位序为小端），没有删除时为None
+        self.alive_bitmap = np.packbits(~self.deleted, bitorder='little') if self.deleted.any() else None
+        self.attributes = attributes if attributes is not None else AttributeIndex(store)
+        for array in (self.ids, self.tombstones, self.deleted, self.alive_bitmap):
+            if isinstance(array, np.ndarray) and array.flags.owndata:
+                array.setflags(write=False)
+    
+    def with_tombstones(self, tombstones):
+        """替换删除标记后的新状态（文档存储、索引和属性数组不变）"""
+        return IndexState(self.store, self.index, tombstones, self.attributes, self.delta)
+    
+    def with_index(self, index, delta=()):
+        """替换索引（及其后的增量向量）后的新状态，向量位置不变"""
+        return IndexState(self.store, index, self.tombstones, self.attributes, delta)
+    
+    def search_delta(self, query_embeddings, k, alive=None):
+        """在增量向量中暴力搜索，返回每个查询的 (相似度数组, 向量位置数组)，按相似度降序
+        
+        alive: 全部文本块的有效掩码（None表示全部有效）
+        """
+        empty = (np.zeros(0, dtype='float32'), np.zeros(0, dtype=np.int64))
+        if self.delta_count == 0:
+            return [empty] * len(query_embeddings)
+        scores = np.concatenate([query_embeddings @ vectors.T for vectors in self.delta], axis=1)
+        positions = np.arange(self.indexed, self.indexed + self.delta_count, dtype=np.int64)
+        if alive is not None:
+            keep = alive[self.indexed:self.indexed + self.delta_count]
+            scores, positions = scores[:, keep], positions[keep]
+        hits = []
+        for query_scores in scores:
+            order = np.argsort(-query_scores, kind='stable')[:k]
+            hits.append((query_scores[order], positions[order]))
+        return hits
+    
+    def live_count(self):
+        """有效文本块数"""
+        return len(self.store) - int(self.deleted.sum())
+    
+    def partition_mask(self, partitions):
+        """属于给定分区的文本块位置掩码"""
+        return self.attributes.mask(MetadataFilter({PARTITION_FIELD: list(partitions)}))
+    
+    def selection(self, partitions=None, metadata_filter=None):
+        """搜索范围，返回 (有效位图, 有效数量)，位图为None表示全部有效
+        
+        分区和元数据过滤条件都转换为位置掩码，与有效位图合并后作为IDSelector在ANN搜索中生效。
+        """
+        if not partitions and not metadata_filter:
+            return self.alive_bitmap, self.live_count()
+        
+        count = len(self.store)
+        mask = ~self.deleted
+        if partitions:
+            mask &= self.partition_mask(partitions)[:count]
+        if metadata_filter:
+            mask &= self.attributes.mask(metadata_filter)[:count]
+        return np.packbits(mask, bitorder='little'), int(mask.sum())
+
+
 class KnowledgeBase:
     def __init__(self, db_path='instance/faiss_index'):
         self.db_path = Path(db_path)
         self.db_path.mkdir(parents=True, exist_ok=True)
         
-        # 嵌入模型
-        logger.info("加载嵌入模型: all-MiniLM-L6-v2")
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-        
-        # 重排模型
-        logger.info("加载重排模型: cross-encoder/ms-marco-MiniLM-L-6-v2")
-        try:
-            from sentence_transformers import CrossEncoder
-            self.rerank_model = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
-            logger.info("重排模型加载成功")
-        except Exception as e:
-            logger.warning(f"重排模型加载失败: {e}，尝试使用sentence-transformer版本")
-            try:
-                # 如果cross-encoder失败，尝试sentence-transformer版本
-                self.rerank_model = SentenceTransformer('sentence-transformers/ms-marco-MiniLM-L-6-v2')
-                logger.info("使用sentence-transformer版本的重排模型")
-            except Exception as e2:
-                logger.warning(f"sentence-transformer版本也加载失败: {e2}，使用嵌入模型代替")
-                self.rerank_model = None
+        # 嵌入模型和重排模型由model_registry在进程内共享，首次使用时才加载
         
         # 文本分割器
         self.text_splitter = SimpleTextSplitter(
@@ -87,258 +367,759 @@ class KnowledgeBase:
             chunk_overlap=50
         )
         
-        # 初始化FAISS
-        self.index = None
-        self.documents = []
-        self.load_index()
+        # 写操作锁（同一实例会被知识库池在多个请求线程间共享，指向同一目录的其他实例也使用同一把锁）
+        self._lock = _write_lock(self.db_path)
+        self._compaction_lock = threading.Lock()
+        # 后台维护线程（合并段、训练索引），close时等待结束
+        self._background = []
+        self._background_lock = threading.Lock()
+        self._closed = False
+        
+        # all-MiniLM-L6-v2的维度是384（以清单中记录的为准）
+        self.dimension = 384
+        # 生成已保存向量所用的嵌入模型，与当前配置不一致时需要重新生成向量
+        self._embedding_model_name = Config.EMBEDDING_MODEL_NAME
+        
+        # 索引类型及参数（见ann_index.py），需要训练的类型保存训练好的空索引
+        self._index_type = Config.KB_INDEX_TYPE
+        self._index_params = {}
+        self._trained_index = None
+        self._trained_file = None
+        self._trained_count = 0
+        
+        # 搜索状态（见IndexState，FAISS中的向量编号即文本块在各段中的顺序位置），只整体替换
+        self._state = IndexState(SegmentedDocuments(), None, np.zeros(0, dtype=np.int64))
+        self._segments = []
+        self._manifest_version = 0
+        self._next_segment = 1
+        self._next_chunk_id = 0
+        
+        # 删除标记（已删除文本块的ID，搜索时通过位图排除，合并段时物理清除）保存在_state中，这里是其文件名
+        self._tombstone_file = None
+        # 各段的BM25倒排表（按段目录缓存）及拼接后的索引（段变化时重建）
+        self._lexicons = {}
+        self._lexical = None
+        self._lexical_lock = threading.Lock()
+        # 加载时会清理清单未引用的段，持有写锁避免清理掉其他实例正在写入的段
+        with self._lock:
+            self.load_index()
+            self._loaded_version = self.disk_version()
+    
+    @property
+    def index(self):
+        """当前的FAISS索引"""
+        return self._state.index
+    
+    @property
+    def embedding_model(self):
+        """生成已保存向量所用的嵌入模型（进程内共享；更换模型后重新生成向量完成前仍为原模型）"""
+        return get_embedding_model(self._embedding_model_name)
+    
+    @property
+    def rerank_model(self):
+        """重排模型（进程内共享，加载失败时为None）"""
+        return get_rerank_model()
+    
+    def disk_version(self):
+        """磁盘上索引的版本标识（段目录不可变，只需看清单文件）"""
+        try:
+            stat = (self.db_path / MANIFEST_FILE).stat()
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+    
+    def is_stale(self):
+        """磁盘上的索引是否已被其他实例修改"""
+        return self.disk_version() != self._loaded_version
+    
+    def refresh(self):
+        """在本实例上重新加载其他实例提交的修改（不创建新实例，调用方持有的引用仍然有效）"""
+        with self._lock:
+            self._sync_with_disk()
+            self._loaded_version = self.disk_version()
+    
+    def memory_bytes(self):
+        """估算实例常驻内存（索引 + 元数据表 + ID数组，文本通过mmap按需读取不计入）"""
+        state = self._state
+        delta_bytes = sum(vectors.nbytes for vectors in state.delta)
+        return ann_index.index_bytes(state.index) + delta_bytes + state.store.resident_bytes() + state.ids.nbytes
+    
+    @property
+    def documents(self):
+        """知识库中的有效文档（不含已删除的文本块）"""
+        state = self._state
+        if state.alive_bitmap is None:
+            return state.store
+        return DocumentSubset(state.store, np.flatnonzero(~state.deleted))
+    
+    def _read_manifest(self):
+        """读取清单文件，不存在或损坏时返回None"""
+        manifest_file = self.db_path / MANIFEST_FILE
+        if not manifest_file.exists():
+            return None
+        try:
+            with open(manifest_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"读取清单文件失败: {e}")
+            return None
+    
+    def _disk_manifest_version(self):
+        """磁盘上清单文件记录的版本（没有清单时为0）"""
+        manifest = self._read_manifest()
+        return manifest.get('version', 0) if manifest else 0
+    
+    def _sync_with_disk(self):
+        """写操作前（持有写锁）检查磁盘上的清单版本，被其他实例提交过时先重新加载"""
+        version = self._disk_manifest_version()
+        if version == self._manifest_version:
+            return
+        logger.warning(f"清单已被其他实例更新（版本 {self._manifest_version} -> {version}），重新加载: {self.db_path}")
+        # 不清理未引用的段：本实例的段合并可能正在写入尚未提交的新段
+        self._load_manifest(cleanup=False)
+        self._loaded_version = self.disk_version()
+    
+    def _commit(self, segments, tombstones):
+        """提交新的段列表和删除标记：写入新的标记文件后原子替换清单文件
+        
+        磁盘上的清单版本与本实例加载的版本不一致时抛出ManifestConflict，不覆盖其他实例的提交。
+        """
+        if self._disk_manifest_version() != self._manifest_version:
+            raise ManifestConflict(f"清单已被其他进程更新: {self.db_path}")
+        version = self._manifest_version + 1
+        tombstone_file = None
+        if len(tombstones) > 0:
+            if np.array_equal(tombstones, self._state.tombstones) and self._tombstone_file:
+                tombstone_file = self._tombstone_file
+            else:
+                tombstone_file = f'tombstones_{version:06d}.npy'
+                with open(self.db_path / tombstone_file, 'wb') as f:
+                    np.save(f, tombstones)
+                    f.flush()
+                    os.fsync(f.fileno())
+        
+        manifest = {
+            'version': version,
+            'next_segment': self._next_segment,
+            'next_chunk_id': self._next_chunk_id,
+            'segments': segments,
+            'tombstones': tombstone_file,
+            'embedding_model': self._embedding_model_name,
+            'dimension': self.dimension,
+            'index': {
+                'type': self._index_type,
+                'params': self._index_params,
+                'trained': self._trained_file,
+                'trained_count': self._trained_count,
+            },
+        }
+        manifest_file = self.db_path / MANIFEST_FILE
+        tmp_file = self.db_path / (MANIFEST_FILE + '.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, manifest_file)
+        self._manifest_version = version
+        self._tombstone_file = tombstone_file
+        self._loaded_version = self.disk_version()
+    
+    def _allocate_ids(self, count):
+        """分配count个新的文本块ID"""
+        ids = np.arange(self._next_chunk_id, self._next_chunk_id + count, dtype=np.int64)
+        self._next_chunk_id += count
+        return ids
+    
+    def _write_segment(self, documents, embeddings, ids, lexicon=None):
+        """写入一个新段（文档 + 原始向量 + ID + BM25倒排表），返回段名和文档存储
+        
+        先写到临时目录再整体重命名，未提交到清单的段在下次加载时被清理。
+        lexicon: 已有的倒排表（合并段时由原有各段的倒排表合并得到），不传时对文档分词生成
+        """
+        segment = f'seg_{self._next_segment:06d}'
+        self._next_segment += 1
+        while (self.db_path / segment).exists():
+            # 其他进程写入但尚未提交的段，跳过该段名
+            segment = f'seg_{self._next_segment:06d}'
+            self._next_segment += 1
+        
+        tmp_path = self.db_path / (segment + '.tmp')
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        DocumentStore.write(tmp_path, documents, ids, vectors=embeddings).close()
+        if Config.KB_LEXICAL_ENABLED:
+            if lexicon is None:
+                lexicon = SegmentLexicon.build(doc['text'] for doc in documents)
+            lexicon.write(tmp_path)
+        
+        os.replace(tmp_path, self.db_path / segment)
+        return segment, DocumentStore(self.db_path / segment)
+    
+    def _remove_unused_files(self):
+        """删除清单不再引用的段目录、删除标记和训练索引文件（Windows下仍被映射的目录会删除失败，下次再试）"""
+        referenced = set(self._segments)
+        for path in self.db_path.iterdir():
+            if path.is_dir() and path.name.startswith('seg_') and path.name not in referenced:
+                shutil.rmtree(path, ignore_errors=True)
+            elif (
+                (path.name.startswith('tombstones_') and path.name != self._tombstone_file)
+                or (path.name.startswith('trained_') and path.name != self._trained_file)
+            ):
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+    
+    def _set_tombstones(self, tombstones):
+        """更新删除标记及搜索时使用的有效位图"""
+        self._state = self._state.with_tombstones(tombstones)
+    
+    def _set_index(self, index, delta=()):
+        """替换内存中的索引及其后的增量向量（文档和向量位置不变）"""
+        self._state = self._state.with_index(index, delta)
+    
+    def _set_segments(self, segments, stores, index, tombstones=None, delta=()):
+        """替换内存中的段、文档、索引和增量向量，tombstones默认沿用当前的删除标记"""
+        if tombstones is None:
+            tombstones = self._state.tombstones
+        self._segments = list(segments)
+        self._state = IndexState(SegmentedDocuments(stores), index, tombstones, delta=delta)
+        paths = {str(store.path) for store in stores}
+        self._lexicons = {path: lexicon for path, lexicon in self._lexicons.items() if path in paths}
+        self._lexical = None
     
     def load_index(self):
-        """加载FAISS索引"""
-        index_file = self.db_path / 'index.faiss'
-        docs_file = self.db_path / 'documents.pkl'
+        """加载清单中的所有段，用段中保存的向量组装内存中的FAISS索引"""
+        if not self._load_manifest():
+            return
         
-        logger.info(f"尝试加载索引: index_file={index_file.absolute()}, exists={index_file.exists()}")
-        logger.info(f"尝试加载文档: docs_file={docs_file.absolute()}, exists={docs_file.exists()}")
+        if self._embedding_model_name != Config.EMBEDDING_MODEL_NAME:
+            logger.warning(
+                f"嵌入模型已从 {self._embedding_model_name} 更换为 {Config.EMBEDDING_MODEL_NAME}，"
+                f"在后台重新生成向量，完成前继续使用原模型和原向量"
+            )
+            self._start_background(self._reembed_in_background)
+        self._maybe_schedule_maintenance()
+    
+    def _load_manifest(self, cleanup=True):
+        """按清单加载段和索引，没有清单（新建或旧版格式）时返回False
         
-        # 如果标准路径不存在，尝试查找其他可能的文件名（处理编码问题）
-        if not index_file.exists():
-            # 查找目录下所有.faiss文件
-            faiss_files = list(self.db_path.glob('*.faiss'))
-            logger.info(f"查找.faiss文件: 找到 {len(faiss_files)} 个")
-            if faiss_files:
-                index_file = faiss_files[0]
-                logger.info(f"使用找到的索引文件: {index_file.name}")
+        cleanup: 是否删除清单未引用的段目录和文件
+        """
+        manifest = self._read_manifest()
         
-        if not docs_file.exists():
-            # 查找目录下所有.pkl文件
-            pkl_files = list(self.db_path.glob('*.pkl'))
-            logger.info(f"查找.pkl文件: 找到 {len(pkl_files)} 个")
-            if pkl_files:
-                docs_file = pkl_files[0]
-                logger.info(f"使用找到的文档文件: {docs_file.name}")
+        if manifest is None or 'segments' not in manifest:
+            # 旧版本使用documents.pkl + index.faiss保存，先转换为段格式
+            if not self._migrate_legacy_index():
+                logger.info(f"知识库为空，创建新索引: {self.db_path}")
+                self._create_new_index()
+            return False
         
-        if index_file.exists() and docs_file.exists():
+        self._manifest_version = manifest.get('version', 0)
+        self._next_segment = manifest.get('next_segment', len(manifest['segments']) + 1)
+        self._next_chunk_id = manifest.get('next_chunk_id', 0)
+        self._embedding_model_name = manifest.get('embedding_model', Config.EMBEDDING_MODEL_NAME)
+        self.dimension = manifest.get('dimension', self.dimension)
+        self._tombstone_file = manifest.get('tombstones')
+        if self._tombstone_file:
+            tombstones = np.load(self.db_path / self._tombstone_file)
+        else:
+            tombstones = np.zeros(0, dtype=np.int64)
+        self._load_index_config(manifest.get('index') or {})
+        
+        segments = []
+        stores = []
+        for segment in manifest['segments']:
             try:
-                self.index = faiss.read_index(str(index_file.resolve()))
-                with open(docs_file.resolve(), 'rb') as f:
-                    self.documents = pickle.load(f)
-                logger.info(f"加载索引成功，包含 {len(self.documents)} 条文档")
+                store = DocumentStore(self.db_path / segment)
+                if store.vectors is None or store.vectors.shape != (len(store), self.dimension):
+                    store = self._recover_segment_vectors(segment, store)
             except Exception as e:
-                logger.error(f"加载索引失败: {e}", exc_info=True)
-                # 如果索引文件损坏，尝试从documents.pkl重新生成
-                if docs_file.exists():
-                    logger.info("索引文件损坏，尝试从documents.pkl重新生成索引")
-                    try:
-                        with open(docs_file.resolve(), 'rb') as f:
-                            self.documents = pickle.load(f)
-                        if len(self.documents) > 0:
-                            self._rebuild_index_from_documents()
-                            return
-                    except Exception as e2:
-                        logger.error(f"从documents.pkl重新生成索引失败: {e2}")
-                self._create_new_index()
-        elif docs_file.exists() and not index_file.exists():
-            # 只有documents.pkl，没有index.faiss，尝试重新生成索引
-            logger.warning(f"索引文件不存在，但文档文件存在，尝试重新生成索引")
-            logger.warning(f"目录内容: {list(self.db_path.glob('*'))}")
+                # 文本本身损坏无法恢复，跳过该段（下次提交时从清单中移除）
+                logger.error(f"加载知识库段 {segment} 失败，已跳过: {e}", exc_info=True)
+                continue
+            segments.append(segment)
+            stores.append(store)
+        
+        self._set_segments(segments, stores, self._build_index(SegmentedDocuments(stores).vectors()), tombstones)
+        if cleanup:
+            self._remove_unused_files()
+        logger.info(f"加载索引成功，{len(self._segments)} 个段，包含 {len(self.documents)} 条文档")
+        return True
+    
+    def _load_index_config(self, config):
+        """读取清单中的索引配置及训练好的空索引"""
+        self._index_type = config.get('type', Config.KB_INDEX_TYPE)
+        self._index_params = config.get('params') or {}
+        self._trained_file = config.get('trained')
+        self._trained_count = config.get('trained_count', 0)
+        self._trained_index = None
+        if self._trained_file:
             try:
-                with open(docs_file.resolve(), 'rb') as f:
-                    self.documents = pickle.load(f)
-                if len(self.documents) > 0:
-                    logger.info(f"从 {len(self.documents)} 条文档重新生成索引")
-                    self._rebuild_index_from_documents()
-                else:
-                    logger.warning("文档文件为空，创建新索引")
-                    self._create_new_index()
+                self._trained_index = _read_faiss_index(self.db_path / self._trained_file)
             except Exception as e:
-                logger.error(f"加载documents.pkl失败: {e}")
-                self._create_new_index()
-        else:
-            logger.warning(f"索引文件不存在: index.faiss={index_file.exists()}, documents.pkl={docs_file.exists()}")
-            logger.warning(f"目录内容: {list(self.db_path.glob('*'))}")
-            self._create_new_index()
+                # 训练结果丢失时先用暴力搜索，后台重新训练
+                logger.error(f"读取训练索引失败，将重新训练: {e}")
+            if self._trained_index is not None and self._trained_index.metric_type != faiss.METRIC_INNER_PRODUCT:
+                # 旧版本按L2距离训练的索引不能用于余弦相似度
+                logger.info("训练索引使用L2距离，按内积重新训练")
+                self._trained_index = None
+            if self._trained_index is None:
+                self._trained_file = None
+                self._trained_count = 0
     
-    def _create_new_index(self):
-        """创建新索引"""
-        # all-MiniLM-L6-v2的维度是384
-        dimension = 384
-        self.index = faiss.IndexFlatL2(dimension)
-        self.documents = []
-        logger.info(f"创建新索引，维度: {dimension}")
-    
-    def _rebuild_index_from_documents(self):
-        """从现有文档重新生成索引"""
-        if len(self.documents) == 0:
-            logger.warning("文档为空，无法重新生成索引")
-            self._create_new_index()
-            return
+    def _recover_segment_vectors(self, segment, store):
+        """为缺少向量文件（或向量文件损坏）的段补写向量，返回重新打开的文档存储
         
-        logger.info(f"开始从 {len(self.documents)} 条文档重新生成索引...")
+        优先从旧版段目录中的index.faiss还原向量，都不可用时才重新生成。
+        """
+        vectors = None
+        index_file = self.db_path / segment / 'index.faiss'
+        if index_file.exists():
+            try:
+                segment_index = _read_faiss_index(index_file)
+                if segment_index.ntotal == len(store) > 0 and segment_index.d == self.dimension:
+                    vectors = segment_index.reconstruct_n(0, segment_index.ntotal)
+            except Exception as e:
+                logger.error(f"读取段 {segment} 的旧索引失败: {e}")
         
-        # 创建新索引
-        dimension = 384
-        self.index = faiss.IndexFlatL2(dimension)
+        if vectors is None:
+            if len(store) == 0:
+                vectors = np.zeros((0, self.dimension), dtype='float32')
+            else:
+                logger.warning(f"段 {segment} 没有可用的向量，从文档重新生成 {len(store)} 条向量")
+                vectors = self._encode([store.text(i) for i in range(len(store))])
         
-        # 提取所有文档文本
-        all_texts = [doc.get('text', '') for doc in self.documents]
+        DocumentStore.write_vectors(self.db_path / segment, vectors)
+        if index_file.exists():
+            index_file.unlink()
+        store.close()
+        logger.info(f"已为段 {segment} 补写向量文件")
+        return DocumentStore(self.db_path / segment)
+    
+    def _migrate_legacy_index(self):
+        """把旧版documents.pkl（+ index.faiss）转换为一个段，成功返回True"""
+        docs_file = self.db_path / 'documents.pkl'
+        if not docs_file.exists():
+            # 查找目录下其他.pkl文件（处理编码问题）
+            pkl_files = list(self.db_path.glob('*.pkl'))
+            if not pkl_files:
+                return False
+            docs_file = pkl_files[0]
+            logger.info(f"使用找到的文档文件: {docs_file.name}")
         
-        # 生成向量
-        logger.info("正在生成向量...")
-        embeddings = self.embedding_model.encode(all_texts, show_progress_bar=False, batch_size=32)
-        embeddings = np.array(embeddings).astype('float32')
+        try:
+            with open(docs_file, 'rb') as f:
+                documents = pickle.load(f)
+        except Exception as e:
+            logger.error(f"加载{docs_file.name}失败: {e}")
+            return False
+        
+        logger.info(f"将 {docs_file.name} 中的 {len(documents)} 条文档转换为段格式")
         
-        # 添加到索引
-        logger.info("添加到FAISS索引...")
-        self.index.add(embeddings)
+        # 旧索引完好时直接复用其中的向量
+        embeddings = None
+        index_files = [self.db_path / 'index.faiss'] + list(self.db_path.glob('*.faiss'))
+        for index_file in index_files:
+            if not index_file.exists():
+                continue
+            try:
+                legacy_index = _read_faiss_index(index_file)
+                if legacy_index.ntotal == len(documents):
+                    embeddings = legacy_index.reconstruct_n(0, legacy_index.ntotal)
+                break
+            except Exception as e:
+                logger.error(f"加载旧索引失败: {e}")
+        
+        if embeddings is None:
+            logger.warning("旧索引缺失或与文档不一致，从文档重新生成向量")
+            embeddings = self._encode([doc.get('text', '') for doc in documents])
+        
+        self._replace_all_segments(documents, embeddings, self._allocate_ids(len(documents)))
+        
+        # 保留原文件作为备份，之后不再读取
+        os.replace(docs_file, docs_file.with_name(docs_file.name + '.bak'))
+        for index_file in self.db_path.glob('*.faiss'):
+            os.replace(index_file, index_file.with_name(index_file.name + '.bak'))
+        return True
+    
+    def _create_new_index(self):
+        """创建新索引"""
+        self._set_segments([], [], self._build_index(None))
+        logger.info(f"创建新索引，维度: {self.dimension}")
+    
+    def _build_index(self, vectors):
+        """用给定向量构建内存中的FAISS索引（vectors为None时返回空索引）
+        
+        需要训练的索引类型复制训练好的空索引后加入向量；尚未训练时先使用暴力搜索。
+        """
+        count = 0 if vectors is None else len(vectors)
+        index_type = ann_index.resolve_index_type(self._index_type, count)
+        if self._trained_index is not None:
+            index = faiss.clone_index(self._trained_index)
+        elif index_type in ann_index.TRAINED_INDEX_TYPES:
+            index = faiss.IndexFlatIP(self.dimension)
+        else:
+            index = ann_index.create_index(index_type, self.dimension, count, self._index_params)
+        if count > 0:
+            # 旧版本保存的向量可能未归一化，加入索引前统一归一化
+            index.add(_normalize(vectors))
+        return index
+    
+    def _needs_training(self):
+        """当前向量数下是否需要（重新）训练索引"""
+        count = self._state.live_count()
+        index_type = ann_index.resolve_index_type(self._index_type, count)
+        if index_type not in ann_index.TRAINED_INDEX_TYPES:
+            return False
+        if not ann_index.can_train(index_type, count, self._index_params):
+            return False
+        if self._trained_index is None:
+            return True
+        if ann_index.index_type_of(self._trained_index) != index_type:
+            return True
+        # 没有固定nlist时，数据量增长较多后按新的规模重新训练
+        return (
+            not self._index_params.get('nlist')
+            and count >= self._trained_count * Config.KB_ANN_RETRAIN_GROWTH
+        )
+    
+    def train_index(self):
+        """训练索引（聚类中心/码本）并用全部向量重建，返回是否进行了训练
+        
+        训练在写锁外进行，期间允许继续写入；训练完成后用提交时的全部向量重建索引。
+        """
+        with self._compaction_lock:
+            with self._lock:
+                if not self._needs_training():
+                    return False
+                state = self._state
+                alive = np.flatnonzero(~state.deleted)
+                vectors = _normalize(state.store.vectors()[alive])
+                index_type = ann_index.resolve_index_type(self._index_type, len(alive))
+            
+            logger.info(f"开始训练 {index_type} 索引，训练向量 {len(vectors)} 条: {self.db_path}")
+            trained = ann_index.create_index(index_type, self.dimension, len(vectors), self._index_params)
+            ann_index.train_index(trained, vectors)
+            
+            with self._lock:
+                self._sync_with_disk()
+                trained_file = f'trained_{self._manifest_version + 1:06d}.faiss'
+                _write_faiss_index(trained, self.db_path / trained_file)
+                self._trained_index = trained
+                self._trained_file = trained_file
+                self._trained_count = len(vectors)
+                self._commit(self._segments, self._state.tombstones)
+                self._set_index(self._build_index(self._state.store.vectors()))
+                self._remove_unused_files()
+            logger.info(f"索引训练完成: {self.db_path}，类型 {index_type}")
+            return True
+    
+    def set_index_type(self, index_type, **params):
+        """设置知识库的索引类型及参数（nlist、hnsw_m、pq_m、nprobe、ef_search），并用保存的向量重建索引"""
+        if index_type not in ann_index.INDEX_TYPES:
+            raise ValueError(f"不支持的索引类型: {index_type}，可选: {', '.join(ann_index.INDEX_TYPES)}")
+        with self._compaction_lock, self._lock:
+            self._sync_with_disk()
+            self._index_type = index_type
+            self._index_params = {key: value for key, value in params.items() if value is not None}
+            self._trained_index = None
+            self._trained_file = None
+            self._trained_count = 0
+            self._commit(self._segments, self._state.tombstones)
+            self._set_index(self._build_index(self._state.store.vectors()))
+            self._remove_unused_files()
+        logger.info(f"知识库索引类型设置为 {index_type}: {self.db_path}")
+        if not self.train_index() and index_type in ann_index.TRAINED_INDEX_TYPES:
+            logger.info("文档数不足以训练该类型的索引，暂时使用暴力搜索，文档增加后自动训练")
+    
+    def _encode(self, texts, model_name=None):
+        """批量生成向量（L2归一化），model_name默认为知识库当前使用的嵌入模型"""
+        if not texts:
+            return np.zeros((0, self.dimension), dtype='float32')
+        model = get_embedding_model(model_name) if model_name else self.embedding_model
+        embeddings = model.encode(texts, show_progress_bar=False, batch_size=32)
+        return _normalize(embeddings)
+    
+    def _replace_all_segments(self, documents, embeddings, ids):
+        """用一个新段替换全部现有段（迁移和重新生成向量时使用）"""
+        segment, store = self._write_segment(documents, embeddings, ids)
+        remaining = self._state.tombstones[np.isin(self._state.tombstones, ids)]
+        self._commit([segment], remaining)
+        self._set_segments([segment], [store], self._build_index(embeddings), remaining)
+        self._remove_unused_files()
+    
+    def rebuild_index(self):
+        """用段中保存的向量重建内存索引（不重新生成向量，索引损坏或更换索引类型时使用）"""
+        with self._lock:
+            index = self._build_index(self._state.store.vectors())
+            self._set_index(index)
+            logger.info(f"已从保存的向量重建索引，包含 {index.ntotal} 条向量")
+    
+    def reembed(self):
+        """用当前配置的嵌入模型重新生成全部向量，返回是否完成替换
         
-        # 保存索引
-        logger.info("保存重新生成的索引...")
+        只有更换嵌入模型时才需要调用；同时清除已删除的文本块。向量在写锁外生成，期间继续用原模型和原向量
+        提供搜索和写入；生成期间新写入的段在提交时（持有写锁）补充生成，然后一次替换全部段。
+        """
+        model_name = Config.EMBEDDING_MODEL_NAME
+        with self._compaction_lock:
+            with self._lock:
+                self._sync_with_disk()
+                segments = list(self._segments)
+                store = self._state.store
+                alive = np.flatnonzero(~self._state.deleted)
+            
+            documents = DocumentSubset(store, alive)
+            logger.info(f"开始用 {model_name} 重新生成 {len(alive)} 条向量（完成前继续使用原向量）...")
+            embeddings = self._encode([doc['text'] for doc in documents], model_name)
+            ids = np.asarray(store.ids)[alive]
+            
+            with self._lock:
+                self._sync_with_disk()
+                if self._segments[:len(segments)] != segments:
+                    logger.warning("重新生成向量期间段列表已变化，放弃本次替换")
+                    return False
+                state = self._state
+                added = SegmentedDocuments(state.store.stores[len(segments):])
+                added_alive = np.flatnonzero(~state.deleted[len(store):])
+                added_documents = DocumentSubset(added, added_alive)
+                if len(added_documents) > 0:
+                    logger.info(f"补充生成期间新写入的 {len(added_documents)} 条向量")
+                    embeddings = np.concatenate([
+                        embeddings, self._encode([doc['text'] for doc in added_documents], model_name)
+                    ])
+                    ids = np.concatenate([ids, added.ids[added_alive]])
+                if len(embeddings) > 0:
+                    self.dimension = embeddings.shape[1]
+                
+                self._embedding_model_name = model_name
+                # 训练结果与旧向量对应，需要按新向量重新训练
+                self._trained_index = None
+                self._trained_file = None
+                self._trained_count = 0
+                self._replace_all_segments(SegmentedDocuments([documents, added_documents]), embeddings, ids)
+            logger.info(f"向量重新生成完成，包含 {len(self.documents)} 条文档")
+        self._maybe_schedule_maintenance()
+        return True
+    
+    def _reembed_in_background(self):
         try:
-            self.save_index()
-            logger.info(f"索引重新生成成功，包含 {len(self.documents)} 条文档")
+            self.reembed()
         except Exception as e:
-            logger.error(f"保存重新生成的索引失败: {e}")
-            logger.warning("索引已在内存中可用，可以正常搜索，但重启后需要重新生成")
-            # 即使保存失败，索引也在内存中可用，不影响搜索功能
+            logger.error(f"后台重新生成向量失败: {e}", exc_info=True)
     
     def save_index(self):
-        """保存索引"""
-        try:
-            # 确保目录存在
+        """提交当前状态（段在写入时已落盘，这里只需确保清单存在，例如新建知识库时）"""
+        with self._lock:
             self.db_path.mkdir(parents=True, exist_ok=True)
+            self._sync_with_disk()
+            if self._read_manifest() is None:
+                self._commit(self._segments, self._state.tombstones)
+                logger.info(f"知识库清单已创建: {self.db_path / MANIFEST_FILE}")
+    
+    def compact(self):
+        """把所有段合并为一个段，并物理清除已删除的文本块（后台维护只合并部分段，见_plan_compaction）"""
+        return self._merge_segments(0, len(self._segments))
+    
+    def _merge_segments(self, start, end):
+        """把第start到end-1个（相邻的）段合并为一个段，并物理清除其中已删除的文本块
+        
+        向量直接取自段中保存的原始向量，不重新生成，读写量只与这些段的大小成正比。合并期间允许继续写入和删除：
+        提交时保留合并期间新增的段和删除标记。没有清除文本块时各文本块在索引中的位置不变，沿用当前索引；
+        否则用保存的向量重新组装内存索引。合并后没有有效文本块时直接移除这些段。
+        """
+        with self._compaction_lock:
+            with self._lock:
+                self._sync_with_disk()
+                segments = self._segments[start:end]
+                state = self._state
+                documents = SegmentedDocuments(state.store.stores[start:end])
+                offset = sum(len(store) for store in state.store.stores[:start])
+                count = len(documents)
+                alive = np.flatnonzero(~state.deleted[offset:offset + count])
+            if len(segments) == 0 or (len(segments) == 1 and len(alive) == count):
+                return False
             
-            # 使用相对路径（Path对象会自动处理）
-            index_file = self.db_path / 'index.faiss'
-            docs_file = self.db_path / 'documents.pkl'
-            
-            logger.info(f"准备保存索引到: {index_file.absolute()}")
-            logger.info(f"准备保存文档到: {docs_file.absolute()}")
-            logger.info(f"索引大小: {self.index.ntotal if hasattr(self.index, 'ntotal') else 'N/A'}")
-            logger.info(f"文档数量: {len(self.documents)}")
+            logger.info(f"开始合并 {len(segments)} 个段，保留 {len(alive)}/{count} 条文档: {self.db_path}")
+            merged = None
+            if len(alive) > 0:
+                embeddings = documents.vectors()[alive]
+                ids = documents.ids[alive]
+                lexicon = self._merged_lexicon(documents, alive) if Config.KB_LEXICAL_ENABLED else None
+                merged, merged_store = self._write_segment(DocumentSubset(documents, alive), embeddings, ids, lexicon)
             
-            # 保存索引文件 - 使用字符串路径
-            try:
-                index_path_str = str(index_file.resolve())
-                # 确保父目录存在
-                index_file.parent.mkdir(parents=True, exist_ok=True)
-                
-                # 尝试写入索引文件 - 使用bytes模式确保编码正确
-                logger.info(f"准备写入索引文件，路径: {index_path_str}")
-                logger.info(f"索引类型: {type(self.index)}, 大小: {self.index.ntotal if hasattr(self.index, 'ntotal') else 'N/A'}")
-                
-                # 使用绝对路径字符串，确保路径正确
-                abs_path_str = str(Path(index_path_str).absolute())
-                
-                # 确保目录存在
-                Path(abs_path_str).parent.mkdir(parents=True, exist_ok=True)
-                
-                # 写入索引文件 - 使用多种方法确保成功
-                import time
-                saved = False
-                
-                # 方法1: 使用绝对路径
-                try:
-                    faiss.write_index(self.index, abs_path_str)
-                    time.sleep(0.2)  # 等待文件系统同步
-                    if Path(abs_path_str).exists():
-                        saved = True
-                        logger.info(f"FAISS索引已保存到: {abs_path_str}")
-                except Exception as write_error:
-                    logger.warning(f"绝对路径保存失败: {write_error}")
+            with self._lock:
+                self._sync_with_disk()
+                if self._segments[start:end] != segments:
+                    # 合并期间段列表被整体替换（例如重建索引或其他实例的提交），放弃本次合并
+                    logger.warning("合并期间段列表已变化，放弃本次合并")
+                    if merged is not None:
+                        merged_store.close()
+                        shutil.rmtree(self.db_path / merged, ignore_errors=True)
+                    return False
                 
-                # 方法2: 如果方法1失败，尝试使用相对路径
-                if not saved:
-                    try:
-                        relative_path = str(index_file)
-                        faiss.write_index(self.index, relative_path)
-                        time.sleep(0.2)
-                        if Path(relative_path).exists():
-                            saved = True
-                            abs_path_str = str(Path(relative_path).absolute())
-                            logger.info(f"使用相对路径保存成功: {relative_path}")
-                    except Exception as rel_error:
-                        logger.warning(f"相对路径保存也失败: {rel_error}")
-                
-                # 方法3: 如果都失败，尝试使用短路径名（Windows）
-                if not saved and os.name == 'nt' and HAS_WIN32API:
-                    try:
-                        short_path = win32api.GetShortPathName(str(self.db_path))
-                        short_index_path = Path(short_path) / 'index.faiss'
-                        faiss.write_index(self.index, str(short_index_path))
-                        time.sleep(0.2)
-                        if short_index_path.exists():
-                            saved = True
-                            abs_path_str = str(short_index_path.absolute())
-                            logger.info(f"使用短路径名保存成功: {short_index_path}")
-                    except Exception as short_error:
-                        logger.warning(f"短路径名保存失败: {short_error}")
-                
-                if not saved:
-                    # 不抛出异常，记录警告，索引在内存中仍然可用
-                    logger.error("所有保存方法都失败，索引仅在内存中可用")
-                    logger.warning("这可能是由于路径编码问题，但搜索功能仍然可用")
-                    # 不抛出异常，让调用者知道保存失败但可以继续使用
-                    return  # 提前返回，不继续验证
-                
-                # 验证文件
-                check_path = Path(abs_path_str)
-                if check_path.exists():
-                    file_size = check_path.stat().st_size
-                    logger.info(f"验证成功: 索引文件存在，大小: {file_size} 字节")
+                state = self._state
+                replacement = [merged] if merged is not None else []
+                new_segments = self._segments[:start] + replacement + self._segments[end:]
+                stores = (
+                    state.store.stores[:start]
+                    + ([merged_store] if merged is not None else [])
+                    + state.store.stores[end:]
+                )
+                if len(alive) == count:
+                    index, delta = state.index, state.delta
                 else:
-                    # 等待更长时间后再次检查
-                    time.sleep(0.5)
-                    if check_path.exists():
-                        file_size = check_path.stat().st_size
-                        logger.info(f"延迟验证成功: 索引文件存在，大小: {file_size} 字节")
-                    else:
-                        logger.error(f"警告: 索引文件保存后验证不存在: {abs_path_str}")
-                        logger.error(f"目录内容: {list(check_path.parent.glob('*'))}")
-            except Exception as e:
-                logger.error(f"保存FAISS索引失败: {e}")
-                logger.warning("索引在内存中仍然可用，可以正常搜索")
-                # 不抛出异常，允许索引在内存中使用
-                # 这样即使保存失败，搜索功能仍然可用
-            
-            # 保存文档文件
-            try:
-                docs_path_str = str(docs_file.resolve())
-                with open(docs_path_str, 'wb') as f:
-                    pickle.dump(self.documents, f)
-                logger.info(f"文档数据已保存到: {docs_path_str}")
-            except Exception as e:
-                logger.error(f"保存文档数据失败: {e}", exc_info=True)
-                raise
-            
-            logger.info(f"保存索引成功，包含 {len(self.documents)} 条文档")
+                    # 被清除的文本块之后的向量位置整体前移，重新组装内存索引（增量向量一并加入）
+                    index, delta = self._build_index(SegmentedDocuments(stores).vectors()), ()
+                
+                kept_ids = SegmentedDocuments(stores).ids
+                tombstones = state.tombstones[np.isin(state.tombstones, kept_ids)]
+                self._commit(new_segments, tombstones)
+                # 段、文档和与之对应的索引、位图作为一个新状态整体替换，正在进行的搜索继续使用原状态
+                self._set_segments(new_segments, stores, index, tombstones, delta)
+                self._remove_unused_files()
+            logger.info(f"段合并完成: {self.db_path}")
+            return True
+    
+    def _plan_compaction(self):
+        """后台维护要合并的相邻段区间 (start, end)，不需要合并时返回None
+        
+        - 已删除比例达到KB_MAX_DELETED_RATIO的段单独重写，物理清除（优先删除最多的段）
+        - 否则按大小分层（size-tiered）：大小相差不超过KB_TIER_RATIO倍的相邻段达到KB_MERGE_FACTOR个时合并，
+          优先合并总大小最小的一组；大段只在与之大小相近的段积累够之后才参与合并，
+          每条文档被重写的次数与文档总量成对数关系，而不是每次合并都重写全部数据
+        """
+        state = self._state
+        sizes = []
+        deleted = []
+        offset = 0
+        for store in state.store.stores:
+            removed = int(state.deleted[offset:offset + len(store)].sum())
+            sizes.append(len(store) - removed)
+            deleted.append(removed)
+            offset += len(store)
+        
+        candidates = [
+            i for i in range(len(sizes))
+            if deleted[i] > 0 and deleted[i] >= Config.KB_MAX_DELETED_RATIO * (sizes[i] + deleted[i])
+        ]
+        if candidates:
+            i = max(candidates, key=lambda i: deleted[i])
+            return i, i + 1
+        
+        best = None
+        for start in range(len(sizes)):
+            smallest = largest = max(sizes[start], 1)
+            end = start
+            while end < len(sizes):
+                size = max(sizes[end], 1)
+                if max(largest, size) > Config.KB_TIER_RATIO * min(smallest, size):
+                    break
+                smallest, largest = min(smallest, size), max(largest, size)
+                end += 1
+            if end - start >= Config.KB_MERGE_FACTOR:
+                total = sum(sizes[start:end])
+                if best is None or total < best[0]:
+                    best = (total, start, end)
+        return None if best is None else best[1:]
+    
+    def _needs_compaction(self):
+        """是否有需要在后台合并的段"""
+        return self._plan_compaction() is not None
+    
+    def _needs_fold(self):
+        """增量向量是否需要并入主索引（见Config.KB_DELTA_MIN_ROWS）"""
+        state = self._state
+        return state.delta_count > 0 and state.delta_count >= max(
+            Config.KB_DELTA_MIN_ROWS, Config.KB_DELTA_RATIO * state.indexed
+        )
+    
+    def _fold_delta(self):
+        """把增量向量并入主索引，返回是否进行了合并
+        
+        复制主索引并加入增量向量在写锁外进行，期间允许继续写入和搜索；完成后只替换已并入的部分，
+        合并期间新追加的增量向量保留。增量达到主索引的一定比例才合并，每条向量被复制的次数摊销为常数。
+        """
+        with self._compaction_lock:
+            with self._lock:
+                state = self._state
+            if state.index is None or state.delta_count == 0:
+                return False
             
-            # 验证文件是否真的保存了（使用resolve后的路径）
-            index_resolved = index_file.resolve()
-            docs_resolved = docs_file.resolve()
+            logger.info(f"开始把 {state.delta_count} 条增量向量并入主索引（{state.indexed} 条）: {self.db_path}")
+            index = faiss.clone_index(state.index)
+            for vectors in state.delta:
+                index.add(vectors)
             
-            if not index_resolved.exists():
-                logger.error(f"错误: 索引文件保存后不存在: {index_resolved}")
-                logger.error(f"目录内容: {list(self.db_path.resolve().glob('*'))}")
-            else:
-                logger.info(f"验证成功: 索引文件存在，大小: {index_resolved.stat().st_size} 字节")
-                
-            if not docs_resolved.exists():
-                logger.error(f"错误: 文档文件保存后不存在: {docs_resolved}")
-            else:
-                logger.info(f"验证成功: 文档文件存在，大小: {docs_resolved.stat().st_size} 字节")
+            with self._lock:
+                current = self._state
+                folded = len(state.delta)
+                if current.index is not state.index or any(
+                    a is not b for a, b in zip(current.delta[:folded], state.delta)
+                ):
+                    # 合并期间索引被整体替换（例如重新加载或重建索引），放弃本次合并
+                    logger.warning("合并增量向量期间索引已被替换，放弃本次合并")
+                    return False
+                self._set_index(index, current.delta[folded:])
+            logger.info(f"增量向量合并完成: {self.db_path}")
+            return True
+    
+    def _maybe_schedule_maintenance(self):
+        """需要合并段、合并增量向量或训练索引时在后台线程进行"""
+        if not (self._needs_compaction() or self._needs_fold() or self._needs_training()):
+            return
+        if self._compaction_lock.locked():
+            return
+        self._start_background(self._maintain_in_background)
+    
+    def _start_background(self, target):
+        """启动后台线程并记录，实例已关闭时不再启动"""
+        with self._background_lock:
+            if self._closed:
+                return
+            self._background = [thread for thread in self._background if thread.is_alive()]
+            thread = threading.Thread(target=target, name=f'kb-maintenance-{self.db_path.name}', daemon=True)
+            self._background.append(thread)
+            thread.start()
+    
+    def _maintain_in_background(self):
+        try:
+            # 逐组合并，直到没有需要合并的段（每组合并后段的大小分布会变化）
+            while not self._closed:
+                with self._lock:
+                    plan = self._plan_compaction()
+                if plan is None or not self._merge_segments(*plan):
+                    break
+            # 训练会用全部向量重建索引，未训练时才单独合并增量向量
+            if not self._closed and not self.train_index() and self._needs_fold():
+                self._fold_delta()
         except Exception as e:
-            logger.error(f"保存索引失败: {e}", exc_info=True)
-            import traceback
-            traceback.print_exc()
-            raise
+            logger.error(f"后台维护知识库失败: {e}", exc_info=True)
     
-    def add_documents(self, texts, metadata_list=None):
-        """添加文档到知识库"""
+    def close(self, timeout=None):
+        """停止启动新的后台维护并等待正在进行的维护结束（删除索引目录或退出进程前调用）
+        
+        返回后台线程是否都已结束；正在进行的合并或训练会完成当前步骤，之后的步骤不再进行。
+        """
+        with self._background_lock:
+            self._closed = True
+            threads = list(self._background)
+        for thread in threads:
+            thread.join(timeout)
+        return not any(thread.is_alive() for thread in threads)
+    
+    def add_documents(self, texts, metadata_list=None, partition=None):
+        """添加文档到知识库（只写入新增数据组成的新段）
+        
+        partition: 统一存储模式下文档所属的知识库名称
+        """
         if not texts:
             return
         
         if metadata_list is None:
             metadata_list = [{}] * len(texts)
+        if partition is not None:
+            metadata_list = [dict(metadata or {}, **{PARTITION_FIELD: partition}) for metadata in metadata_list]
         
         # 分割文本
         all_chunks = []
@@ -350,185 +1131,494 @@ class KnowledgeBase:
                 all_chunks.append(chunk)
                 all_metadata.append(metadata)
         
-        # 生成向量
-        embeddings = self.embedding_model.encode(all_chunks, show_progress_bar=False)
-        embeddings = np.array(embeddings).astype('float32')
-        
-        # 添加到索引
-        self.index.add(embeddings)
+        # 生成向量（在锁外进行，避免阻塞同一知识库上的其他写操作）
+        embeddings = self._encode(all_chunks)
+        documents = [
+            {'text': chunk, 'metadata': metadata}
+            for chunk, metadata in zip(all_chunks, all_metadata)
+        ]
         
-        # 保存文档
-        for chunk, metadata in zip(all_chunks, all_metadata):
-            self.documents.append({
-                'text': chunk,
-                'metadata': metadata
-            })
+        segment = self._append(documents, embeddings)
+        logger.info(f"添加 {len(all_chunks)} 个文档块到知识库（段 {segment}）")
+    
+    def _append(self, documents, embeddings):
+        """把已生成向量的文档写成一个新段并提交，返回段名"""
+        embeddings = _normalize(embeddings)
+        with self._lock:
+            for attempt in range(COMMIT_RETRIES):
+                # 先同步其他实例的提交，段名和文本块ID按最新的清单分配
+                self._sync_with_disk()
+                ids = self._allocate_ids(len(documents))
+                segment, store = self._write_segment(documents, embeddings, ids)
+                try:
+                    self._commit(self._segments + [segment], self._state.tombstones)
+                    break
+                except ManifestConflict:
+                    store.close()
+                    shutil.rmtree(self.db_path / segment, ignore_errors=True)
+                    if attempt == COMMIT_RETRIES - 1:
+                        raise
+            
+            # 提交成功后再更新内存状态：搜索线程不加锁读取当前状态，FAISS索引不能边搜索边添加，
+            # 新向量作为增量加入新状态，主索引不变（不复制），写入的开销只与新增数据量成正比
+            state = self._state
+            embeddings.setflags(write=False)
+            self._set_segments(
+                self._segments + [segment], state.store.stores + [store], state.index, delta=state.delta + (embeddings,)
+            )
         
-        self.save_index()
-        logger.info(f"添加 {len(all_chunks)} 个文档块到知识库")
+        self._maybe_schedule_maintenance()
+        return segment
     
-    def search(self, query, top_k=10, similarity_threshold=0.3):
-        """搜索知识库"""
+    def import_documents(self, source, partition=None):
+        """导入另一个知识库的全部有效文档及其向量（不重新生成向量），返回导入数量"""
+        if source._embedding_model_name != self._embedding_model_name:
+            raise ValueError(
+                f"嵌入模型不一致（{source._embedding_model_name} / {self._embedding_model_name}），无法直接导入向量"
+            )
+        source_state = source._state
+        alive = np.flatnonzero(~source_state.deleted)
+        if len(alive) == 0:
+            return 0
+        documents = [
+            {'text': doc['text'], 'metadata': dict(doc['metadata'], **{PARTITION_FIELD: partition})}
+            if partition is not None else doc
+            for doc in DocumentSubset(source_state.store, alive)
+        ]
+        self._append(documents, source_state.store.vectors()[alive])
+        return len(documents)
+    
+    def _segment_lexicon(self, store):
+        """段的BM25倒排表，旧版本写入的段没有倒排表时分词生成并补写到段目录"""
+        key = str(store.path)
+        lexicon = self._lexicons.get(key)
+        if lexicon is None:
+            if SegmentLexicon.exists(store.path):
+                lexicon = SegmentLexicon.load(store.path)
+            else:
+                logger.info(f"段 {store.path.name} 没有倒排表，分词生成")
+                lexicon = SegmentLexicon.build(store.text(i) for i in range(len(store)))
+                try:
+                    lexicon.write(store.path)
+                except OSError as e:
+                    logger.warning(f"写入倒排表失败（仅在内存中使用）: {e}")
+            self._lexicons[key] = lexicon
+        return lexicon
+    
+    def _lexical_index(self, documents):
+        """文档序列（某一时刻的快照）对应的BM25索引"""
+        with self._lexical_lock:
+            lexical = self._lexical
+            if lexical is None or lexical[0] is not documents:
+                lexical = (documents, LexicalIndex(self._segment_lexicon(store) for store in documents.stores))
+                if documents is self._state.store:
+                    self._lexical = lexical
+            return lexical[1]
+    
+    def _merged_lexicon(self, documents, alive):
+        """合并段时由各段的倒排表合并出新段的倒排表，只保留alive中的文本块"""
+        with self._lexical_lock:
+            parts = []
+            start = 0
+            for store in documents.stores:
+                end = start + len(store)
+                kept = alive[(alive >= start) & (alive < end)] - start
+                parts.append((self._segment_lexicon(store), kept))
+                start = end
+        return SegmentLexicon.merge(parts)
+    
+    def partition_documents(self, partition):
+        """某个分区内的有效文档"""
+        state = self._state
+        mask = state.partition_mask([partition])[:len(state.store)] & ~state.deleted
+        return DocumentSubset(state.store, np.flatnonzero(mask))
+    
+    def search(self, query, top_k=10, similarity_threshold=0.3, nprobe=None, ef_search=None,
+               query_embedding=None, rerank=True, partitions=None, metadata_filter=None):
+        """搜索知识库
+        
+        nprobe: 倒排索引探查的列表数（越大越准越慢），默认取知识库参数或KB_IVF_NPROBE
+        ef_search: HNSW索引的候选队列长度，默认取知识库参数或KB_HNSW_EF_SEARCH
+        query_embedding: 预先生成的查询向量（例如搜索多个知识库时共用），不传时按query生成
+        rerank: 是否重排（跨知识库搜索时由调用方合并后统一重排）
+        partitions: 统一存储模式下只在这些知识库（分区）内搜索
+        metadata_filter: 元数据过滤条件（见metadata_filter.py），在ANN搜索中通过IDSelector生效
+        """
         logger.info(f"🔍 开始搜索知识库: query='{query}', top_k={top_k}, threshold={similarity_threshold}")
-        logger.info(f"📚 知识库文档总数: {len(self.documents)}")
+        results = self.search_batch(
+            [query], top_k=top_k, similarity_threshold=similarity_threshold,
+            nprobe=nprobe, ef_search=ef_search,
+            query_embeddings=None if query_embedding is None else [query_embedding],
+            rerank=rerank, partitions=partitions, metadata_filter=metadata_filter
+        )[0]
         
-        if len(self.documents) == 0:
-            logger.warning("⚠️ 知识库为空，无法搜索")
-            return []
+        logger.info(f"✅ 搜索完成，最终返回 {len(results)} 条结果")
+        if len(results) > 0:
+            logger.info(f"   最高相似度: {results[0].get('similarity') or 0:.4f}")
+            logger.info(f"   最低相似度: {results[-1].get('similarity') or 0:.4f}")
         
-        # 生成查询向量
-        logger.info("🔄 正在生成查询向量...")
-        query_embedding = self.embedding_model.encode([query])
-        query_embedding = np.array(query_embedding).astype('float32')
-        logger.info(f"✅ 查询向量生成完成，维度: {query_embedding.shape}")
+        return results
+    
+    def search_batch(self, queries, top_k=10, similarity_threshold=0.3, nprobe=None, ef_search=None,
+                     query_embeddings=None, rerank=True, partitions=None, metadata_filter=None):
+        """批量搜索知识库，返回与queries一一对应的结果列表
         
-        # 搜索
-        k = min(top_k, len(self.documents))
-        if k == 0:
-            logger.warning("⚠️ k=0，无法搜索")
+        所有查询一次生成向量、一次FAISS搜索、一次重排打分，参数含义同search。
+        query_embeddings: 与queries一一对应的预先生成的查询向量（重排仍使用queries原文）
+        
+        启用混合检索（KB_LEXICAL_ENABLED）时先查BM25倒排索引：关键词查询的结果足够明确时直接返回，
+        不生成查询向量也不重排；其余查询的向量结果与BM25结果按RRF融合后再重排。
+        """
+        queries = list(queries)
+        if not queries:
             return []
+        metadata_filter = MetadataFilter.parse(metadata_filter) if metadata_filter else None
         
-        logger.info(f"🔎 在FAISS索引中搜索，k={k}")
-        distances, indices = self.index.search(query_embedding, k)
-        logger.info(f"📊 搜索完成，找到 {len(indices[0])} 个候选结果")
+        # 取一次状态的引用，之后只读这个对象：并发的写入、删除和段合并替换的是新状态，不影响本次结果
+        state = self._state
+        documents = state.store
+        index = state.index
+        ids = state.ids
+        # 查询向量用生成这些文档向量的模型编码（更换模型后、重新生成向量完成前仍为原模型）
+        model_name = self._embedding_model_name
+        alive_bitmap, live_count = state.selection(partitions, metadata_filter)
+        logger.info(f"📚 知识库文档总数: {live_count}，查询数: {len(queries)}")
         
-        results = []
-        filtered_count = 0
-        for i, (distance, idx) in enumerate(zip(distances[0], indices[0])):
-            if idx < len(self.documents) and idx >= 0:
-                # L2距离转换为相似度（归一化到0-1）
-                # 使用更合理的距离转换：all-MiniLM-L6-v2的典型距离范围是0-2
-                max_distance = 2.0
-                similarity = max(0, 1 - (distance / max_distance))
-                
-                logger.debug(f"结果 {i+1}: idx={idx}, distance={distance:.4f}, similarity={similarity:.4f}, threshold={similarity_threshold}")
-                
-                # 降低相似度阈值，让更多结果能够返回
-                if similarity >= similarity_threshold:
-                    doc = self.documents[idx].copy()
-                    doc['similarity'] = float(similarity)
-                    doc['rank'] = i + 1
-                    results.append(doc)
-                    logger.debug(f"✅ 结果 {i+1} 通过阈值过滤: similarity={similarity:.4f}")
-                else:
-                    filtered_count += 1
-                    logger.debug(f"❌ 结果 {i+1} 未通过阈值过滤: similarity={similarity:.4f} < {similarity_threshold}")
+        if live_count == 0:
+            logger.warning("⚠️ 知识库为空或没有符合过滤条件的文档，无法搜索")
+            return [[] for _ in queries]
         
-        logger.info(f"📈 搜索统计: 总候选={len(indices[0])}, 通过阈值={len(results)}, 被过滤={filtered_count}")
+        k = min(top_k, live_count)
+        if k == 0:
+            logger.warning("⚠️ k=0，无法搜索")
+            return [[] for _ in queries]
         
-        # 重排序（使用重排模型提升相关性）
-        if len(results) > 0 and self.rerank_model and len(results) <= 50:  # 只对前50条进行重排，避免太慢
-            logger.info(f"🔄 开始重排序，结果数: {len(results)}")
-            try:
-                doc_texts = [r['text'] for r in results]
-                
-                # 检查是否是CrossEncoder
-                if isinstance(self.rerank_model, CrossEncoder):
-                    # CrossEncoder直接接受(query, document)对，返回相关性分数
-                    pairs = [[query, doc_text] for doc_text in doc_texts]
-                    rerank_scores = self.rerank_model.predict(pairs)
-                    # 将numpy数组转换为列表
-                    if hasattr(rerank_scores, 'tolist'):
-                        rerank_scores = rerank_scores.tolist()
-                    elif isinstance(rerank_scores, np.ndarray):
-                        rerank_scores = rerank_scores.tolist()
+        # 有效位图展开的逐文本块掩码，供BM25检索和增量向量的暴力搜索使用
+        mask = None
+        if alive_bitmap is not None:
+            mask = np.unpackbits(alive_bitmap, count=len(documents), bitorder='little').astype(bool)
+        
+        # 关键词检索：结果足够明确的查询走快速路径，其余保留BM25结果用于融合
+        results_list = [None] * len(queries)
+        lexical_hits = [None] * len(queries)
+        if Config.KB_LEXICAL_ENABLED:
+            lexical = self._lexical_index(documents)
+            # 调用方传入了每个查询的向量时，快速路径的结果也能给出余弦相似度并按阈值过滤
+            given_embeddings = None
+            if query_embeddings is not None:
+                given_embeddings = _normalize(np.atleast_2d(query_embeddings))
+                if given_embeddings.shape != (len(queries), index.d):
+                    given_embeddings = None
+            for i, query in enumerate(queries):
+                terms = query_terms(query)
+                positions, scores, matched = lexical.search(terms, k, mask)
+                if is_decisive(terms, scores, matched):
+                    full = matched == len(terms)
+                    if given_embeddings is not None:
+                        query_embedding = given_embeddings[i]
                     else:
-                        rerank_scores = list(rerank_scores)
-                else:
-                    # 如果是SentenceTransformer，使用原来的方法
-                    query_emb = self.rerank_model.encode([query])[0]
-                    doc_embs = self.rerank_model.encode(doc_texts)
-                    
-                    # 计算余弦相似度作为重排分数
-                    rerank_scores = []
-                    query_norm = np.linalg.norm(query_emb)
-                    for doc_emb in doc_embs:
-                        doc_norm = np.linalg.norm(doc_emb)
-                        if query_norm > 0 and doc_norm > 0:
-                            score = float(np.dot(query_emb, doc_emb) / (query_norm * doc_norm))
+                        # 同一查询已经编码过（例如搜索其他知识库时）直接用缓存的向量，不调用模型
+                        query_embedding = _query_embedding_cache.get((model_name, _normalize_query(query)))
+                    results = self._lexical_results(
+                        documents, ids, positions[full], scores[full], query_embedding, similarity_threshold
+                    )
+                    if results:
+                        results_list[i] = results
+                        continue
+                    # 全部低于相似度阈值时按普通查询处理，BM25结果参与融合
+                lexical_hits[i] = (positions, scores)
+        pending = [i for i, results in enumerate(results_list) if results is None]
+        if len(pending) < len(queries):
+            logger.info(f"⚡ {len(queries) - len(pending)} 个查询走关键词快速路径，跳过向量检索和重排")
+        
+        if pending:
+            # 生成查询向量（归一化，与文档向量的内积即余弦相似度）
+            if query_embeddings is None:
+                logger.info("🔄 正在生成查询向量...")
+                pending_embeddings = encode_queries([queries[i] for i in pending], model_name)
+            else:
+                pending_embeddings = _normalize(np.atleast_2d(query_embeddings))
+                if len(pending_embeddings) == len(queries):
+                    pending_embeddings = pending_embeddings[pending]
+            if pending_embeddings.shape != (len(pending), index.d):
+                raise ValueError(f"查询向量维度 {pending_embeddings.shape} 与索引维度 {index.d} 不一致")
+            logger.info(f"✅ 查询向量就绪，维度: {pending_embeddings.shape}")
+            
+            # 有删除标记、分区或过滤条件时只在有效位图内搜索（alive_bitmap需在搜索期间保持引用）
+            selector = None
+            if alive_bitmap is not None:
+                selector = faiss.IDSelectorBitmap(len(alive_bitmap) * 8, faiss.swig_ptr(alive_bitmap))
+            params = ann_index.search_parameters(
+                index, selector,
+                nprobe=nprobe or self._index_params.get('nprobe'),
+                ef_search=ef_search or self._index_params.get('ef_search')
+            )
+            hits = self._search_index(state, pending_embeddings, k, similarity_threshold, params, mask)
+            
+            for i, query_embedding, (scores, indices) in zip(pending, pending_embeddings, hits):
+                results = []
+                filtered_count = 0
+                for rank, (score, idx) in enumerate(zip(scores, indices)):
+                    if idx < len(documents) and idx >= 0:
+                        # 内积索引中的向量均已归一化，分数即余弦相似度
+                        similarity = float(score)
+                        
+                        logger.debug(f"结果 {rank+1}: idx={idx}, similarity={similarity:.4f}, threshold={similarity_threshold}")
+                        
+                        if similarity >= similarity_threshold:
+                            doc = documents[idx].copy()
+                            doc['chunk_id'] = int(ids[idx])
+                            doc['similarity'] = similarity
+                            doc['rank'] = rank + 1
+                            doc['position'] = int(idx)
+                            results.append(doc)
                         else:
-                            score = 0.0
-                        rerank_scores.append(score)
-                
-                # 更新结果的重排分数
-                for i, result in enumerate(results):
-                    result['rerank_score'] = float(rerank_scores[i])
-                    # 使用重排分数和原始相似度的加权平均（重排分数权重更高）
-                    original_sim = result.get('similarity', 0)
-                    result['final_score'] = 0.6 * float(rerank_scores[i]) + 0.4 * original_sim
+                            filtered_count += 1
                 
-                # 按最终分数排序
-                results.sort(key=lambda x: x.get('final_score', x.get('similarity', 0)), reverse=True)
-                logger.info(f"✅ 重排序完成，共处理 {len(results)} 条结果")
-                # 显示前3条结果的分数
-                for i, r in enumerate(results[:3]):
-                    logger.info(f"  排名 {i+1}: similarity={r.get('similarity', 0):.4f}, final_score={r.get('final_score', 0):.4f}")
-            except Exception as e:
-                logger.warning(f"重排序失败: {e}，使用原始相似度排序")
-                import traceback
-                traceback.print_exc()
-                # 如果重排失败，至少按相似度排序
-                results.sort(key=lambda x: x.get('similarity', 0), reverse=True)
-        else:
-            # 如果没有重排，至少按相似度排序
-            results.sort(key=lambda x: x.get('similarity', 0), reverse=True)
-            logger.info(f"📊 未使用重排模型，按相似度排序，返回 {len(results)} 条结果")
+                logger.info(f"📈 搜索统计: 总候选={len(indices)}, 通过阈值={len(results)}, 被过滤={filtered_count}")
+                if Config.KB_LEXICAL_ENABLED:
+                    results = self._fuse(
+                        documents, ids, results, lexical_hits[i], query_embedding, k, similarity_threshold
+                    )
+                for result in results:
+                    result.pop('position', None)
+                results_list[i] = results
+            
+            if rerank:
+                rerank_results(
+                    [queries[i] for i in pending], [results_list[i] for i in pending],
+                    lambda result: str(self.db_path)
+                )
         
-        logger.info(f"✅ 搜索完成，最终返回 {len(results)} 条结果")
-        if len(results) > 0:
-            logger.info(f"   最高相似度: {results[0].get('similarity', 0):.4f}")
-            logger.info(f"   最低相似度: {results[-1].get('similarity', 0):.4f}")
+        reranked = set(pending) if rerank else set()
+        for i, results in enumerate(results_list):
+            if i not in reranked:
+                results.sort(key=retrieval_score, reverse=True)
+        return results_list
+    
+    def _lexical_results(self, documents, ids, positions, scores, query_embedding=None, similarity_threshold=0):
+        """关键词快速路径的结果
         
+        lexical_score为相对于最高BM25分数的比例，不是余弦相似度，不写入similarity。
+        有查询向量时用段中保存的向量计算真实的余弦相似度，低于similarity_threshold的结果不返回；
+        没有查询向量时不调用模型，similarity为None，这些关键词明确匹配的结果不受相似度阈值限制。
+        """
+        similarities = [None] * len(positions)
+        if query_embedding is not None and len(positions):
+            vectors = _normalize(documents.vectors_at([int(p) for p in positions]))
+            similarities = [float(similarity) for similarity in vectors @ query_embedding]
+        results = []
+        for position, score, similarity in zip(positions, scores, similarities):
+            if similarity is not None and similarity < similarity_threshold:
+                continue
+            rank = len(results)
+            doc = documents[int(position)].copy()
+            doc['chunk_id'] = int(ids[position])
+            doc['bm25_score'] = float(score)
+            doc['lexical_score'] = float(score / scores[0])
+            doc['similarity'] = similarity
+            doc['fused_score'] = 1 / (Config.KB_RRF_K + rank + 1)
+            doc['rank'] = rank + 1
+            doc['retrieval'] = 'lexical'
+            results.append(doc)
         return results
     
-    def delete_documents_by_filename(self, filename):
-        """根据文件名删除文档"""
+    def _fuse(self, documents, ids, vector_results, lexical_hits, query_embedding, k, similarity_threshold=0):
+        """按RRF融合向量结果和BM25结果，取前k条
+        
+        只由BM25召回的文本块用段中保存的向量计算余弦相似度，与向量结果一样低于similarity_threshold的不返回。
+        """
+        rrf_k = Config.KB_RRF_K
+        fused = {}
+        for rank, result in enumerate(vector_results, 1):
+            result['fused_score'] = 1 / (rrf_k + rank)
+            result['retrieval'] = 'vector'
+            fused[result['position']] = result
+        
+        positions, scores = lexical_hits
+        lexical_only = [int(position) for position in positions if int(position) not in fused]
+        similarities = {}
+        if lexical_only:
+            vectors = documents.vectors_at(lexical_only)
+            similarities = dict(zip(lexical_only, _normalize(vectors) @ query_embedding))
+        for rank, (position, score) in enumerate(zip(positions, scores), 1):
+            position = int(position)
+            result = fused.get(position)
+            if result is None:
+                if similarities[position] < similarity_threshold:
+                    continue
+                result = documents[position].copy()
+                result['chunk_id'] = int(ids[position])
+                result['similarity'] = float(similarities[position])
+                result['fused_score'] = 0.0
+                result['retrieval'] = 'lexical'
+                fused[position] = result
+            else:
+                result['retrieval'] = 'hybrid'
+            result['bm25_score'] = float(score)
+            result['fused_score'] += 1 / (rrf_k + rank)
+        
+        results = sorted(fused.values(), key=lambda result: result['fused_score'], reverse=True)[:k]
+        for rank, result in enumerate(results, 1):
+            result['rank'] = rank
+        return results
+    
+    def _search_index(self, state, query_embeddings, k, similarity_threshold, params, alive=None):
+        """在FAISS索引和增量向量中搜索，返回每个查询的 (相似度数组, 向量位置数组)，按相似度降序
+        
+        alive: 全部文本块的有效掩码（None表示全部有效），用于增量向量；FAISS索引通过params中的IDSelector过滤
+        """
+        index = state.index
+        if similarity_threshold > 0 and ann_index.supports_range_search(index):
+            # 范围搜索：一次取回所有余弦相似度超过阈值的文本块，再按相似度取前k个
+            logger.info(f"🔎 在FAISS索引中范围搜索，threshold={similarity_threshold}, k={k}")
+            lims, scores, indices = index.range_search(query_embeddings, similarity_threshold, params=params)
+            hits = []
+            for i in range(len(query_embeddings)):
+                query_scores = scores[lims[i]:lims[i + 1]]
+                query_indices = indices[lims[i]:lims[i + 1]]
+                order = np.argsort(-query_scores, kind='stable')[:k]
+                hits.append((query_scores[order], query_indices[order]))
+        else:
+            logger.info(f"🔎 在FAISS索引中搜索，k={k}")
+            scores, indices = index.search(query_embeddings, k, params=params)
+            hits = list(zip(scores, indices))
+        if state.delta_count > 0:
+            # 与增量向量的暴力搜索结果合并，取前k个
+            merged = []
+            for (scores, indices), (delta_scores, delta_positions) in zip(
+                hits, state.search_delta(query_embeddings, k, alive)
+            ):
+                scores = np.concatenate([scores, delta_scores])
+                indices = np.concatenate([indices, delta_positions])
+                order = np.argsort(-scores, kind='stable')[:k]
+                merged.append((scores[order], indices[order]))
+            hits = merged
+        logger.info(f"📊 搜索完成，找到 {sum(len(indices) for _, indices in hits)} 个候选结果")
+        return hits
+    
+    def _delete_where(self, should_delete):
+        """为元数据满足条件的文本块写入删除标记，返回删除数量
+        
+        只写入删除标记并更新内存位图，搜索立即生效；物理清除留给段合并。
+        """
+        with self._lock:
+            for attempt in range(COMMIT_RETRIES):
+                self._sync_with_disk()
+                state = self._state
+                positions = state.store.positions_where(should_delete)
+                positions = positions[~state.deleted[positions]]
+                if len(positions) == 0:
+                    return 0
+                
+                tombstones = np.union1d(state.tombstones, state.ids[positions])
+                try:
+                    self._commit(self._segments, tombstones)
+                    break
+                except ManifestConflict:
+                    if attempt == COMMIT_RETRIES - 1:
+                        raise
+            self._set_tombstones(tombstones)
+            logger.info(f"删除 {len(positions)} 个文档块，剩余 {len(self.documents)} 个文档")
+        
+        self._maybe_schedule_maintenance()
+        return len(positions)
+    
+    def delete_documents_by_filename(self, filename, partition=None):
+        """根据文件名删除文档（partition: 统一存储模式下只删除该知识库内的文档）"""
         if not filename:
             return 0
         
-        original_count = len(self.documents)
         # 过滤掉匹配的文件名
-        self.documents = [
-            doc for doc in self.documents 
-            if doc.get('metadata', {}).get('file_name') != filename
-        ]
-        deleted_count = original_count - len(self.documents)
-        
-        if deleted_count > 0:
-            # 重新构建索引
-            logger.info(f"删除 {deleted_count} 个文档块，重新构建索引...")
-            self._rebuild_index_from_documents()
-            logger.info(f"索引重建完成，剩余 {len(self.documents)} 个文档")
-        
-        return deleted_count
+        return self._delete_where(lambda metadata: (
+            metadata.get('file_name') == filename
+            and (partition is None or metadata.get(PARTITION_FIELD) == partition)
+        ))
     
-    def cleanup_missing_files(self, existing_files):
+    def cleanup_missing_files(self, existing_files, partition=None):
         """清理不存在的文件对应的文档
         existing_files: 存在的文件名集合
+        partition: 统一存储模式下只清理该知识库内的文档
         """
         if not existing_files:
             return 0
         
-        original_count = len(self.documents)
         # 只保留文件存在的文档
-        self.documents = [
-            doc for doc in self.documents 
-            if doc.get('metadata', {}).get('file_name') in existing_files
-        ]
-        deleted_count = original_count - len(self.documents)
-        
-        if deleted_count > 0:
-            # 重新构建索引
-            logger.info(f"清理 {deleted_count} 个不存在的文件对应的文档块，重新构建索引...")
-            self._rebuild_index_from_documents()
-            logger.info(f"索引重建完成，剩余 {len(self.documents)} 个文档")
-        
-        return deleted_count
+        return self._delete_where(lambda metadata: (
+            metadata.get('file_name') not in existing_files
+            and (partition is None or metadata.get(PARTITION_FIELD) == partition)
+        ))
     
-    def get_stats(self):
-        """获取知识库统计信息"""
+    def get_stats(self, partition=None):
+        """获取知识库统计信息
+        
+        partition: 统一存储模式下只统计该知识库（分区）的文本块，索引类型和段数为共用索引的值
+        """
+        state = self._state
+        if partition is None:
+            chunk_count = len(state.store)
+            index_size = state.indexed + state.delta_count
+            deleted = state.deleted
+        else:
+            in_partition = state.partition_mask([partition])[:len(state.store)]
+            chunk_count = index_size = int(in_partition.sum())
+            deleted = state.deleted & in_partition
+        deleted_documents = int(deleted.sum())
         return {
-            'total_documents': len(self.documents),
-            'index_size': self.index.ntotal if self.index else 0
+            'total_documents': chunk_count - deleted_documents,
+            'index_size': index_size,
+            'index_type': ann_index.index_type_of(state.index),
+            'segments': len(self._segments),
+            'deleted_documents': deleted_documents
         }
 
+
+class KnowledgeBasePartition:
+    """统一存储模式下单个知识库的视图
+
+    所有知识库共用一个物理索引，每个文本块在元数据中记录所属知识库（分区）；
+    这里把读写操作限定在一个分区内，接口与KnowledgeBase一致。
+    """
+
+    def __init__(self, kb, name):
+        self.kb = kb
+        self.name = name
+
+    @property
+    def documents(self):
+        """该知识库中的有效文档"""
+        return self.kb.partition_documents(self.name)
+
+    def add_documents(self, texts, metadata_list=None):
+        """添加文档到该知识库"""
+        return self.kb.add_documents(texts, metadata_list, partition=self.name)
+
+    def search(self, query, **kwargs):
+        """只在该知识库内搜索"""
+        return self.kb.search(query, partitions=[self.name], **kwargs)
+
+    def search_batch(self, queries, **kwargs):
+        """只在该知识库内批量搜索"""
+        return self.kb.search_batch(queries, partitions=[self.name], **kwargs)
+
+    def delete_documents_by_filename(self, filename):
+        """根据文件名删除该知识库内的文档"""
+        return self.kb.delete_documents_by_filename(filename, partition=self.name)
+
+    def cleanup_missing_files(self, existing_files):
+        """清理该知识库内不存在的文件对应的文档"""
+        return self.kb.cleanup_missing_files(existing_files, partition=self.name)
+
+    def get_stats(self):
+        """该知识库的统计信息（索引相关字段为整个存储共用）"""
+        return self.kb.get_stats(partition=self.name)
+
+    def save_index(self):
+        """确保统一存储的清单存在"""
+        self.kb.save_index()
+
+    def set_index_type(self, index_type, **params):
+        """统一存储模式下索引由所有知识库共用，不能为单个知识库设置索引类型"""
+        if index_type not in ann_index.INDEX_TYPES:
+            raise ValueError(f'不支持的索引类型: {index_type}')
+        logger.warning(f"统一存储模式下索引类型由共用索引决定，忽略知识库 {self.name} 的索引类型设置: {index_type}")
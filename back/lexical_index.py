@@ -0,0 +1,214 @@
+"""基于jieba分词的BM25倒排索引
+
+每个段在写入时生成自己的倒排表（与文档、向量保存在同一个段目录中）：
+- lex_terms.npy    排序后的词项
+- lex_offsets.npy  int64数组，第i个词项的倒排表为 [offsets[i], offsets[i+1])
+- lex_docs.npy     int32数组，倒排表中的文本块下标（段内编号）
+- lex_tfs.npy      int32数组，对应的词频
+- lex_lengths.npy  int32数组，每个文本块的词数
+
+搜索时按段拼接（段内下标加上段的起始位置），词项的文档频率和平均长度在所有段上统计。
+文档用搜索引擎模式分词（包含长词切出的短词），查询用精确模式分词，
+这样查询中的每个词都能在倒排表中找到。
+"""
+import math
+import os
+import re
+from collections import Counter
+from pathlib import Path
+import numpy as np
+import jieba
+from config import Config
+
+TERMS_FILE = 'lex_terms.npy'
+OFFSETS_FILE = 'lex_offsets.npy'
+DOCS_FILE = 'lex_docs.npy'
+TFS_FILE = 'lex_tfs.npy'
+LENGTHS_FILE = 'lex_lengths.npy'
+
+_WORD = re.compile(r'\w')
+
+
+def tokenize(text, for_search=True):
+    """分词并过滤空白和标点，英文统一小写
+
+    for_search: 文档使用搜索引擎模式（长词再切出短词），查询使用精确模式
+    """
+    text = str(text).lower()
+    words = jieba.lcut_for_search(text) if for_search else jieba.lcut(text)
+    return [word.strip() for word in words if _WORD.search(word)]
+
+
+def query_terms(query):
+    """查询的词项（精确模式分词、去重、保持顺序）"""
+    return list(dict.fromkeys(tokenize(query, for_search=False)))
+
+
+class SegmentLexicon:
+    """一个段的倒排表"""
+
+    def __init__(self, terms, offsets, docs, tfs, lengths):
+        self.terms = terms
+        self.offsets = offsets
+        self.docs = docs
+        self.tfs = tfs
+        self.lengths = lengths
+
+    def __len__(self):
+        return len(self.lengths)
+
+    @classmethod
+    def _from_postings(cls, terms, docs, tfs, lengths):
+        """由 (词项, 文本块下标, 词频) 三元组构建倒排表"""
+        unique_terms, term_ids = np.unique(np.asarray(terms, dtype=str), return_inverse=True)
+        docs = np.asarray(docs, dtype=np.int32)
+        tfs = np.asarray(tfs, dtype=np.int32)
+        order = np.lexsort((docs, term_ids))
+        counts = np.bincount(term_ids, minlength=len(unique_terms))
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return cls(unique_terms, offsets, docs[order], tfs[order], np.asarray(lengths, dtype=np.int32))
+
+    @classmethod
+    def build(cls, texts):
+        """对文本逐个分词，构建倒排表"""
+        terms, docs, tfs, lengths = [], [], [], []
+        for i, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                terms.append(term)
+                docs.append(i)
+                tfs.append(tf)
+        return cls._from_postings(terms, docs, tfs, lengths)
+
+    @classmethod
+    def merge(cls, parts):
+        """合并多个段的倒排表（合并段时使用，不需要重新分词）
+
+        parts: [(倒排表, 保留的段内下标数组), ...]，保留的文本块按顺序重新编号
+        """
+        terms, docs, tfs, lengths = [], [], [], []
+        base = 0
+        for lexicon, kept in parts:
+            remap = np.full(len(lexicon), -1, dtype=np.int64)
+            remap[kept] = np.arange(len(kept)) + base
+            posting_terms = np.repeat(np.asarray(lexicon.terms), np.diff(lexicon.offsets))
+            posting_docs = remap[np.asarray(lexicon.docs)]
+            keep = posting_docs >= 0
+            terms.append(posting_terms[keep])
+            docs.append(posting_docs[keep])
+            tfs.append(np.asarray(lexicon.tfs)[keep])
+            lengths.append(np.asarray(lexicon.lengths)[kept])
+            base += len(kept)
+        if not parts:
+            return cls.build([])
+        return cls._from_postings(
+            np.concatenate(terms), np.concatenate(docs), np.concatenate(tfs), np.concatenate(lengths)
+        )
+
+    @staticmethod
+    def exists(path):
+        """段目录中是否已有倒排表（长度文件最后写入）"""
+        return (Path(path) / LENGTHS_FILE).exists()
+
+    def write(self, path):
+        """把倒排表写入段目录（每个文件先写临时文件再替换）"""
+        path = Path(path)
+        for name, array in (
+            (TERMS_FILE, self.terms), (OFFSETS_FILE, self.offsets),
+            (DOCS_FILE, self.docs), (TFS_FILE, self.tfs), (LENGTHS_FILE, self.lengths),
+        ):
+            tmp_file = path / (name + '.tmp')
+            with open(tmp_file, 'wb') as f:
+                np.save(f, np.asarray(array))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, path / name)
+
+    @classmethod
+    def load(cls, path):
+        """用mmap打开段目录中的倒排表"""
+        path = Path(path)
+        return cls(*(
+            np.load(path / name, mmap_mode='r')
+            for name in (TERMS_FILE, OFFSETS_FILE, DOCS_FILE, TFS_FILE, LENGTHS_FILE)
+        ))
+
+    def postings(self, term):
+        """词项的 (文本块下标数组, 词频数组)，词项不存在时为空数组"""
+        i = int(np.searchsorted(self.terms, term))
+        if i < len(self.terms) and self.terms[i] == term:
+            start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+            return self.docs[start:end], self.tfs[start:end]
+        return self.docs[:0], self.tfs[:0]
+
+
+class LexicalIndex:
+    """按段顺序拼接的BM25索引（下标与SegmentedDocuments一致）"""
+
+    def __init__(self, lexicons):
+        self.lexicons = list(lexicons)
+        self._starts = [0]
+        for lexicon in self.lexicons:
+            self._starts.append(self._starts[-1] + len(lexicon))
+        self._lengths = np.concatenate(
+            [np.asarray(lexicon.lengths, dtype=np.float32) for lexicon in self.lexicons]
+        ) if self.lexicons else np.zeros(0, dtype=np.float32)
+        self.avg_length = float(self._lengths.mean()) if len(self._lengths) else 0.0
+
+    def __len__(self):
+        return self._starts[-1]
+
+    def search(self, terms, k, mask=None):
+        """BM25检索，返回按分数降序的 (文本块下标, BM25分数, 命中的查询词数) 三个数组
+
+        mask: 可搜索的文本块位置掩码（有效位图、分区、过滤条件），None表示全部
+        """
+        count = len(self)
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int32))
+        if not terms or count == 0 or k <= 0:
+            return empty
+
+        k1, b = Config.KB_BM25_K1, Config.KB_BM25_B
+        scores = np.zeros(count, dtype=np.float32)
+        matched = np.zeros(count, dtype=np.int32)
+        for term in terms:
+            positions, tfs = [], []
+            for lexicon, start in zip(self.lexicons, self._starts):
+                docs, term_tfs = lexicon.postings(term)
+                if len(docs):
+                    positions.append(np.asarray(docs, dtype=np.int64) + start)
+                    tfs.append(np.asarray(term_tfs, dtype=np.float32))
+            if not positions:
+                continue
+            positions = np.concatenate(positions)
+            tfs = np.concatenate(tfs)
+            idf = math.log(1 + (count - len(positions) + 0.5) / (len(positions) + 0.5))
+            norm = k1 * (1 - b + b * self._lengths[positions] / max(self.avg_length, 1e-6))
+            scores[positions] += idf * tfs * (k1 + 1) / (tfs + norm)
+            matched[positions] += 1
+
+        if mask is not None:
+            matched[~mask[:count]] = 0
+        candidates = np.flatnonzero(matched)
+        if len(candidates) == 0:
+            return empty
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        order = np.argsort(-scores[candidates], kind='stable')
+        candidates = candidates[order]
+        return candidates, scores[candidates], matched[candidates]
+
+
+def is_decisive(terms, scores, matched):
+    """关键词查询的BM25结果是否足够明确，可以跳过向量检索和重排
+
+    查询词不超过KB_LEXICAL_FAST_MAX_TERMS个，排名第一的结果命中全部查询词、
+    BM25分数不低于KB_LEXICAL_MIN_SCORE，且不低于只命中部分查询词的最好结果的KB_LEXICAL_DECISIVE_RATIO倍。
+    """
+    if not 0 < len(terms) <= Config.KB_LEXICAL_FAST_MAX_TERMS or len(scores) == 0:
+        return False
+    if matched[0] < len(terms) or scores[0] < Config.KB_LEXICAL_MIN_SCORE:
+        return False
+    partial = scores[matched < len(terms)]
+    return len(partial) == 0 or scores[0] >= Config.KB_LEXICAL_DECISIVE_RATIO * partial.max()
@@ -0,0 +1,144 @@
+"""持久化的大模型生成结果缓存
+
+以 (模型名, 提示词哈希, 生成参数) 为键，把生成结果保存在SQLite文件中，进程重启后仍然有效。
+定时采集反复总结同一篇文章、热门问题使用相同上下文时，直接返回缓存结果，不再调用Ollama。
+条目写入后超过ttl秒失效；条目数超过上限时淘汰最久未使用的条目。
+"""
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from config import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def prompt_hash(prompt):
+    """提示词的SHA-256哈希"""
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+
+def options_key(options):
+    """生成参数的规范化表示（键排序）"""
+    return json.dumps(options or {}, sort_keys=True, ensure_ascii=False)
+
+
+class LLMCache:
+    """SQLite缓存，线程安全，带命中统计
+
+    ttl: 条目写入后的有效秒数，None表示不过期
+    max_entries: 最多保存的条目数
+    """
+
+    def __init__(self, path, ttl=None, max_entries=20000):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS llm_cache ('
+            ' model TEXT NOT NULL, prompt_hash TEXT NOT NULL, options TEXT NOT NULL,'
+            ' response TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL,'
+            ' PRIMARY KEY (model, prompt_hash, options))'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed)')
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, model, prompt, options=None):
+        """读取缓存的生成结果，不存在或已过期时返回None"""
+        key = (model, prompt_hash(prompt), options_key(options))
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT response, created FROM llm_cache WHERE model = ? AND prompt_hash = ? AND options = ?', key
+            ).fetchone()
+            if row is not None and self.ttl is not None and row[1] + self.ttl <= now:
+                self._conn.execute('DELETE FROM llm_cache WHERE model = ? AND prompt_hash = ? AND options = ?', key)
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                'UPDATE llm_cache SET accessed = ? WHERE model = ? AND prompt_hash = ? AND options = ?', (now,) + key
+            )
+            self.hits += 1
+            return row[0]
+
+    def put(self, model, prompt, options, response):
+        """写入生成结果，超出条目上限时淘汰最久未使用的条目"""
+        if self.max_entries <= 0 or not response:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?)',
+                (model, prompt_hash(prompt), options_key(options), response, now, now)
+            )
+            count = self._conn.execute('SELECT COUNT(*) FROM llm_cache').fetchone()[0]
+            if count > self.max_entries:
+                deleted = self._conn.execute(
+                    'DELETE FROM llm_cache WHERE rowid IN '
+                    '(SELECT rowid FROM llm_cache ORDER BY accessed LIMIT ?)', (count - self.max_entries,)
+                ).rowcount
+                self.evictions += deleted
+
+    def purge_expired(self):
+        """删除所有过期条目，返回删除的条数"""
+        if self.ttl is None:
+            return 0
+        with self._lock:
+            return self._conn.execute(
+                'DELETE FROM llm_cache WHERE created <= ?', (time.time() - self.ttl,)
+            ).rowcount
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._conn.execute('DELETE FROM llm_cache')
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM llm_cache').fetchone()[0]
+
+    def get_stats(self):
+        """缓存统计信息"""
+        size = len(self)
+        with self._lock:
+            return {
+                'size': size,
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """按配置创建的共享缓存（未启用时返回None）"""
+    global _default_cache
+    if not Config.LLM_CACHE_ENABLED:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = LLMCache(
+                Config.LLM_CACHE_PATH,
+                ttl=Config.LLM_CACHE_TTL or None,
+                max_entries=Config.LLM_CACHE_MAX_ENTRIES
+            )
+            logger.info(f"大模型生成结果缓存: {Config.LLM_CACHE_PATH}（{len(_default_cache)} 条）")
+        return _default_cache
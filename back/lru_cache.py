@@ -0,0 +1,69 @@
+"""线程安全的LRU缓存，带命中统计和可选的过期时间"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """按最近使用淘汰的有界缓存
+
+    ttl: 条目写入后的有效秒数，None表示不过期
+    """
+
+    def __init__(self, max_items=1024, ttl=None):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._entries = OrderedDict()  # 键 -> (过期时间, 值)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """读取缓存，命中时移到最近使用的位置"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        if self.max_items <= 0:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """移除并返回条目"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return default if entry is None else entry[1]
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_stats(self):
+        """缓存统计信息"""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_items': self.max_items,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
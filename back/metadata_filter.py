@@ -0,0 +1,197 @@
+"""按元数据过滤检索范围
+
+过滤表达式是一个字典，各字段之间为“且”，列表中的多个取值为“或”：
+
+    {
+        "source": "新华网",                     # 等值，也可以是列表
+        "file_type": ["pdf", "txt"],
+        "file_name": ["a.pdf"],
+        "published": {"from": "2024-01-01", "to": "2024-06-30"}   # 闭区间，可只给一端
+    }
+
+过滤在ANN搜索之前完成：每个字段预先计算好逐文本块的取值编码数组
+（发布时间为排序后的时间戳数组），过滤时只做向量化比较，
+得到的位图与有效位图合并后作为IDSelector交给FAISS，不需要多取结果再过滤。
+"""
+import json
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import numpy as np
+from lru_cache import LRUCache
+
+# 等值过滤的字段（kb_name为统一存储模式下的分区字段）
+EQUALITY_FIELDS = ('source', 'file_type', 'file_name', 'kb_name')
+# 范围过滤的字段
+RANGE_FIELDS = ('published',)
+
+
+def _to_timestamp(value):
+    """把ISO格式或RSS格式（RFC 2822）的时间解析为时间戳，无法解析时返回None"""
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    elif isinstance(value, str) and value.strip():
+        text = value.strip()
+        try:
+            parsed = datetime.fromisoformat(text.replace('Z', '+00:00'))
+        except ValueError:
+            try:
+                parsed = parsedate_to_datetime(text)
+            except (TypeError, ValueError, IndexError):
+                return None
+    else:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def parse_tags(tags):
+    """解析FileMetadata中的标签（JSON数组或逗号分隔的字符串）"""
+    if isinstance(tags, (list, tuple, set)):
+        values = tags
+    elif not tags:
+        return set()
+    else:
+        try:
+            values = json.loads(tags)
+        except ValueError:
+            values = None
+        if not isinstance(values, list):
+            values = str(tags).replace('，', ',').split(',')
+    return {str(tag).strip() for tag in values if str(tag).strip()}
+
+
+def _is_date(value):
+    """是否为不带时间的日期字符串（如 2024-06-30）"""
+    return isinstance(value, str) and len(value.strip()) == 10
+
+
+class MetadataFilter:
+    """解析后的过滤表达式"""
+
+    def __init__(self, equals=None, ranges=None):
+        self.equals = equals or {}   # 字段 -> 允许的取值集合
+        self.ranges = ranges or {}   # 字段 -> (下界, 上界)，None表示不限
+
+    @classmethod
+    def parse(cls, expression):
+        """解析过滤表达式，格式错误时抛出ValueError"""
+        if isinstance(expression, cls):
+            return expression
+        if not isinstance(expression, dict):
+            raise ValueError('过滤条件必须是对象')
+
+        equals, ranges = {}, {}
+        for field, value in expression.items():
+            if field in EQUALITY_FIELDS:
+                values = value if isinstance(value, (list, tuple, set, frozenset)) else [value]
+                equals[field] = frozenset(str(v) for v in values)
+            elif field in RANGE_FIELDS:
+                if not isinstance(value, dict) or not set(value) <= {'from', 'to'}:
+                    raise ValueError(f'{field} 过滤条件格式应为 {{"from": ..., "to": ...}}')
+                bounds = []
+                for key in ('from', 'to'):
+                    bound = value.get(key)
+                    timestamp = None if bound in (None, '') else _to_timestamp(bound)
+                    if bound not in (None, '') and timestamp is None:
+                        raise ValueError(f'无法解析的时间: {bound}')
+                    if key == 'to' and timestamp is not None and _is_date(bound):
+                        # 只给日期时上界包含当天
+                        timestamp += 86400 - 1e-3
+                    bounds.append(timestamp)
+                ranges[field] = tuple(bounds)
+            else:
+                raise ValueError(f'不支持的过滤字段: {field}')
+        return cls(equals, ranges)
+
+    def __bool__(self):
+        return bool(self.equals or self.ranges)
+
+    def key(self):
+        """规范化的表示，可用作缓存键"""
+        return json.dumps({
+            'equals': {field: sorted(values) for field, values in self.equals.items()},
+            'ranges': self.ranges,
+        }, sort_keys=True)
+
+
+class AttributeIndex:
+    """文档序列的逐字段属性数组，按需构建，用于快速计算过滤位图
+
+    - 等值字段：取值 -> 编码的字典 + 每个文本块的编码数组（int32）
+    - 范围字段：每个文本块的时间戳排序后的数组及对应的文本块下标
+
+    只对去重后的元数据表求值，再按meta_ids展开，不需要读取文本。
+    文档序列不可变（追加、合并都会产生新的序列），属性数组构建后无需更新。
+    """
+
+    def __init__(self, documents, max_masks=64):
+        self.documents = documents
+        self._codes = {}
+        self._sorted = {}
+        # 过滤条件 -> 位置掩码（同一过滤条件的翻页、重复查询直接复用）
+        self._masks = LRUCache(max_masks)
+
+    def __len__(self):
+        return len(self.documents)
+
+    def _expand(self, values_of):
+        """按段把元数据表上的取值展开为逐文本块的数组"""
+        return [np.asarray(values_of(store.metadata_table))[np.asarray(store.meta_ids)]
+                for store in self.documents.stores if len(store)]
+
+    def _field_codes(self, field):
+        """等值字段的 (取值->编码, 逐文本块编码数组)，缺失该字段的编码为-1"""
+        if field not in self._codes:
+            vocabulary = {}
+
+            def values_of(table):
+                codes = []
+                for metadata in table:
+                    value = metadata.get(field)
+                    codes.append(-1 if value in (None, '') else vocabulary.setdefault(str(value), len(vocabulary)))
+                return np.array(codes, dtype=np.int32)
+
+            parts = self._expand(values_of)
+            codes = np.concatenate(parts) if parts else np.zeros(0, dtype=np.int32)
+            self._codes[field] = (vocabulary, codes)
+        return self._codes[field]
+
+    def _field_sorted(self, field):
+        """范围字段的 (排序后的时间戳, 对应的文本块下标)，无法解析的时间不参与排序"""
+        if field not in self._sorted:
+            def values_of(table):
+                timestamps = [_to_timestamp(metadata.get(field)) for metadata in table]
+                return np.array([np.nan if t is None else t for t in timestamps], dtype=np.float64)
+
+            parts = self._expand(values_of)
+            timestamps = np.concatenate(parts) if parts else np.zeros(0, dtype=np.float64)
+            positions = np.flatnonzero(~np.isnan(timestamps))
+            order = np.argsort(timestamps[positions], kind='stable')
+            self._sorted[field] = (timestamps[positions][order], positions[order])
+        return self._sorted[field]
+
+    def mask(self, metadata_filter):
+        """满足过滤条件的文本块位置掩码（只读bool数组，长度为文本块数）"""
+        key = metadata_filter.key()
+        mask = self._masks.get(key)
+        if mask is not None:
+            return mask
+
+        mask = np.ones(len(self), dtype=bool)
+        for field, values in metadata_filter.equals.items():
+            vocabulary, codes = self._field_codes(field)
+            wanted = [vocabulary[value] for value in values if value in vocabulary]
+            mask &= np.isin(codes, wanted)
+        for field, (low, high) in metadata_filter.ranges.items():
+            timestamps, positions = self._field_sorted(field)
+            start = 0 if low is None else np.searchsorted(timestamps, low, side='left')
+            end = len(timestamps) if high is None else np.searchsorted(timestamps, high, side='right')
+            in_range = np.zeros(len(self), dtype=bool)
+            in_range[positions[start:end]] = True
+            mask &= in_range
+        mask.flags.writeable = False
+        self._masks.put(key, mask)
+        return mask
@@ -0,0 +1,102 @@
+"""模型注册表：进程内共享的嵌入模型和重排模型
+
+每个模型在进程内只加载一次（首次使用时才加载），所有KnowledgeBase实例共享同一个对象。
+"""
+import threading
+import logging
+from config import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    """线程安全的懒加载模型注册表"""
+
+    def __init__(self):
+        self._models = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def get(self, key, loader):
+        """获取模型，不存在时调用loader加载（同一key并发调用只会加载一次）"""
+        if key in self._models:
+            return self._models[key]
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # 按key加锁，避免加载一个模型时阻塞其他模型的获取
+        with key_lock:
+            if key not in self._models:
+                self._models[key] = loader()
+            return self._models[key]
+
+    def is_loaded(self, key):
+        """模型是否已加载"""
+        return key in self._models
+
+    def clear(self):
+        """释放所有已加载的模型"""
+        with self._lock:
+            self._models.clear()
+
+
+_registry = ModelRegistry()
+
+
+def _load_embedding_model(model_name):
+    from sentence_transformers import SentenceTransformer
+    logger.info(f"加载嵌入模型: {model_name}")
+    return SentenceTransformer(model_name)
+
+
+def _load_rerank_model():
+    logger.info(f"加载重排模型: {Config.RERANK_MODEL_NAME}")
+    try:
+        from sentence_transformers import CrossEncoder
+        model = CrossEncoder(Config.RERANK_MODEL_NAME)
+        logger.info("重排模型加载成功")
+        return model
+    except Exception as e:
+        logger.warning(f"重排模型加载失败: {e}，尝试使用sentence-transformer版本")
+    try:
+        # 如果cross-encoder失败，尝试sentence-transformer版本
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(Config.RERANK_FALLBACK_MODEL_NAME)
+        logger.info("使用sentence-transformer版本的重排模型")
+        return model
+    except Exception as e:
+        logger.warning(f"sentence-transformer版本也加载失败: {e}，使用嵌入模型代替")
+        return None
+
+
+def _load_context_tokenizer():
+    logger.info(f"加载上下文分词器: {Config.CONTEXT_TOKENIZER_NAME}")
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(Config.CONTEXT_TOKENIZER_NAME)
+    except Exception as e:
+        logger.warning(f"上下文分词器加载失败: {e}，按字符估算token数")
+        return None
+
+
+def get_embedding_model(model_name=None):
+    """获取共享的嵌入模型（model_name默认为当前配置的模型；更换模型后，尚未重新生成向量的知识库仍使用原模型）"""
+    model_name = model_name or Config.EMBEDDING_MODEL_NAME
+    return _registry.get(('embedding', model_name), lambda: _load_embedding_model(model_name))
+
+
+def get_rerank_model():
+    """获取共享的重排模型（加载失败时返回None）"""
+    return _registry.get(('rerank', Config.RERANK_MODEL_NAME), _load_rerank_model)
+
+
+def get_context_tokenizer():
+    """获取共享的上下文分词器（与生成模型同系列，加载失败时返回None）"""
+    return _registry.get(('tokenizer', Config.CONTEXT_TOKENIZER_NAME), _load_context_tokenizer)
+
+
+def get_registry():
+    """获取全局模型注册表"""
+    return _registry
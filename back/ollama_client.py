@@ -1,113 +1,144 @@
-import ollama
+import os
 import logging
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from config import Config
+from llm_cache import get_llm_cache, prompt_hash, options_key
+from async_ollama import get_runtime, normalize_host
+from circuit_breaker import CircuitBreaker
+from single_flight import SingleFlight, Abandoned
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def _candidate_hosts():
+    """依次尝试的Ollama地址：OLLAMA_HOST环境变量、127.0.0.1、localhost
+    
+    Ollama服务端常把OLLAMA_HOST设为0.0.0.0（监听所有地址），客户端无法连接0.0.0.0，改用127.0.0.1。
+    """
+    hosts = []
+    for host in (os.environ.get('OLLAMA_HOST'), 'http://127.0.0.1:11434', 'http://localhost:11434'):
+        if host:
+            host = normalize_host(host.replace('0.0.0.0', '127.0.0.1'))
+            if host not in hosts:
+                hosts.append(host)
+    return hosts
+
+
 class OllamaClient:
-    def __init__(self, model_name='qwen3:4b'):
+    def __init__(self, model_name='qwen3:4b', cache=None, probe_interval=None):
         """
-        初始化Ollama客户端
+        初始化Ollama客户端（不阻塞：连接探测在后台线程中进行）
         
         Args:
             model_name: 要使用的模型名称，默认为'qwen3:4b'
                        注意：确保该模型已通过 'ollama pull <model_name>' 安装
+            cache: 生成结果缓存（LLMCache），默认使用按配置创建的共享缓存
+            probe_interval: 后台重新探测的间隔（秒），默认Config.OLLAMA_PROBE_INTERVAL，0表示只探测一次
         """
         self.model_name = model_name
-        self.client = None
+        self.cache = cache if cache is not None else get_llm_cache()
+        self.host = None
+        self.runtime = None  # 生成请求使用的异步运行时（共用连接池和并发上限）
         self.available = False
-        
-        try:
-            # 步骤1: 创建Ollama客户端实例
-            # 优先使用127.0.0.1而不是0.0.0.0，因为Python客户端可能无法连接到0.0.0.0
-            import os
-            # 临时覆盖OLLAMA_HOST环境变量，使用127.0.0.1
-            original_host = os.environ.get('OLLAMA_HOST')
+        self.installed_models = []
+        self._state = None  # 上一次探测的状态（ready / model_missing / unavailable），用于只在变化时输出日志
+        # 生成请求连续失败时熔断，断开期间直接返回，不再等待超时
+        self.breaker = CircuitBreaker(
+            failure_threshold=Config.OLLAMA_BREAKER_FAILURES,
+            reset_timeout=Config.OLLAMA_BREAKER_RESET
+        )
+        # 正在进行的相同生成请求只发送一次
+        self._flights = SingleFlight()
+        self.probe_interval = Config.OLLAMA_PROBE_INTERVAL if probe_interval is None else probe_interval
+        self._probe_now = threading.Event()
+        self._probe_thread = threading.Thread(target=self._probe_loop, name='ollama-probe', daemon=True)
+        self._probe_thread.start()
+    
+    def probe(self):
+        """探测一次Ollama服务：依次尝试候选地址，检查模型是否已安装，返回是否可用"""
+        error = None
+        for host in _candidate_hosts():
             try:
-                # 使用127.0.0.1而不是0.0.0.0
-                os.environ['OLLAMA_HOST'] = 'http://127.0.0.1:11434'
-                logger.info(f"设置OLLAMA_HOST为: http://127.0.0.1:11434")
-                
-                # 尝试多种连接方式以确保能够连接
-                self.client = None
-                connection_attempts = [
-                    {'host': 'http://127.0.0.1:11434'},  # 显式指定127.0.0.1
-                    {'host': '127.0.0.1:11434'},        # 只指定host:port
-                    {'host': 'http://localhost:11434'}, # localhost
-                    {},                                  # 使用默认连接（会使用环境变量）
-                ]
-                
-                for attempt in connection_attempts:
-                    try:
-                        logger.info(f"尝试连接Ollama: {attempt if attempt else '默认连接'}")
-                        self.client = ollama.Client(**attempt) if attempt else ollama.Client()
-                        # 测试连接
-                        models_response = self.client.list()
-                        logger.info(f"Ollama客户端创建成功，连接方式: {attempt if attempt else '默认'}")
-                        break
-                    except Exception as e:
-                        logger.warning(f"连接尝试失败: {e}")
-                        continue
-                
-                if not self.client:
-                    raise Exception("所有连接方式都失败")
-                
-                # 步骤2: 测试连接 - 尝试列出已安装的模型
-                models_response = self.client.list()
-            finally:
-                # 恢复原始环境变量
-                if original_host:
-                    os.environ['OLLAMA_HOST'] = original_host
-                elif 'OLLAMA_HOST' in os.environ:
-                    del os.environ['OLLAMA_HOST']
-            # 处理不同版本的ollama库返回格式
-            # 新版本返回Model对象列表，旧版本返回字典列表
-            installed_models = []
-            if hasattr(models_response, 'models'):
-                # 新版本：models_response是ListResponse对象
-                models_list = models_response.models
-            elif isinstance(models_response, dict):
-                # 旧版本：返回字典
-                models_list = models_response.get('models', [])
+                runtime = get_runtime(host)
+                installed_models = runtime.list_models(timeout=Config.OLLAMA_PROBE_TIMEOUT)
+            except Exception as e:
+                error = e
+                continue
+            self.host, self.runtime, self.installed_models = host, runtime, installed_models
+            self.available = self.model_name in installed_models
+            if self.available:
+                self._log_state('ready', f"Ollama服务连接成功（{host}），模型 '{self.model_name}' 已安装并可用")
             else:
-                # 直接是列表
-                models_list = models_response
-            
-            for model in models_list:
-                if hasattr(model, 'model'):
-                    # Model对象，使用.model属性
-                    installed_models.append(model.model)
-                elif isinstance(model, dict):
-                    # 字典，使用['name']键
-                    installed_models.append(model.get('name', ''))
-                else:
-                    # 字符串
-                    installed_models.append(str(model))
-            
-            logger.info(f"Ollama服务连接成功，已安装的模型: {installed_models}")
-            
-            # 步骤3: 检查指定的模型是否已安装
-            if model_name in installed_models:
-                self.available = True
-                logger.info(f"初始化Ollama客户端成功，模型 '{model_name}' 已安装并可用")
+                self._log_state(
+                    'model_missing',
+                    f"模型 '{self.model_name}' 未安装。已安装的模型: {installed_models}",
+                    f"请运行 'ollama pull {self.model_name}' 安装该模型，安装后自动恢复"
+                )
+            return self.available
+        
+        self.available = False
+        self._log_state(
+            'unavailable',
+            f"Ollama服务不可用: {error}",
+            "可能的原因：",
+            "1. Ollama服务未启动 - 请运行 'ollama serve' 或启动Ollama应用",
+            "2. Ollama未安装 - 请访问 https://ollama.com 下载安装",
+            "3. 服务运行在不同端口 - 请检查OLLAMA_HOST环境变量",
+            "将使用简化模式（备用语义分析），服务恢复后自动重新连接"
+        )
+        return False
+    
+    def _log_state(self, state, *messages):
+        # 只在状态变化时输出，避免定期探测刷屏
+        if state == self._state:
+            return
+        self._state = state
+        for message in messages:
+            if state == 'ready':
+                logger.info(message)
             else:
-                logger.warning(f"模型 '{model_name}' 未安装。已安装的模型: {installed_models}")
-                logger.warning(f"请运行 'ollama pull {model_name}' 安装该模型")
-                logger.warning("Ollama客户端将使用简化模式（备用语义分析）")
-                self.available = False
-                
-        except Exception as e:
-            logger.warning(f"Ollama服务不可用: {e}")
-            logger.warning("可能的原因：")
-            logger.warning("1. Ollama服务未启动 - 请运行 'ollama serve' 或启动Ollama应用")
-            logger.warning("2. Ollama未安装 - 请访问 https://ollama.com 下载安装")
-            logger.warning("3. 服务运行在不同端口 - 请检查OLLAMA_HOST环境变量")
-            logger.warning("将使用简化模式（备用语义分析）")
-            self.available = False
+                logger.warning(message)
+    
+    def _probe_loop(self):
+        """后台探测：启动时立即探测，之后定期重新探测；生成失败时提前探测"""
+        while True:
+            try:
+                self.probe()
+            except Exception as e:
+                logger.error(f"Ollama探测失败: {e}")
+            if not self.probe_interval:
+                return
+            self._probe_now.wait(self.probe_interval)
+            self._probe_now.clear()
+    
+    def _allow_request(self):
+        """服务可用且熔断器放行时才发送生成请求"""
+        if not self.available or not self.runtime:
+            logger.warning("Ollama不可用，无法生成文本")
+            return False
+        if not self.breaker.allow():
+            logger.warning("Ollama熔断中，跳过生成请求")
+            return False
+        return True
+    
+    def _record_failure(self):
+        self.breaker.record_failure()
+        self._probe_now.set()
+    
+    @staticmethod
+    def _generate_options(max_tokens):
+        """生成参数"""
+        return {
+            'num_predict': max_tokens,
+            'temperature': 0.7
+        }
     
     def generate(self, prompt, max_tokens=500):
         """
-        生成文本（使用chat API，更稳定可靠）
+        生成文本（使用chat API，更稳定可靠），相同模型、提示词和参数的结果从缓存返回，
+        正在生成的相同请求只生成一次，并发的调用者共享结果
         
         Args:
             prompt: 输入提示词
@@ -116,8 +147,24 @@ class OllamaClient:
         Returns:
             str: 生成的文本
         """
-        if not self.available or not self.client:
-            logger.warning("Ollama不可用，无法生成文本")
+        options = self._generate_options(max_tokens)
+        if self.cache is not None:
+            cached = self.cache.get(self.model_name, prompt, options)
+            if cached is not None:
+                return cached
+        
+        return self._flights.do(
+            self._flight_key(prompt, options),
+            lambda: self._generate_uncached(prompt, options)
+        )
+    
+    def _flight_key(self, prompt, options):
+        """相同请求的键（与生成结果缓存的键一致）"""
+        return (self.model_name, prompt_hash(prompt), options_key(options))
+    
+    def _generate_uncached(self, prompt, options):
+        """向Ollama发送生成请求，失败时返回None"""
+        if not self._allow_request():
             return None
         
         try:
@@ -130,51 +177,176 @@ class OllamaClient:
                 }
             ]
             
-            response = self.client.chat(
-                model=self.model_name,
-                messages=messages,
-                options={
-                    'num_predict': max_tokens,
-                    'temperature': 0.7
-                }
-            )
-            
-            # chat API返回格式: {'message': {'role': 'assistant', 'content': '...'}, ...}
-            generated_text = response.get('message', {}).get('content', '')
+            # 请求超过并发上限时在运行时中排队
+            generated_text = self.runtime.chat(self.model_name, messages, options)
+            self.breaker.record_success()
             
             if generated_text:
                 logger.info(f"Ollama生成成功，生成了 {len(generated_text)} 个字符")
+                if self.cache is not None:
+                    self.cache.put(self.model_name, prompt, options, generated_text)
                 return generated_text
             else:
                 logger.warning("Ollama返回空内容")
                 return ''
                 
         except Exception as e:
+            self._record_failure()
             logger.error(f"Ollama生成失败: {e}", exc_info=True)
             return None
     
+    def chat_stream(self, messages, options=None, deadline=None):
+        """
+        流式对话，逐段产出模型生成的文本
+        
+        提前关闭生成器（如客户端断开连接）时会关闭与Ollama的HTTP连接，
+        Ollama随即停止生成，不再占用本地模型。
+        
+        Args:
+            messages: 消息列表
+            options: 生成参数
+            deadline: time.monotonic()的截止时刻，超过时关闭连接并抛出TimeoutError（不计入熔断失败）
+        
+        Yields:
+            str: 新生成的文本片段
+        """
+        if not self._allow_request():
+            return
+        
+        stream = self.runtime.chat_stream(self.model_name, messages, options, deadline=deadline)
+        generated_chars = 0
+        finished = False
+        failed = False
+        try:
+            for content in stream:
+                generated_chars += len(content)
+                yield content
+            finished = True
+        except TimeoutError:
+            # 到达调用方的截止时间，不说明Ollama出错
+            raise
+        except Exception:
+            failed = True
+            raise
+        finally:
+            # 正常结束时stream已读完；提前退出时关闭连接以取消生成
+            stream.close()
+            # 提前关闭（客户端断开）不算失败；还没收到任何片段就关闭时也不能说明Ollama正常，
+            # 不改变熔断状态（半开状态下只释放试探名额）
+            if failed:
+                self._record_failure()
+            elif finished or generated_chars:
+                self.breaker.record_success()
+            else:
+                self.breaker.release()
+            if finished:
+                logger.info(f"Ollama流式生成完成，生成了 {generated_chars} 个字符")
+            else:
+                logger.info(f"Ollama流式生成提前结束，已生成 {generated_chars} 个字符")
+    
+    def generate_stream(self, prompt, max_tokens=500, deadline=None):
+        """
+        流式生成文本（参数与generate相同），缓存命中或合并到正在进行的相同请求时一次性产出完整结果
+        
+        deadline: time.monotonic()的截止时刻；生成或等待相同请求超过该时刻时抛出TimeoutError
+        
+        Yields:
+            str: 新生成的文本片段
+        """
+        options = self._generate_options(max_tokens)
+        if self.cache is not None:
+            cached = self.cache.get(self.model_name, prompt, options)
+            if cached is not None:
+                yield cached
+                return
+        
+        # 已有相同的请求正在生成时等待其完成，一次性产出完整结果；
+        # 该请求被客户端提前关闭时（Abandoned）自己生成
+        key = self._flight_key(prompt, options)
+        while True:
+            future, leader = self._flights.begin(key)
+            if leader:
+                break
+            try:
+                text = future.result(None if deadline is None else max(deadline - time.monotonic(), 0))
+            except Abandoned:
+                continue
+            except FutureTimeoutError:
+                raise TimeoutError('等待相同的生成请求超过截止时间') from None
+            if text:
+                yield text
+            return
+        
+        messages = [
+            {
+                'role': 'user',
+                'content': prompt
+            }
+        ]
+        generated = []
+        try:
+            for chunk in self.chat_stream(messages, options=options, deadline=deadline):
+                generated.append(chunk)
+                yield chunk
+        except (GeneratorExit, TimeoutError):
+            # 截止时间是本次调用自己的，等待者各自重新生成
+            self._flights.finish(key, future, error=Abandoned())
+            raise
+        except Exception:
+            self._flights.finish(key, future, None)
+            raise
+        # 只缓存完整生成的结果（提前关闭时不会执行到这里）；先写缓存再唤醒等待者，之后的调用直接命中缓存
+        text = ''.join(generated)
+        if self.cache is not None:
+            self.cache.put(self.model_name, prompt, options, text)
+        self._flights.finish(key, future, text or None)
+    
     def chat(self, messages):
         """对话"""
+        if not self._allow_request():
+            return "对话失败: Ollama不可用"
         try:
-            response = self.client.chat(
-                model=self.model_name,
-                messages=messages
-            )
-            return response['message']['content']
+            response = self.runtime.chat(self.model_name, messages)
+            self.breaker.record_success()
+            return response
         except Exception as e:
+            self._record_failure()
             logger.error(f"Ollama对话失败: {e}")
             return f"对话失败: {str(e)}"
     
     def summarize(self, text, max_length=200):
-        """摘要生成"""
+        """摘要生成，Ollama不可用或生成失败时返回截断的原文"""
+        if not self.available:
+            return self._truncate(text, max_length)
+        summary = self.generate(self._summary_prompt(text, max_length), max_tokens=max_length)
+        return summary if summary is not None else self._truncate(text, max_length)
+    
+    def summarize_stream(self, text, max_length=200):
+        """流式摘要生成，Ollama不可用时一次性产出截断的原文"""
         if not self.available:
-            return text[:max_length] + "..." if len(text) > max_length else text
-        prompt = f"请为以下文本生成简洁的摘要（不超过{max_length}字）：\n\n{text}"
-        return self.generate(prompt, max_tokens=max_length)
+            yield self._truncate(text, max_length)
+            return
+        yield from self.generate_stream(self._summary_prompt(text, max_length), max_tokens=max_length)
+    
+    @staticmethod
+    def _truncate(text, max_length):
+        return text[:max_length] + "..." if len(text) > max_length else text
+    
+    @staticmethod
+    def _summary_prompt(text, max_length):
+        return f"请为以下文本生成简洁的摘要（不超过{max_length}字）：\n\n{text}"
     
     def answer_question(self, question, context):
         """基于上下文回答问题"""
-        prompt = f"""基于以下上下文回答问题。如果上下文中没有相关信息，请说明。
+        return self.generate(self._answer_prompt(question, context), max_tokens=300)
+    
+    def answer_question_stream(self, question, context, deadline=None):
+        """基于上下文流式回答问题，deadline见generate_stream"""
+        yield from self.generate_stream(self._answer_prompt(question, context), max_tokens=300, deadline=deadline)
+    
+    @staticmethod
+    def _answer_prompt(question, context):
+        return f"""基于以下上下文回答问题。如果上下文中没有相关信息，请说明。
 
 上下文：
 {context}
@@ -182,5 +354,13 @@ class OllamaClient:
 问题：{question}
 
 答案："""
-        return self.generate(prompt, max_tokens=300)
-
+    
+    def get_stats(self):
+        """服务状态、熔断器状态和生成请求的并发统计（当前占用、排队数、峰值、平均等待时间）"""
+        return {
+            'host': self.host,
+            'available': self.available,
+            'breaker': self.breaker.get_stats(),
+            'single_flight': self._flights.get_stats(),
+            'requests': self.runtime.get_stats() if self.runtime is not None else None,
+        }
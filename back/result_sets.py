@@ -0,0 +1,95 @@
+"""搜索结果集与分页游标
+
+第一次搜索把合并、重排后的全部候选结果保存为服务端结果集（带过期时间），
+返回不透明的游标；之后的翻页只对结果集切片，不再检索和重排。
+翻到候选结果之外时，可以按更大的每库候选数重新检索，把新增结果追加到结果集末尾，
+已经返回过的结果顺序保持不变。
+"""
+import base64
+import json
+import secrets
+import threading
+from config import Config
+from lru_cache import LRUCache
+
+
+class ResultSet:
+    """一次搜索的候选结果"""
+
+    def __init__(self, query, kb_names, metadata_filter, results, per_kb_top_k, exhausted, info=None):
+        self.id = secrets.token_urlsafe(12)
+        self.query = query
+        self.kb_names = list(kb_names)
+        self.metadata_filter = metadata_filter
+        self.results = results
+        self.per_kb_top_k = per_kb_top_k   # 每个知识库已取回的候选数
+        self.exhausted = exhausted         # 是否已经没有更多候选
+        self.info = info or {}             # 搜索统计信息（各知识库结果数、是否联网搜索等）
+        self.lock = threading.Lock()       # 扩充候选时加锁，同一结果集只扩充一次
+
+    def __len__(self):
+        return len(self.results)
+
+    def has_more(self, offset):
+        """offset之后是否还有结果（包括尚未取回的候选）"""
+        return offset < len(self.results) or not self.exhausted
+
+
+def result_set_key(query, kb_names, metadata_filter):
+    """相同查询、知识库和过滤条件共用一个结果集（兼容只传page的翻页请求）"""
+    return json.dumps(
+        [' '.join(query.split()), sorted(kb_names), metadata_filter.key() if metadata_filter else None],
+        ensure_ascii=False
+    )
+
+
+class ResultSetStore:
+    """按ID保存结果集，数量有上限，过期自动失效"""
+
+    def __init__(self, max_items=256, ttl=600):
+        self._sets = LRUCache(max_items, ttl=ttl)
+        self._ids_by_key = LRUCache(max_items, ttl=ttl)
+
+    def add(self, key, result_set):
+        """保存结果集"""
+        self._sets.put(result_set.id, result_set)
+        self._ids_by_key.put(key, result_set.id)
+        return result_set
+
+    def get(self, set_id):
+        """按ID取结果集，不存在或已过期时返回None"""
+        return self._sets.get(set_id)
+
+    def find(self, key):
+        """按查询条件取结果集"""
+        set_id = self._ids_by_key.get(key)
+        return None if set_id is None else self._sets.get(set_id)
+
+    def get_stats(self):
+        """结果集缓存统计信息"""
+        return self._sets.get_stats()
+
+
+def encode_cursor(set_id, offset):
+    """生成游标：结果集ID + 下一页的起始位置"""
+    payload = json.dumps({'id': set_id, 'offset': offset}, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析游标，返回 (结果集ID, 起始位置)，格式错误时抛出ValueError"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        set_id, offset = payload['id'], int(payload['offset'])
+    except (TypeError, KeyError, ValueError, UnicodeError) as e:
+        raise ValueError(f'无效的游标: {e}')
+    if not isinstance(set_id, str) or offset < 0:
+        raise ValueError('无效的游标')
+    return set_id, offset
+
+
+result_sets = ResultSetStore(
+    max_items=Config.KB_RESULT_SET_MAX_ITEMS,
+    ttl=Config.KB_RESULT_SET_TTL
+)
@@ -3,8 +3,10 @@ from apscheduler.triggers.cron import CronTrigger
 from datetime import datetime
 import logging
 from news_crawler import NewsCrawler
-from knowledge_base import KnowledgeBase
+from kb_pool import get_knowledge_base
 from ollama_client import OllamaClient
+from context_builder import truncate_to_tokens
+from config import Config
 from models import db, User
 import atexit
 
@@ -63,7 +65,10 @@ class NewsScheduler:
                     # 使用Ollama生成摘要
                     content = article.get('content', '')
                     if len(content) > 500:
-                        summary = self.ollama_client.summarize(content[:1000], max_length=200)
+                        # 按token数截断原文（提示词越长生成越慢）
+                        summary = self.ollama_client.summarize(
+                            truncate_to_tokens(content, Config.SUMMARY_MAX_INPUT_TOKENS), max_length=200
+                        )
                         article['summary'] = summary
                     
                     text = f"标题：{article.get('title', '')}\n内容：{article.get('content', '')}"
@@ -78,9 +83,7 @@ class NewsScheduler:
                     })
                 
                 # 添加到default知识库（确保定时任务采集的新闻可以被搜索到）
-                default_kb = KnowledgeBase(db_path='instance/faiss_index_default')
-                default_kb.add_documents(texts, metadata_list)
-                del default_kb
+                get_knowledge_base('default').add_documents(texts, metadata_list)
                 
                 # 同时添加到全局kb实例（保持兼容）
                 self.kb.add_documents(texts, metadata_list)
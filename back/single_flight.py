@@ -0,0 +1,70 @@
+"""相同请求合并（single-flight）
+
+同一时刻键相同的多个调用只执行一次：第一个调用者（leader）执行，
+其余调用者（follower）等待同一个Future，得到相同的结果或异常。
+执行结束后键即被移除，之后的调用会重新执行（结果复用由缓存负责）。
+"""
+import threading
+from concurrent.futures import Future
+
+
+class Abandoned(Exception):
+    """leader没有完成（如流式生成被客户端提前关闭），follower需要自己执行"""
+
+
+class SingleFlight:
+    """线程安全的相同请求合并"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def begin(self, key):
+        """开始一次调用，返回 (Future, 是否为leader)；leader执行完成后必须调用finish"""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            self.leaders += 1
+            return future, True
+
+    def finish(self, key, future, result=None, error=None):
+        """leader结束调用，唤醒所有follower"""
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, fn):
+        """执行fn，键相同的并发调用共享同一次执行的结果"""
+        while True:
+            future, leader = self.begin(key)
+            if not leader:
+                try:
+                    return future.result()
+                except Abandoned:
+                    continue
+            try:
+                result = fn()
+            except BaseException as e:
+                self.finish(key, future, error=e if isinstance(e, Exception) else Abandoned())
+                raise
+            self.finish(key, future, result)
+            return result
+
+    def get_stats(self):
+        """合并统计：进行中的调用数、实际执行次数、被合并的调用数"""
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+            }
@@ -0,0 +1,179 @@
+"""
+本地模拟的Ollama HTTP服务（测试和基准测试用）
+
+实现 /api/tags 和 /api/chat（流式与非流式），每个文本片段按固定延迟生成，
+记录同时进行的生成请求数、峰值、完成数和被客户端中途断开的请求数。
+
+单独运行时启动服务，或用 --bench 对异步客户端做并发基准测试：
+    python tests/fake_ollama.py --port 11434 --delay 0.05
+    python tests/fake_ollama.py --bench 50 --max-in-flight 10
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class FakeOllamaServer:
+    """模拟的Ollama服务，port为0时使用随机端口"""
+
+    def __init__(self, port=0, models=('qwen3:4b', 'qwen2.5:4b'), tokens=10, delay=0.01):
+        self.models = list(models)
+        self.tokens = tokens
+        self.delay = delay
+        self.fail = False  # 为True时生成请求返回500（模拟模型崩溃）
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.completed = 0
+        self.aborted = 0
+        self._lock = threading.Lock()
+        self._server = _Server(('127.0.0.1', port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self._server.server_address[1]}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _enter(self):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _exit(self, completed):
+        with self._lock:
+            self.in_flight -= 1
+            if completed:
+                self.completed += 1
+            else:
+                self.aborted += 1
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, payload, status=200):
+                body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _write_chunk(self, payload):
+                line = json.dumps(payload, ensure_ascii=False).encode('utf-8') + b'\n'
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(line), line))
+                self.wfile.flush()
+
+            def do_GET(self):
+                if self.path != '/api/tags':
+                    return self._send_json({'error': 'not found'}, 404)
+                self._send_json({'models': [{'name': name} for name in server.models]})
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if self.path != '/api/chat':
+                    return self._send_json({'error': 'not found'}, 404)
+                if request.get('model') not in server.models:
+                    return self._send_json({'error': f"model '{request.get('model')}' not found"}, 404)
+                if server.fail:
+                    with server._lock:
+                        server.requests += 1
+                    return self._send_json({'error': 'model runner has unexpectedly stopped'}, 500)
+
+                server._enter()
+                completed = False
+                try:
+                    if not request.get('stream', True):
+                        time.sleep(server.delay * server.tokens)
+                        content = ''.join(f'词{i}' for i in range(server.tokens))
+                        self._send_json({'message': {'role': 'assistant', 'content': content}, 'done': True})
+                    else:
+                        self.send_response(200)
+                        self.send_header('Content-Type', 'application/x-ndjson')
+                        self.send_header('Transfer-Encoding', 'chunked')
+                        self.end_headers()
+                        for i in range(server.tokens):
+                            time.sleep(server.delay)
+                            self._write_chunk({'message': {'role': 'assistant', 'content': f'词{i}'}, 'done': False})
+                        self._write_chunk({'message': {'role': 'assistant', 'content': ''}, 'done': True})
+                        self.wfile.write(b'0\r\n\r\n')
+                        self.wfile.flush()
+                    completed = True
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    server._exit(completed)
+
+        return Handler
+
+
+def _bench(count, max_in_flight, delay, tokens):
+    """用同步接口并发发起count个生成请求，输出延迟分布和服务端观察到的并发峰值"""
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+    from concurrent.futures import ThreadPoolExecutor
+    from async_ollama import AsyncOllamaClient, OllamaRuntime
+
+    server = FakeOllamaServer(delay=delay, tokens=tokens).start()
+    runtime = OllamaRuntime(AsyncOllamaClient(server.url, max_in_flight=max_in_flight))
+    messages = [{'role': 'user', 'content': '你好'}]
+
+    def one(_):
+        start = time.perf_counter()
+        runtime.chat('qwen3:4b', messages)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=count) as pool:
+        latencies = sorted(pool.map(one, range(count)))
+    elapsed = time.perf_counter() - start
+    print(f'请求数: {count}，并发上限: {max_in_flight}，总耗时: {elapsed:.2f}s')
+    print(f'延迟 p50: {latencies[len(latencies) // 2]:.3f}s，p95: {latencies[int(len(latencies) * 0.95) - 1]:.3f}s，'
+          f'最大: {latencies[-1]:.3f}s')
+    print(f'服务端并发峰值: {server.peak_in_flight}，客户端统计: {runtime.get_stats()}')
+    runtime.close()
+    server.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='模拟的Ollama服务')
+    parser.add_argument('--port', type=int, default=11434)
+    parser.add_argument('--delay', type=float, default=0.05, help='每个文本片段的生成延迟（秒）')
+    parser.add_argument('--tokens', type=int, default=20, help='每次生成的文本片段数')
+    parser.add_argument('--bench', type=int, default=0, help='并发请求数（不为0时运行基准测试）')
+    parser.add_argument('--max-in-flight', type=int, default=10, help='基准测试的并发上限')
+    args = parser.parse_args()
+
+    if args.bench:
+        _bench(args.bench, args.max_in_flight, args.delay, args.tokens)
+    else:
+        fake = FakeOllamaServer(port=args.port, delay=args.delay, tokens=args.tokens).start()
+        print(f'模拟Ollama服务已启动: {fake.url}')
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            fake.stop()
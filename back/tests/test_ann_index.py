@@ -0,0 +1,88 @@
+"""
+可插拔索引类型单元测试
+"""
+import unittest
+import sys
+from pathlib import Path
+import numpy as np
+import faiss
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+import ann_index
+
+
+class AnnIndexTestCase(unittest.TestCase):
+    """索引类型测试类"""
+
+    def setUp(self):
+        """测试前准备"""
+        self.vectors = np.random.default_rng(0).random((2000, 32), dtype=np.float32)
+        faiss.normalize_L2(self.vectors)
+
+    def test_resolve_auto(self):
+        """测试auto按文档数选择索引类型"""
+        self.assertEqual(ann_index.resolve_index_type('auto', 10), 'flat')
+        self.assertEqual(ann_index.resolve_index_type('auto', 10 ** 9), 'ivf_flat')
+        self.assertEqual(ann_index.resolve_index_type('hnsw', 10), 'hnsw')
+
+    def test_can_train(self):
+        """测试训练所需的最少向量数"""
+        self.assertTrue(ann_index.can_train('flat', 0))
+        self.assertTrue(ann_index.can_train('ivf_flat', 2000, {'nlist': 16}))
+        self.assertFalse(ann_index.can_train('ivf_flat', 100, {'nlist': 16}))
+        self.assertFalse(ann_index.can_train('ivf_pq', 2000, {'nlist': 16}))
+
+    def test_ivf_search_with_selector(self):
+        """测试倒排索引的训练、nprobe和有效位图"""
+        index = ann_index.create_index('ivf_flat', 32, params={'nlist': 16})
+        ann_index.train_index(index, self.vectors)
+        index.add(self.vectors)
+        self.assertEqual(ann_index.index_type_of(index), 'ivf_flat')
+
+        # 排除第0个向量后，用它自身查询不应再命中
+        alive = np.ones(len(self.vectors), dtype=bool)
+        alive[0] = False
+        bitmap = np.packbits(alive, bitorder='little')
+        selector = faiss.IDSelectorBitmap(len(bitmap) * 8, faiss.swig_ptr(bitmap))
+        params = ann_index.search_parameters(index, selector, nprobe=16)
+
+        _, indices = index.search(self.vectors[:1], 5)
+        self.assertEqual(indices[0][0], 0)
+        _, indices = index.search(self.vectors[:1], 5, params=params)
+        self.assertNotIn(0, indices[0])
+
+    def test_range_search_cosine(self):
+        """测试范围搜索返回余弦相似度超过阈值的全部结果"""
+        index = ann_index.create_index('flat', 32)
+        index.add(self.vectors)
+        self.assertTrue(ann_index.supports_range_search(index))
+
+        _, scores, indices = index.range_search(self.vectors[:1], 0.95)
+        expected = np.flatnonzero(self.vectors @ self.vectors[0] > 0.95)
+        self.assertEqual(sorted(indices), list(expected))
+        self.assertAlmostEqual(float(scores.max()), 1.0, places=5)
+
+    def test_hnsw_parameters(self):
+        """测试HNSW索引的搜索参数"""
+        index = ann_index.create_index('hnsw', 32, params={'hnsw_m': 8})
+        index.add(self.vectors)
+        params = ann_index.search_parameters(index, ef_search=128)
+        self.assertEqual(params.efSearch, 128)
+
+        _, indices = index.search(self.vectors[:1], 1, params=params)
+        self.assertEqual(indices[0][0], 0)
+        self.assertFalse(ann_index.supports_range_search(index))
+
+    def test_flat_without_parameters(self):
+        """测试暴力搜索不需要搜索参数"""
+        index = ann_index.create_index('flat', 32)
+        self.assertIsNone(ann_index.search_parameters(index))
+        with self.assertRaises(ValueError):
+            ann_index.create_index('bogus', 32)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,10 +11,42 @@ import json
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
+import app as app_module
 from app import app, db
 from models import User
 
 
+class StubOllamaClient:
+    """模拟的Ollama客户端：流式接口逐段产出固定文本，记录输出是否被关闭"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def _stream(self):
+        try:
+            yield from self.chunks
+        finally:
+            self.closed = True
+
+    def answer_question_stream(self, question, context):
+        return self._stream()
+
+    def summarize_stream(self, text, max_length=200):
+        return self._stream()
+
+
+def parse_sse(body):
+    """把SSE响应解析为 [(事件名, 数据)]"""
+    events = []
+    for message in body.split('\n\n'):
+        if not message:
+            continue
+        lines = dict(line.split(': ', 1) for line in message.split('\n'))
+        events.append((lines['event'], json.loads(lines['data'])))
+    return events
+
+
 class APITestCase(unittest.TestCase):
     """API测试类"""
     
@@ -90,6 +122,45 @@ class APITestCase(unittest.TestCase):
         self.assertIn('results', data)
         self.assertIn('reply', data)
     
+    def test_search_knowledge_stream(self):
+        """测试流式检索（NDJSON，最后一个事件为done）"""
+        response = self.app.post('/api/knowledge/search/stream',
+                                json={'query': '测试查询', 'page_size': 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        events = [json.loads(line) for line in response.get_data(as_text=True).splitlines() if line]
+        self.assertEqual(events[-1]['type'], 'done')
+        self.assertIn('results', events[-1])
+        self.assertIn('next_cursor', events[-1])
+    
+    def test_generate_stream(self):
+        """测试流式问答的SSE格式（sources、逐段token、done），没有生成内容时推送error"""
+        original = app_module.ollama_client
+        app_module.ollama_client = StubOllamaClient(['你', '好'])
+        try:
+            response = self.app.post('/api/knowledge/generate/stream',
+                                    json={'task': 'answer', 'question': '问题', 'context': '上下文'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, 'text/event-stream')
+            body = response.get_data(as_text=True)
+            self.assertTrue(body.startswith('event: sources\ndata: '))
+            events = parse_sse(body)
+            self.assertEqual([name for name, _ in events], ['sources', 'token', 'token', 'done'])
+            self.assertTrue(all(name == data['type'] for name, data in events))
+            self.assertEqual([data['text'] for _, data in events[1:3]], ['你', '好'])
+            self.assertEqual(events[-1][1]['text'], '你好')
+            self.assertTrue(app_module.ollama_client.closed)
+            
+            app_module.ollama_client = StubOllamaClient([])
+            response = self.app.post('/api/knowledge/generate/stream',
+                                    json={'task': 'summarize', 'text': '很长的文本'})
+            self.assertEqual([name for name, _ in parse_sse(response.get_data(as_text=True))], ['error'])
+            
+            response = self.app.post('/api/knowledge/generate/stream', json={'task': 'answer'})
+            self.assertEqual(response.status_code, 400)
+        finally:
+            app_module.ollama_client = original
+    
     def test_unauthorized_access(self):
         """测试未授权访问"""
         response = self.app.get('/api/knowledge/kb-list')
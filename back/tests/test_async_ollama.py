@@ -0,0 +1,97 @@
+"""
+异步Ollama客户端单元测试（使用本地模拟的Ollama服务）
+"""
+import unittest
+import asyncio
+import time
+import sys
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from async_ollama import AsyncOllamaClient, OllamaRuntime, FairLimiter, OllamaError, normalize_host
+from fake_ollama import FakeOllamaServer
+
+MESSAGES = [{'role': 'user', 'content': '你好'}]
+
+
+class AsyncOllamaTestCase(unittest.TestCase):
+    """异步Ollama客户端测试类"""
+
+    def setUp(self):
+        """测试前准备：启动模拟服务"""
+        self.server = FakeOllamaServer(tokens=5, delay=0.02).start()
+        self.runtime = OllamaRuntime(AsyncOllamaClient(self.server.url, max_in_flight=4))
+
+    def tearDown(self):
+        """测试后清理"""
+        self.runtime.close()
+        self.server.stop()
+
+    def test_chat_and_list(self):
+        """测试对话、模型列表和错误处理"""
+        self.assertIn('qwen3:4b', self.runtime.list_models())
+        self.assertEqual(self.runtime.chat('qwen3:4b', MESSAGES), '词0词1词2词3词4')
+        self.assertEqual(''.join(self.runtime.chat_stream('qwen3:4b', MESSAGES)), '词0词1词2词3词4')
+        with self.assertRaises(OllamaError):
+            self.runtime.chat('missing', MESSAGES)
+        self.assertEqual(normalize_host('127.0.0.1'), 'http://127.0.0.1:11434')
+
+    def test_max_in_flight(self):
+        """测试并发请求不超过上限，超出的请求排队"""
+        with ThreadPoolExecutor(max_workers=12) as pool:
+            results = list(pool.map(lambda _: self.runtime.chat('qwen3:4b', MESSAGES), range(12)))
+        self.assertEqual(len(results), 12)
+        self.assertEqual(self.server.peak_in_flight, 4)
+        stats = self.runtime.get_stats()
+        self.assertEqual((stats['total'], stats['queued'], stats['peak_in_flight']), (12, 8, 4))
+        self.assertEqual(stats['in_flight'], 0)
+
+    def test_stream_cancel(self):
+        """测试提前关闭流式生成时断开连接并释放名额"""
+        self.server.tokens = 50
+        stream = self.runtime.chat_stream('qwen3:4b', MESSAGES)
+        self.assertEqual([next(stream), next(stream)], ['词0', '词1'])
+        stream.close()
+        time.sleep(0.2)
+        self.assertEqual(self.server.aborted, 1)
+        self.assertEqual(self.runtime.get_stats()['in_flight'], 0)
+
+    def test_stream_deadline(self):
+        """测试等待第一个片段超过截止时刻时抛出TimeoutError并释放名额"""
+        self.server.delay = 1
+        start = time.monotonic()
+        stream = self.runtime.chat_stream('qwen3:4b', MESSAGES, deadline=start + 0.1)
+        with self.assertRaises(TimeoutError):
+            next(stream)
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(self.runtime.get_stats()['in_flight'], 0)
+
+    def test_fair_limiter(self):
+        """测试名额按到达顺序分配，取消的等待者不占名额"""
+        async def scenario():
+            limiter = FairLimiter(1)
+            order = []
+
+            async def worker(name):
+                async with limiter:
+                    order.append(name)
+                    await asyncio.sleep(0.01)
+
+            await limiter.acquire()
+            tasks = [asyncio.create_task(worker(i)) for i in range(4)]
+            await asyncio.sleep(0)
+            tasks[1].cancel()
+            limiter.release()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            return order, limiter.in_flight
+
+        self.assertEqual(asyncio.run(scenario()), ([0, 2, 3], 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+"""
+问答上下文构建单元测试
+"""
+import unittest
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from context_builder import build_context, dedupe_results, count_tokens, truncate_to_tokens
+
+NEWS = '中国人民银行宣布下调存款准备金率0.5个百分点，释放长期资金约1万亿元，保持流动性合理充裕。'
+
+
+def hit(text, similarity, final_score=None):
+    result = {'text': text, 'similarity': similarity}
+    if final_score is not None:
+        result['final_score'] = final_score
+    return result
+
+
+class ContextBuilderTestCase(unittest.TestCase):
+    """问答上下文构建测试类"""
+
+    def test_dedupe(self):
+        """测试按分数排序并去除近似重复（保留分数高的）"""
+        results = [
+            hit('华为发布鸿蒙操作系统新版本，支持更多设备。', 0.5),
+            hit(NEWS, 0.6),
+            hit(NEWS.replace('。', '！'), 0.7, final_score=0.9),
+        ]
+        kept = dedupe_results(results)
+        self.assertEqual([r['similarity'] for r in kept], [0.7, 0.5])
+
+    def test_budget(self):
+        """测试装入的上下文不超过token预算，放不下的文本块截断"""
+        # 各不相同的文本块（不会被当作近似重复）
+        results = [hit(f'第{i}条：' + ''.join(chr(0x4e00 + i * 500 + k) for k in range(300)), 1 - i * 0.1)
+                   for i in range(5)]
+        per_chunk = count_tokens(results[0]['text'])
+
+        context, used = build_context(results, max_tokens=per_chunk * 2 + per_chunk // 2)
+        self.assertLessEqual(count_tokens(context), per_chunk * 2 + per_chunk // 2)
+        self.assertEqual(len(used), 3)
+        self.assertTrue(context.startswith('第0条'))
+
+        context, used = build_context(results, max_tokens=10)
+        self.assertEqual((context, used), ('', []))
+
+    def test_truncate(self):
+        """测试按token数截断"""
+        self.assertEqual(truncate_to_tokens(NEWS, 1000), NEWS)
+        truncated = truncate_to_tokens(NEWS, 10)
+        self.assertTrue(NEWS.startswith(truncated))
+        self.assertLessEqual(count_tokens(truncated), 10)
+        self.assertEqual(truncate_to_tokens(NEWS, 0), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
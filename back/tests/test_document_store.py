@@ -0,0 +1,95 @@
+"""
+列式文档存储单元测试
+"""
+import unittest
+import sys
+from pathlib import Path
+import tempfile
+import shutil
+import numpy as np
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from document_store import DocumentStore, SegmentedDocuments
+
+
+class DocumentStoreTestCase(unittest.TestCase):
+    """文档存储测试类"""
+
+    def setUp(self):
+        """测试前准备"""
+        self.test_dir = tempfile.mkdtemp()
+        self.store_path = Path(self.test_dir) / 'docs'
+
+    def tearDown(self):
+        """测试后清理"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_write_and_read(self):
+        """测试写入后按下标读取"""
+        documents = [
+            {'text': '第一段', 'metadata': {'file_name': 'a.txt', 'source': 'test'}},
+            {'text': 'second chunk', 'metadata': {'file_name': 'a.txt', 'source': 'test'}},
+            {'text': '第三段', 'metadata': {'file_name': 'b.txt'}},
+        ]
+        store = DocumentStore.write(self.store_path, documents, ids=[10, 11, 12])
+
+        self.assertEqual(len(store), 3)
+        self.assertEqual(list(store.ids), [10, 11, 12])
+        self.assertEqual(store[1], documents[1])
+        self.assertEqual(store[-1]['text'], '第三段')
+        self.assertEqual(list(store), documents)
+
+        # 重新打开得到相同内容
+        reopened = DocumentStore(self.store_path)
+        self.assertEqual(list(reopened), documents)
+
+    def test_vectors(self):
+        """测试向量随文档保存并按mmap读取"""
+        documents = [{'text': f'块{i}', 'metadata': {}} for i in range(3)]
+        vectors = np.arange(12, dtype=np.float32).reshape(3, 4)
+        store = DocumentStore.write(self.store_path, documents, ids=range(3), vectors=vectors)
+
+        np.testing.assert_array_equal(store.vectors, vectors)
+        np.testing.assert_array_equal(SegmentedDocuments([store, store]).vectors()[3:], vectors)
+
+        with self.assertRaises(ValueError):
+            DocumentStore.write(Path(self.test_dir) / 'bad', documents, ids=range(3), vectors=vectors[:2])
+
+    def test_metadata_deduplicated(self):
+        """测试相同元数据只存一份"""
+        documents = [{'text': f'块{i}', 'metadata': {'file_name': 'a.txt'}} for i in range(10)]
+        store = DocumentStore.write(self.store_path, documents, ids=range(10))
+
+        self.assertEqual(len(store.metadata_table), 1)
+
+        # 修改返回的元数据不影响存储
+        store[0]['metadata']['title'] = 'changed'
+        self.assertNotIn('title', store[1]['metadata'])
+
+    def test_positions_where(self):
+        """测试按元数据筛选文本块下标"""
+        documents = [
+            {'text': 'a1', 'metadata': {'file_name': 'a.txt'}},
+            {'text': 'b1', 'metadata': {'file_name': 'b.txt'}},
+            {'text': 'a2', 'metadata': {'file_name': 'a.txt'}},
+        ]
+        store = DocumentStore.write(self.store_path, documents, ids=[0, 1, 2])
+
+        positions = store.positions_where(lambda metadata: metadata.get('file_name') == 'a.txt')
+        self.assertEqual(list(positions), [0, 2])
+
+    def test_empty_store(self):
+        """测试空存储"""
+        store = DocumentStore.write(self.store_path, [], ids=[])
+
+        self.assertEqual(len(store), 0)
+        self.assertEqual(list(store), [])
+        with self.assertRaises(IndexError):
+            store[0]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+"""
+跨知识库搜索单元测试
+"""
+import unittest
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from federated_search import merge_results
+
+
+class FederatedSearchTestCase(unittest.TestCase):
+    """跨知识库搜索测试类"""
+
+    def test_merge_results(self):
+        """测试按相似度合并多个知识库的结果"""
+        kb_a = [{'text': 'a1', 'similarity': 0.9}, {'text': 'a2', 'similarity': 0.4}]
+        kb_b = [{'text': 'b1', 'similarity': 0.7}, {'text': 'b2', 'similarity': 0.5}]
+
+        merged = merge_results([kb_a, kb_b])
+        self.assertEqual([r['text'] for r in merged], ['a1', 'b1', 'b2', 'a2'])
+
+        merged = merge_results([kb_a, kb_b, []], limit=2)
+        self.assertEqual([r['text'] for r in merged], ['a1', 'b1'])
+
+    def test_merge_empty(self):
+        """测试没有结果时合并为空列表"""
+        self.assertEqual(merge_results([]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
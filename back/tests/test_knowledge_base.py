@@ -7,12 +7,20 @@ import os
 from pathlib import Path
 import tempfile
 import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 
 # 添加项目根目录到路径
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
-from knowledge_base import KnowledgeBase, SimpleTextSplitter
+import knowledge_base
+from knowledge_base import KnowledgeBase, KnowledgeBasePartition, SimpleTextSplitter, encode_queries
+from kb_pool import KnowledgeBasePool, kb_pool, get_knowledge_base
+from federated_search import federated_search
+from config import Config
 
 
 class KnowledgeBaseTestCase(unittest.TestCase):
@@ -27,7 +35,8 @@ class KnowledgeBaseTestCase(unittest.TestCase):
     
     def tearDown(self):
         """测试后清理"""
-        # 删除临时目录
+        # 等待后台维护线程结束后再删除临时目录
+        self.kb.close()
         if self.kb_path.exists():
             shutil.rmtree(self.test_dir)
     
@@ -74,6 +83,90 @@ class KnowledgeBaseTestCase(unittest.TestCase):
         self.assertIn('metadata', results[0])
         self.assertIn('score', results[0])
     
+    def test_search_batch(self):
+        """测试批量检索（结果与逐条检索一致）"""
+        texts = [
+            'Python是一种编程语言',
+            '机器学习是人工智能的一个分支'
+        ]
+        self.kb.add_documents(texts, [{'title': 'Python'}, {'title': 'ML'}])
+        
+        queries = ['Python编程', '人工智能']
+        batch_results = self.kb.search_batch(queries, top_k=1, similarity_threshold=0.0)
+        
+        self.assertEqual(len(batch_results), 2)
+        for query, results in zip(queries, batch_results):
+            single = self.kb.search(query, top_k=1, similarity_threshold=0.0)
+            self.assertEqual([r['text'] for r in results], [r['text'] for r in single])
+        self.assertEqual(self.kb.search_batch([]), [])
+    
+    def test_encode_queries_concurrent(self):
+        """测试查询编码：相同查询并发时只编码一次，不同查询可以同时编码"""
+        class StubModel:
+            def __init__(self):
+                self.calls = []
+                self.barrier = None
+            
+            def encode(self, texts, **kwargs):
+                self.calls.append(list(texts))
+                if self.barrier is not None:
+                    # 两个不同查询必须同时处于编码中才能通过
+                    self.barrier.wait()
+                else:
+                    time.sleep(0.2)
+                return np.ones((len(texts), 4), dtype='float32')
+        
+        model = StubModel()
+        original = knowledge_base.get_embedding_model
+        knowledge_base.get_embedding_model = lambda model_name=None: model
+        try:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                vectors = list(executor.map(lambda _: encode_queries(['相同的查询'], 'stub'), range(4)))
+            self.assertEqual(model.calls, [['相同的查询']])
+            self.assertTrue(all(np.array_equal(v, vectors[0]) for v in vectors))
+            
+            model.barrier = threading.Barrier(2, timeout=3)
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                list(executor.map(lambda query: encode_queries([query], 'stub'), ['查询甲', '查询乙']))
+            self.assertEqual(sorted(model.calls[1:]), [['查询乙'], ['查询甲']])
+        finally:
+            knowledge_base.get_embedding_model = original
+    
+    def test_search_with_query_embedding(self):
+        """测试使用预先生成的查询向量检索"""
+        self.kb.add_documents(['Python是一种编程语言'], [{'title': 'Python'}])
+        
+        query_embedding = encode_queries(['Python编程'])[0]
+        results = self.kb.search('Python编程', top_k=1, similarity_threshold=0.0, query_embedding=query_embedding)
+        expected = self.kb.search('Python编程', top_k=1, similarity_threshold=0.0)
+        self.assertAlmostEqual(results[0]['similarity'], expected[0]['similarity'], places=5)
+    
+    def test_hybrid_search(self):
+        """测试混合检索：明确的关键词查询走BM25快速路径，其余查询按RRF融合"""
+        texts = ['中国人民银行宣布降准0.5个百分点'] + [f'第{i}条新闻：市场动态' for i in range(30)]
+        self.kb.add_documents(texts, [{'title': f'新闻{i}'} for i in range(len(texts))])
+        
+        results = self.kb.search('降准', top_k=3, similarity_threshold=0.0)
+        self.assertEqual(results[0]['retrieval'], 'lexical')
+        self.assertEqual(results[0]['text'], texts[0])
+        # BM25比例单独保存，不冒充余弦相似度；没有查询向量时相似度为None，传入时给出真实的余弦相似度
+        self.assertEqual(results[0]['lexical_score'], 1.0)
+        self.assertIsNone(results[0]['similarity'])
+        query_embedding, text_embedding = encode_queries(['降准', texts[0]])
+        results = self.kb.search('降准', top_k=3, similarity_threshold=0.0, query_embedding=query_embedding)
+        self.assertEqual(results[0]['retrieval'], 'lexical')
+        expected = float(query_embedding @ text_embedding)
+        self.assertAlmostEqual(results[0]['similarity'], expected, places=4)
+        # 查询已编码过时快速路径直接使用缓存的向量；关键词结果同样受相似度阈值限制
+        results = self.kb.search('降准', top_k=3, similarity_threshold=0.0)
+        self.assertAlmostEqual(results[0]['similarity'], expected, places=4)
+        results = self.kb.search('降准', top_k=3, similarity_threshold=expected + 0.01)
+        self.assertNotIn(texts[0], [r['text'] for r in results])
+        self.assertTrue(all(r['similarity'] >= expected + 0.01 for r in results))
+        
+        results = self.kb.search('央行最近的货币政策有什么变化', top_k=3, similarity_threshold=0.0)
+        self.assertTrue(all('fused_score' in r for r in results))
+    
     def test_search_with_rerank(self):
         """测试检索+重排"""
         # 添加测试文档
@@ -98,6 +191,200 @@ class KnowledgeBaseTestCase(unittest.TestCase):
         self.assertIn('metadata', results[0])
         self.assertIn('score', results[0])
     
+    def test_compact(self):
+        """测试段合并"""
+        # 每次添加都会写入一个新段
+        self.kb.add_documents(['第一批文档'], [{'title': '文档1', 'source': 'test'}])
+        self.kb.add_documents(['第二批文档'], [{'title': '文档2', 'source': 'test'}])
+        self.assertEqual(self.kb.get_stats()['segments'], 2)
+        
+        # 合并后只剩一个段，文档不变
+        self.assertTrue(self.kb.compact())
+        stats = self.kb.get_stats()
+        self.assertEqual(stats['segments'], 1)
+        self.assertEqual(stats['total_documents'], 2)
+        
+        # 重新加载后内容一致
+        reloaded = KnowledgeBase(db_path=str(self.kb_path))
+        self.assertEqual([doc['text'] for doc in reloaded.documents], ['第一批文档', '第二批文档'])
+
+    def test_tiered_compaction(self):
+        """测试后台只合并大小相近的相邻小段，大段不被重写"""
+        self.kb.add_documents([f'第{i}篇大文档的内容' for i in range(40)])
+        big_segment = self.kb._segments[0]
+        for i in range(4):
+            self.kb.add_documents([f'第{i}篇小文档'])
+        # 第4个小段写入后触发后台合并，等待合并结束
+        self.kb.close()
+        
+        self.assertEqual(len(self.kb._segments), 2)
+        self.assertEqual(self.kb._segments[0], big_segment)
+        self.assertEqual(self.kb.get_stats()['total_documents'], 44)
+        results = self.kb.search('第3篇小文档', top_k=1, similarity_threshold=0.0, rerank=False)
+        self.assertEqual(results[0]['text'], '第3篇小文档')
+
+    def test_append_delta(self):
+        """测试写入只把新向量加入增量部分（不复制主索引），搜索同时覆盖主索引和增量，后台合并后结果不变"""
+        self.kb.add_documents([f'第{i}篇 机器学习笔记' for i in range(10)], [{'file_name': f'{i}.txt'} for i in range(10)])
+        index = self.kb._state.index
+        self.kb.add_documents(['Python是一种编程语言', 'Java也是一种编程语言'],
+                              [{'file_name': 'python.txt'}, {'file_name': 'java.txt'}])
+        state = self.kb._state
+        self.assertIs(state.index, index)
+        self.assertEqual(state.indexed + state.delta_count, 12)
+        self.assertEqual(self.kb.get_stats()['index_size'], 12)
+        
+        # 删除比例低于KB_MAX_DELETED_RATIO，不触发后台重写
+        self.kb.delete_documents_by_filename('9.txt')
+        before = self.kb.search('编程语言', top_k=12, similarity_threshold=0.0, rerank=False)
+        self.assertEqual(len(before), 11)
+        self.assertNotIn('第9篇 机器学习笔记', [r['text'] for r in before])
+        
+        self.assertTrue(self.kb._fold_delta())
+        state = self.kb._state
+        self.assertEqual((state.indexed, state.delta_count), (12, 0))
+        after = self.kb.search('编程语言', top_k=12, similarity_threshold=0.0, rerank=False)
+        # 相似度相同的结果顺序可能不同，按文本块比较
+        self.assertEqual(
+            {r['chunk_id']: round(r['similarity'], 5) for r in after},
+            {r['chunk_id']: round(r['similarity'], 5) for r in before}
+        )
+    
+    def test_search_during_compaction(self):
+        """测试清除已删除文本块的段合并替换状态的过程中进行的搜索，文档、索引和位图来自同一时刻"""
+        for batch in range(2):
+            self.kb.add_documents(
+                [f'第{batch}批第{i}篇 Python编程' for i in range(10)],
+                [{'file_name': f'{batch}_{i}.txt'} for i in range(10)]
+            )
+        texts = {int(chunk_id): doc['text'] for chunk_id, doc in zip(self.kb._state.ids, self.kb.documents)}
+        for i in range(0, 10, 2):
+            self.kb.delete_documents_by_filename(f'0_{i}.txt')
+        
+        # 合并提交后构造新状态时（构造属性数组的时刻）插入一次搜索
+        searched = []
+        original = knowledge_base.AttributeIndex
+        
+        class SearchingAttributeIndex(original):
+            def __init__(index_self, documents, *args, **kwargs):
+                super().__init__(documents, *args, **kwargs)
+                if len(documents) == 15 and not searched:
+                    searched.append(self.kb.search('Python编程', top_k=40, similarity_threshold=0.0, rerank=False))
+        
+        knowledge_base.AttributeIndex = SearchingAttributeIndex
+        try:
+            self.assertTrue(self.kb.compact())
+        finally:
+            knowledge_base.AttributeIndex = original
+        
+        results = searched[0]
+        self.assertEqual(len(results), 15)
+        for result in results:
+            self.assertEqual(result['text'], texts[result['chunk_id']])
+            self.assertNotIn(result['metadata']['file_name'], {f'0_{i}.txt' for i in range(0, 10, 2)})
+    
+    def test_two_instances(self):
+        """测试同一目录的两个实例交替写入，不丢失对方提交的段"""
+        other = KnowledgeBase(db_path=str(self.kb_path))
+        self.kb.add_documents(['第一个实例写入的文档'])
+        other.add_documents(['第二个实例写入的文档'])
+        self.kb.add_documents(['第一个实例再次写入的文档'])
+        self.assertEqual(other.delete_documents_by_filename('missing.txt'), 0)
+
+        reloaded = KnowledgeBase(db_path=str(self.kb_path))
+        self.assertEqual(
+            [doc['text'] for doc in reloaded.documents],
+            ['第一个实例写入的文档', '第二个实例写入的文档', '第一个实例再次写入的文档']
+        )
+
+    def test_pool_single_instance(self):
+        """测试知识库池：被淘汰但仍在使用的实例再次取用时复用，磁盘更新后在原实例上重新加载"""
+        pool = KnowledgeBasePool(max_items=1)
+        kb = pool.get(str(self.kb_path))
+        pool.get(str(Path(self.test_dir) / 'other_kb'))
+        self.assertIs(pool.get(str(self.kb_path)), kb)
+
+        self.kb.add_documents(['其他实例写入的文档'])
+        self.assertIs(pool.get(str(self.kb_path)), kb)
+        self.assertEqual([doc['text'] for doc in kb.documents], ['其他实例写入的文档'])
+    
+    def test_delete_documents_by_filename(self):
+        """测试按文件名删除（删除标记立即生效）"""
+        texts = ['Python是一种编程语言', 'Java也是一种编程语言']
+        metadata_list = [
+            {'title': 'Python', 'file_name': 'python.txt'},
+            {'title': 'Java', 'file_name': 'java.txt'}
+        ]
+        self.kb.add_documents(texts, metadata_list)
+        
+        deleted = self.kb.delete_documents_by_filename('python.txt')
+        self.assertEqual(deleted, 1)
+        self.assertEqual(self.kb.get_stats()['total_documents'], 1)
+        
+        # 已删除的文档不再出现在检索结果中
+        results = self.kb.search('Python编程', top_k=5, similarity_threshold=0.0)
+        self.assertTrue(all(r['metadata']['file_name'] == 'java.txt' for r in results))
+        
+        # 合并段后物理清除
+        self.kb.compact()
+        stats = self.kb.get_stats()
+        self.assertEqual(stats['index_size'], 1)
+        self.assertEqual(stats['deleted_documents'], 0)
+    
+    def test_set_index_type(self):
+        """测试切换索引类型（用保存的向量重建，不重新生成向量）"""
+        texts = ['Python是一种编程语言', 'Java也是一种编程语言']
+        self.kb.add_documents(texts, [{'title': 'Python'}, {'title': 'Java'}])
+        
+        self.kb.set_index_type('hnsw', hnsw_m=8)
+        stats = self.kb.get_stats()
+        self.assertEqual(stats['index_type'], 'hnsw')
+        self.assertEqual(stats['index_size'], 2)
+        
+        results = self.kb.search('Python编程', top_k=1, similarity_threshold=0.0, ef_search=16)
+        self.assertEqual(len(results), 1)
+        
+        # 索引类型保存在清单中，重新加载后保持不变
+        reloaded = KnowledgeBase(db_path=str(self.kb_path))
+        self.assertEqual(reloaded.get_stats()['index_type'], 'hnsw')
+        
+        with self.assertRaises(ValueError):
+            self.kb.set_index_type('unknown')
+    
+    def test_partitions(self):
+        """测试统一存储：多个知识库共用一个索引，按分区搜索、删除和统计"""
+        kb_a = KnowledgeBasePartition(self.kb, 'a')
+        kb_b = KnowledgeBasePartition(self.kb, 'b')
+        kb_a.add_documents(['Python是一种编程语言'], [{'file_name': 'same.txt'}])
+        kb_b.add_documents(['Python也可以用来做数据分析'], [{'file_name': 'same.txt'}])
+        
+        results = kb_a.search('Python', top_k=5, similarity_threshold=0.0)
+        self.assertEqual([r['metadata']['kb_name'] for r in results], ['a'])
+        results = self.kb.search('Python', top_k=5, similarity_threshold=0.0, partitions=['a', 'b'])
+        self.assertEqual(len(results), 2)
+        
+        # 同名文件只删除本知识库内的文档
+        self.assertEqual(kb_a.delete_documents_by_filename('same.txt'), 1)
+        self.assertEqual(kb_a.get_stats()['total_documents'], 0)
+        self.assertEqual(kb_b.get_stats()['total_documents'], 1)
+        self.assertEqual(self.kb.get_stats()['index_size'], 2)
+    
+    def test_federated_unified(self):
+        """测试统一存储下跨知识库搜索：每个知识库各自取前top_k条，不被结果多的知识库挤掉"""
+        cwd = os.getcwd()
+        mode = Config.KB_STORAGE_MODE
+        os.chdir(self.test_dir)
+        Config.KB_STORAGE_MODE = 'unified'
+        try:
+            get_knowledge_base('a').add_documents([f'Python编程语言教程第{i}章' for i in range(10)])
+            get_knowledge_base('b').add_documents(['Python数据分析'])
+            results, counts = federated_search('Python编程语言教程', ['a', 'b'], top_k=3, similarity_threshold=0.0)
+            self.assertEqual(counts, {'a': 3, 'b': 1})
+        finally:
+            Config.KB_STORAGE_MODE = mode
+            kb_pool.close()
+            os.chdir(cwd)
+    
     def test_text_splitter(self):
         """测试文本分割器"""
         splitter = SimpleTextSplitter(chunk_size=100, chunk_overlap=20)
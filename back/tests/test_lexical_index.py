@@ -0,0 +1,81 @@
+"""
+BM25倒排索引单元测试
+"""
+import unittest
+import sys
+from pathlib import Path
+import tempfile
+import shutil
+import numpy as np
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from lexical_index import SegmentLexicon, LexicalIndex, query_terms, is_decisive
+
+TEXTS = [
+    '中国人民银行宣布降准0.5个百分点',
+    '华为发布鸿蒙操作系统',
+    '央行货币政策报告：保持流动性合理充裕',
+    '华为手机销量增长',
+]
+
+
+class LexicalIndexTestCase(unittest.TestCase):
+    """BM25倒排索引测试类"""
+
+    def setUp(self):
+        """测试前准备"""
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """测试后清理"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def search(self, index, query, k=10, mask=None):
+        positions, _, _ = index.search(query_terms(query), k, mask)
+        return list(positions)
+
+    def test_search(self):
+        """测试按段拼接后的BM25检索及位置掩码"""
+        index = LexicalIndex([SegmentLexicon.build(TEXTS[:2]), SegmentLexicon.build(TEXTS[2:])])
+        self.assertEqual(len(index), 4)
+        self.assertEqual(self.search(index, '降准'), [0])
+        # 短文档中的词分数更高
+        self.assertEqual(self.search(index, '华为'), [3, 1])
+        # 长词切出的短词也能命中（“操作系统”包含“系统”）
+        self.assertEqual(self.search(index, '系统'), [1])
+        self.assertEqual(self.search(index, '华为', mask=np.array([True, False, True, True])), [3])
+        self.assertEqual(self.search(index, '不存在的词'), [])
+
+    def test_write_load_and_merge(self):
+        """测试写入、mmap读取，以及合并段时去掉已删除的文本块"""
+        lexicon = SegmentLexicon.build(TEXTS)
+        lexicon.write(self.test_dir)
+        self.assertTrue(SegmentLexicon.exists(self.test_dir))
+        loaded = SegmentLexicon.load(self.test_dir)
+        self.assertEqual(list(loaded.postings('华为')[0]), [1, 3])
+
+        merged = SegmentLexicon.merge([(loaded, np.array([1, 2, 3]))])
+        rebuilt = SegmentLexicon.build(TEXTS[1:])
+        self.assertEqual(list(merged.terms), list(rebuilt.terms))
+        self.assertEqual(list(merged.docs), list(rebuilt.docs))
+        self.assertEqual(list(merged.lengths), list(rebuilt.lengths))
+
+    def test_is_decisive(self):
+        """测试关键词快速路径的判断"""
+        index = LexicalIndex([SegmentLexicon.build(TEXTS + ['第%d条其他新闻' % i for i in range(40)])])
+        terms = query_terms('降准')
+        _, scores, matched = index.search(terms, 10)
+        self.assertTrue(is_decisive(terms, scores, matched))
+
+        # 查询词过多（自然语言问题）或没有结果时不走快速路径
+        terms = query_terms('央行最近为什么要降准，对房价和股市有什么影响')
+        _, scores, matched = index.search(terms, 10)
+        self.assertFalse(is_decisive(terms, scores, matched))
+        self.assertFalse(is_decisive([], np.zeros(0), np.zeros(0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+"""
+大模型生成结果缓存单元测试
+"""
+import unittest
+import time
+import sys
+from pathlib import Path
+import tempfile
+import shutil
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from llm_cache import LLMCache
+
+OPTIONS = {'num_predict': 300, 'temperature': 0.7}
+
+
+class LLMCacheTestCase(unittest.TestCase):
+    """大模型生成结果缓存测试类"""
+
+    def setUp(self):
+        """测试前准备"""
+        self.test_dir = tempfile.mkdtemp()
+        self.path = Path(self.test_dir) / 'llm_cache.sqlite3'
+
+    def tearDown(self):
+        """测试后清理"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_get_put(self):
+        """测试按 模型 + 提示词 + 参数 缓存，以及重新打开后仍然有效"""
+        cache = LLMCache(self.path)
+        cache.put('qwen', '总结这篇文章', OPTIONS, '摘要')
+        self.assertEqual(cache.get('qwen', '总结这篇文章', {'temperature': 0.7, 'num_predict': 300}), '摘要')
+        self.assertIsNone(cache.get('llama', '总结这篇文章', OPTIONS))
+        self.assertIsNone(cache.get('qwen', '总结这篇文章', {'num_predict': 200, 'temperature': 0.7}))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+        self.assertEqual(LLMCache(self.path).get('qwen', '总结这篇文章', OPTIONS), '摘要')
+
+    def test_ttl_and_eviction(self):
+        """测试过期失效和按条目数淘汰最久未使用的条目"""
+        cache = LLMCache(self.path, ttl=0.05)
+        cache.put('qwen', 'a', OPTIONS, 'A')
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('qwen', 'a', OPTIONS))
+        self.assertEqual(len(cache), 0)
+
+        cache = LLMCache(self.path, max_entries=2)
+        cache.put('qwen', 'a', OPTIONS, 'A')
+        cache.put('qwen', 'b', OPTIONS, 'B')
+        cache.get('qwen', 'a', OPTIONS)
+        cache.put('qwen', 'c', OPTIONS, 'C')
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('qwen', 'b', OPTIONS))
+        self.assertEqual(cache.get('qwen', 'a', OPTIONS), 'A')
+        self.assertEqual(cache.get_stats()['evictions'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
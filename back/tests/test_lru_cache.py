@@ -0,0 +1,60 @@
+"""
+LRU缓存单元测试
+"""
+import unittest
+import time
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from lru_cache import LRUCache
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    """LRU缓存测试类"""
+
+    def test_get_and_put(self):
+        """测试读写及命中统计"""
+        cache = LRUCache(max_items=2)
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+
+        stats = cache.get_stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_evict_least_recently_used(self):
+        """测试淘汰最久未使用的条目"""
+        cache = LRUCache(max_items=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_ttl(self):
+        """测试条目过期后不再返回"""
+        cache = LRUCache(max_items=2, ttl=0.05)
+        cache.put('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_disabled(self):
+        """测试容量为0时不缓存"""
+        cache = LRUCache(max_items=0)
+        cache.put('a', 1)
+        self.assertEqual(cache.get('a', 'missing'), 'missing')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+元数据过滤单元测试
+"""
+import unittest
+import sys
+from pathlib import Path
+import tempfile
+import shutil
+import numpy as np
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from document_store import DocumentStore, SegmentedDocuments
+from metadata_filter import MetadataFilter, AttributeIndex, parse_tags
+
+
+class MetadataFilterTestCase(unittest.TestCase):
+    """元数据过滤测试类"""
+
+    def setUp(self):
+        """测试前准备：两个段组成的文档序列"""
+        self.test_dir = tempfile.mkdtemp()
+        first = DocumentStore.write(Path(self.test_dir) / 'seg_1', [
+            {'text': '一', 'metadata': {'source': '新华网', 'published': '2024-01-15T08:00:00'}},
+            {'text': '二', 'metadata': {'source': '新华网', 'published': '2024-03-01T08:00:00'}},
+            {'text': '三', 'metadata': {'source': '文件上传', 'file_type': 'pdf', 'file_name': 'a.pdf'}},
+        ], ids=[0, 1, 2])
+        second = DocumentStore.write(Path(self.test_dir) / 'seg_2', [
+            {'text': '四', 'metadata': {'source': '人民网', 'published': 'Mon, 30 Jun 2024 10:00:00 +0000'}},
+            {'text': '五', 'metadata': {'source': '文件上传', 'file_type': 'txt', 'file_name': 'b.txt'}},
+        ], ids=[3, 4])
+        self.documents = SegmentedDocuments([first, second])
+        self.attributes = AttributeIndex(self.documents)
+
+    def tearDown(self):
+        """测试后清理"""
+        for store in self.documents.stores:
+            store.close()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def positions(self, expression):
+        return list(np.flatnonzero(self.attributes.mask(MetadataFilter.parse(expression))))
+
+    def test_equality(self):
+        """测试等值过滤（列表取值为“或”，字段之间为“且”）"""
+        self.assertEqual(self.positions({'source': '新华网'}), [0, 1])
+        self.assertEqual(self.positions({'source': ['新华网', '人民网']}), [0, 1, 3])
+        self.assertEqual(self.positions({'source': '文件上传', 'file_type': 'txt'}), [4])
+        self.assertEqual(self.positions({'file_name': 'missing.txt'}), [])
+
+    def test_published_range(self):
+        """测试发布时间范围过滤（ISO与RSS格式，只给日期时包含当天）"""
+        self.assertEqual(self.positions({'published': {'from': '2024-02-01'}}), [1, 3])
+        self.assertEqual(self.positions({'published': {'to': '2024-06-30'}}), [0, 1, 3])
+        self.assertEqual(self.positions({'published': {'from': '2024-01-01', 'to': '2024-01-31'}}), [0])
+
+    def test_invalid_expression(self):
+        """测试不支持的字段和无法解析的时间"""
+        with self.assertRaises(ValueError):
+            MetadataFilter.parse({'author': 'x'})
+        with self.assertRaises(ValueError):
+            MetadataFilter.parse({'published': {'from': 'yesterday'}})
+        with self.assertRaises(ValueError):
+            MetadataFilter.parse(['source'])
+        self.assertFalse(MetadataFilter.parse({}))
+
+    def test_parse_tags(self):
+        """测试解析JSON数组或逗号分隔的标签"""
+        self.assertEqual(parse_tags('["经济", "科技"]'), {'经济', '科技'})
+        self.assertEqual(parse_tags('经济， 科技,'), {'经济', '科技'})
+        self.assertEqual(parse_tags(''), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,302 @@
+"""
+Ollama客户端连接探测与熔断单元测试（使用本地模拟的Ollama服务）
+"""
+import unittest
+import os
+import socket
+import time
+import sys
+from pathlib import Path
+import tempfile
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from llm_cache import LLMCache
+from ollama_client import OllamaClient
+from fake_ollama import FakeOllamaServer
+
+
+def wait_for(condition, timeout=3):
+    """等待条件成立"""
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.02)
+    return condition()
+
+
+class StubStream:
+    """模拟运行时返回的流式输出：逐段产出文本，gate未放行时在下一段之前等待，记录是否被关闭"""
+
+    def __init__(self, chunks, gate=None, error=None):
+        self.chunks = chunks
+        self.gate = gate
+        self.error = error
+        self.closed = False
+
+    def __iter__(self):
+        for i, chunk in enumerate(self.chunks):
+            if i > 0 and self.gate is not None:
+                self.gate.wait(3)
+            yield chunk
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        self.closed = True
+
+
+class StubRuntime:
+    """模拟的异步运行时，只实现chat_stream，记录每次返回的流"""
+
+    def __init__(self, chunks=('你', '好'), gate=None, error=None):
+        self.chunks = list(chunks)
+        self.gate = gate
+        self.error = error
+        self.streams = []
+
+    def chat_stream(self, model_name, messages, options=None, deadline=None):
+        stream = StubStream(self.chunks, self.gate, self.error)
+        self.streams.append(stream)
+        return stream
+
+    def get_stats(self):
+        return {}
+
+
+class OllamaClientTestCase(unittest.TestCase):
+    """Ollama客户端测试类"""
+
+    def setUp(self):
+        """测试前准备"""
+        self.test_dir = tempfile.mkdtemp()
+        self.cache = LLMCache(Path(self.test_dir) / 'llm_cache.sqlite3', max_entries=0)
+        self.original_host = os.environ.get('OLLAMA_HOST')
+        self.server = None
+
+    def tearDown(self):
+        """测试后清理"""
+        if self.server:
+            self.server.stop()
+        if self.original_host is None:
+            os.environ.pop('OLLAMA_HOST', None)
+        else:
+            os.environ['OLLAMA_HOST'] = self.original_host
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_background_probe(self):
+        """测试启动不阻塞，服务启动后自动恢复可用"""
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        os.environ['OLLAMA_HOST'] = f'127.0.0.1:{port}'
+
+        start = time.monotonic()
+        client = OllamaClient(cache=self.cache, probe_interval=0.05)
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertFalse(client.available)
+        self.assertEqual(client.summarize('很长的文本' * 100, max_length=10), '很长的文本很长的文本...')
+
+        self.server = FakeOllamaServer(port=port).start()
+        self.assertTrue(wait_for(lambda: client.available))
+        self.assertEqual(client.generate('你好'), ''.join(f'词{i}' for i in range(10)))
+
+    def test_circuit_breaker(self):
+        """测试生成请求连续失败后熔断，恢复时间后试探成功则恢复"""
+        self.server = FakeOllamaServer().start()
+        os.environ['OLLAMA_HOST'] = self.server.url
+        client = OllamaClient(cache=self.cache, probe_interval=0)
+        client.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.2)
+        self.assertTrue(wait_for(lambda: client.available))
+
+        self.server.fail = True
+        self.assertIsNone(client.generate('你好'))
+        self.assertIsNone(client.generate('你好'))
+        self.assertEqual(client.breaker.state, OPEN)
+        # 断开期间直接返回，不发送请求
+        self.assertIsNone(client.generate('你好'))
+        self.assertEqual(self.server.requests, 2)
+
+        self.server.fail = False
+        time.sleep(0.25)
+        self.assertTrue(client.generate('你好'))
+        self.assertEqual(client.breaker.state, CLOSED)
+
+    def test_single_flight(self):
+        """测试并发的相同请求只向Ollama发送一次"""
+        self.server = FakeOllamaServer(delay=0.02).start()
+        os.environ['OLLAMA_HOST'] = self.server.url
+        client = OllamaClient(cache=self.cache, probe_interval=0)
+        self.assertTrue(wait_for(lambda: client.available))
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(lambda _: client.answer_question('问题', '上下文'), range(8)))
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(self.server.requests, 1)
+        self.assertEqual(client.get_stats()['single_flight']['coalesced'], 7)
+
+        # 不同的提示词分别生成
+        client.answer_question('另一个问题', '上下文')
+        self.assertEqual(self.server.requests, 2)
+
+    def test_single_flight_stream(self):
+        """测试流式生成合并，以及leader提前关闭时follower自己生成"""
+        self.server = FakeOllamaServer(delay=0.02).start()
+        os.environ['OLLAMA_HOST'] = self.server.url
+        client = OllamaClient(cache=self.cache, probe_interval=0)
+        self.assertTrue(wait_for(lambda: client.available))
+
+        stream = client.generate_stream('你好')
+        first = next(stream)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            follower = pool.submit(client.generate, '你好')
+            time.sleep(0.05)
+            self.assertEqual(first + ''.join(stream), follower.result())
+        self.assertEqual(self.server.requests, 1)
+
+        stream = client.generate_stream('再见')
+        next(stream)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            follower = pool.submit(lambda: ''.join(client.generate_stream('再见')))
+            time.sleep(0.05)
+            stream.close()
+            self.assertEqual(follower.result(), ''.join(f'词{i}' for i in range(10)))
+        self.assertEqual(self.server.requests, 3)
+
+    def stub_client(self, runtime):
+        """探测失败后换上模拟的运行时，不连接任何服务；使用启用的缓存"""
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        os.environ['OLLAMA_HOST'] = f'127.0.0.1:{port}'
+        cache = LLMCache(Path(self.test_dir) / 'stream_cache.sqlite3')
+        client = OllamaClient(cache=cache, probe_interval=0)
+        client._probe_thread.join()
+        client.runtime = runtime
+        client.available = True
+        return client
+
+    def test_stream_close(self):
+        """测试提前关闭流式输出时关闭HTTP流且不计入熔断失败，生成出错才计入"""
+        runtime = StubRuntime(chunks=['词0', '词1', '词2'])
+        client = self.stub_client(runtime)
+        client.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+
+        stream = client.chat_stream([{'role': 'user', 'content': '你好'}])
+        self.assertEqual(next(stream), '词0')
+        stream.close()
+        self.assertTrue(runtime.streams[0].closed)
+        self.assertEqual(client.breaker.state, CLOSED)
+
+        # 提前关闭的生成不写入缓存
+        stream = client.generate_stream('你好')
+        next(stream)
+        stream.close()
+        self.assertIsNone(client.cache.get(client.model_name, '你好', client._generate_options(500)))
+
+        runtime.error = RuntimeError('模型崩溃')
+        with self.assertRaises(RuntimeError):
+            list(client.chat_stream([{'role': 'user', 'content': '你好'}]))
+        self.assertTrue(runtime.streams[-1].closed)
+        self.assertEqual(client.breaker.state, OPEN)
+
+    def test_stream_close_before_first_chunk(self):
+        """测试半开状态下还没收到文本就关闭流式输出时不恢复熔断器，只释放试探名额"""
+        runtime = StubRuntime(chunks=['', '词1'])
+        client = self.stub_client(runtime)
+        client.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        client.breaker.record_failure()
+        time.sleep(0.06)
+
+        stream = client.chat_stream([{'role': 'user', 'content': '你好'}])
+        self.assertEqual(next(stream), '')
+        self.assertEqual(client.breaker.state, HALF_OPEN)
+        stream.close()
+        self.assertTrue(runtime.streams[0].closed)
+        self.assertEqual(client.breaker.state, HALF_OPEN)
+
+        # 试探名额已释放，下一个请求作为试探，完整生成后恢复
+        self.assertEqual(''.join(client.chat_stream([{'role': 'user', 'content': '你好'}])), '词1')
+        self.assertEqual(client.breaker.state, CLOSED)
+
+    def test_stream_deadline(self):
+        """测试超过截止时刻时抛出TimeoutError、不计入熔断失败也不写入缓存，等待相同请求的调用同样受截止时刻限制"""
+        runtime = StubRuntime(chunks=[], error=TimeoutError())
+        client = self.stub_client(runtime)
+        with self.assertRaises(TimeoutError):
+            list(client.generate_stream('你好', deadline=time.monotonic()))
+        self.assertEqual(client.breaker.get_stats()['failures'], 0)
+        self.assertIsNone(client.cache.get(client.model_name, '你好', client._generate_options(500)))
+
+        gate = threading.Event()
+        runtime.chunks, runtime.error, runtime.gate = ['词0', '词1'], None, gate
+        stream = client.generate_stream('你好')
+        next(stream)
+        start = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            list(client.generate_stream('你好', deadline=start + 0.1))
+        self.assertLess(time.monotonic() - start, 1)
+        gate.set()
+        self.assertEqual(''.join(stream), '词1')
+        self.assertEqual(len(runtime.streams), 2)
+
+    def test_stream_cache(self):
+        """测试完整生成的结果写入缓存，之后的请求直接一次性产出缓存结果"""
+        runtime = StubRuntime(chunks=['词0', '词1', '词2'])
+        client = self.stub_client(runtime)
+
+        self.assertEqual(list(client.generate_stream('你好')), ['词0', '词1', '词2'])
+        self.assertEqual(client.cache.get(client.model_name, '你好', client._generate_options(500)), '词0词1词2')
+        self.assertEqual(list(client.generate_stream('你好')), ['词0词1词2'])
+        self.assertEqual(len(runtime.streams), 1)
+
+    def test_stream_waiter(self):
+        """测试等待者得到leader生成的完整文本；leader提前关闭（Abandoned）时等待者自己生成"""
+        gate = threading.Event()
+        runtime = StubRuntime(chunks=['词0', '词1', '词2'], gate=gate)
+        client = self.stub_client(runtime)
+
+        stream = client.generate_stream('你好')
+        first = next(stream)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            waiter = pool.submit(lambda: list(client.generate_stream('你好')))
+            self.assertTrue(wait_for(lambda: client.get_stats()['single_flight']['coalesced'] == 1))
+            gate.set()
+            self.assertEqual(first + ''.join(stream), '词0词1词2')
+            self.assertEqual(waiter.result(timeout=3), ['词0词1词2'])
+        self.assertEqual(len(runtime.streams), 1)
+
+        gate.clear()
+        stream = client.generate_stream('再见')
+        next(stream)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            waiter = pool.submit(lambda: ''.join(client.generate_stream('再见')))
+            self.assertTrue(wait_for(lambda: client.get_stats()['single_flight']['coalesced'] == 2))
+            stream.close()
+            gate.set()
+            self.assertEqual(waiter.result(timeout=3), '词0词1词2')
+        self.assertEqual(len(runtime.streams), 3)
+        self.assertTrue(runtime.streams[1].closed)
+
+    def test_half_open(self):
+        """测试半开状态只放行一个试探请求，试探失败重新断开"""
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow())
+
+
+if __name__ == '__main__':
+    unittest.main()
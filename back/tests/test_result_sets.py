@@ -0,0 +1,53 @@
+"""
+搜索结果集与分页游标单元测试
+"""
+import unittest
+import time
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from metadata_filter import MetadataFilter
+from result_sets import ResultSet, ResultSetStore, result_set_key, encode_cursor, decode_cursor
+
+
+class ResultSetTestCase(unittest.TestCase):
+    """结果集测试类"""
+
+    def make_result_set(self, count=3, exhausted=True):
+        results = [{'text': f'结果{i}', 'kb_name': 'default', 'chunk_id': i} for i in range(count)]
+        return ResultSet('查询', ['default'], None, results, per_kb_top_k=50, exhausted=exhausted)
+
+    def test_cursor(self):
+        """测试游标的生成与解析"""
+        cursor = encode_cursor('abc', 20)
+        self.assertEqual(decode_cursor(cursor), ('abc', 20))
+        for invalid in ('not-a-cursor', encode_cursor('abc', -1), ''):
+            with self.assertRaises(ValueError):
+                decode_cursor(invalid)
+
+    def test_store_and_expire(self):
+        """测试按ID和查询条件取结果集，以及过期失效"""
+        store = ResultSetStore(max_items=2, ttl=0.05)
+        key = result_set_key(' 查询 ', ['b', 'a'], MetadataFilter.parse({'source': 'x'}))
+        self.assertEqual(key, result_set_key('查询', ['a', 'b'], MetadataFilter.parse({'source': ['x']})))
+
+        result_set = store.add(key, self.make_result_set())
+        self.assertIs(store.get(result_set.id), result_set)
+        self.assertIs(store.find(key), result_set)
+        time.sleep(0.1)
+        self.assertIsNone(store.get(result_set.id))
+        self.assertIsNone(store.find(key))
+
+    def test_has_more(self):
+        """测试是否还有下一页（包括尚未取回的候选）"""
+        self.assertTrue(self.make_result_set(3).has_more(2))
+        self.assertFalse(self.make_result_set(3).has_more(3))
+        self.assertTrue(self.make_result_set(3, exhausted=False).has_more(3))
+
+
+if __name__ == '__main__':
+    unittest.main()
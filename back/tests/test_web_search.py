@@ -0,0 +1,132 @@
+"""
+联网搜索对冲查询单元测试（使用本地的模拟搜索服务）
+"""
+import unittest
+import json
+import threading
+import time
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from web_search import WebSearcher
+
+BAIDU_HTML = '''<html><body>
+<div class="result"><h3><a href="https://example.com/a">结果A</a></h3><span class="content-abstract">摘要A</span></div>
+<div class="result"><h3><a href="https://example.com/b">结果B</a></h3><span class="content-abstract">摘要B</span></div>
+</body></html>'''
+
+DDG_JSON = {
+    'Heading': '结果A',
+    'AbstractText': 'DuckDuckGo摘要A',
+    'AbstractURL': 'https://example.com/a',
+    'RelatedTopics': [{'FirstURL': 'https://example.com/c', 'Text': '相关结果C'}],
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """按路径模拟搜索源：/ddg 返回JSON，/baidu 返回HTML；行为由server.behaviors决定"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        name = self.path[1:].split('?')[0]
+        delay, status = self.server.behaviors[name]
+        self.server.requests[name] = self.server.requests.get(name, 0) + 1
+        if status != 200:
+            time.sleep(delay)
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = (json.dumps(DDG_JSON) if name == 'ddg' else BAIDU_HTML).encode('utf-8')
+        body += b' ' * 65536
+        # 先返回响应头，响应内容分块慢慢发送，客户端可以在数据块之间取消
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            for i in range(0, len(body), 4096):
+                time.sleep(delay * 4096 / len(body))
+                self.wfile.write(body[i:i + 4096])
+                self.wfile.flush()
+        except OSError:
+            pass
+
+
+class WebSearchTestCase(unittest.TestCase):
+    """联网搜索对冲查询测试类"""
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.daemon_threads = True
+        self.server.behaviors = {'ddg': (0.05, 200), 'baidu': (0.05, 200)}
+        self.server.requests = {}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.searcher_args = {'duckduckgo_url': f'{url}/ddg', 'baidu_url': f'{url}/baidu', 'timeout': 3}
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def searcher(self, **kwargs):
+        searcher = WebSearcher(**dict(self.searcher_args, **kwargs))
+        searcher.session.trust_env = False
+        return searcher
+
+    def test_first_result_wins(self):
+        """测试同时查询时第一个有结果的搜索源胜出，较慢的搜索源被取消"""
+        self.server.behaviors['ddg'] = (2, 200)
+        searcher = self.searcher(hedge_delay=0, merge_window=0)
+        start = time.monotonic()
+        results = searcher.search('测试', max_results=3)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual([r['title'] for r in results], ['结果A', '结果B'])
+        self.assertEqual(results[0]['source'], '百度搜索')
+
+        # 较慢的搜索源在下一个数据块处停止，记为取消而不是失败
+        time.sleep(0.5)
+        stats = searcher.get_stats()
+        self.assertEqual(stats['duckduckgo']['cancelled'], 1)
+        self.assertEqual(stats['duckduckgo']['failure_rate'], 0)
+        self.assertEqual(stats['baidu']['successes'], 1)
+
+    def test_hedge_and_order(self):
+        """测试失败的搜索源立即触发下一个，统计的失败率决定之后的查询顺序"""
+        self.server.behaviors['ddg'] = (0, 500)
+        searcher = self.searcher(hedge_delay=5)
+        self.assertEqual(searcher.provider_order(), ['duckduckgo', 'baidu'])
+        start = time.monotonic()
+        results = searcher.search('测试')
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(len(results), 2)
+        self.assertEqual(searcher.get_stats()['duckduckgo']['errors'], 1)
+
+        # 失败过的搜索源排到后面；排在前面的搜索源在对冲延迟内返回结果时不再查询其他搜索源
+        self.assertEqual(searcher.provider_order(), ['baidu', 'duckduckgo'])
+        searcher.search('测试')
+        self.assertEqual(self.server.requests, {'ddg': 1, 'baidu': 2})
+
+    def test_merge_and_deadline(self):
+        """测试合并窗口内的结果去重合并，所有搜索源超过截止时间时返回空列表"""
+        searcher = self.searcher(hedge_delay=0, merge_window=1)
+        results = searcher.search('测试', max_results=3)
+        self.assertEqual([r['link'] for r in results],
+                         ['https://example.com/a', 'https://example.com/c', 'https://example.com/b'])
+        self.assertEqual([r['rank'] for r in results], [1, 2, 3])
+
+        self.server.behaviors = {'ddg': (2, 200), 'baidu': (2, 200)}
+        searcher = self.searcher(hedge_delay=0, deadline=0.3)
+        start = time.monotonic()
+        self.assertEqual(searcher.search('测试'), [])
+        self.assertLess(time.monotonic() - start, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+"""
+联网搜索结果并行总结单元测试
+"""
+import unittest
+import time
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from web_summary import summarize_web_results
+
+
+class SlowClient:
+    """按标题决定每个片段的生成耗时，记录生成的片段数"""
+
+    def __init__(self, delays):
+        self.delays = delays
+        self.chunks = {}
+        self.stopped = {}
+
+    def answer_question_stream(self, question, context, deadline=None):
+        title = context.split('\n')[0][len('标题：'):]
+        if self.delays[title] is None:
+            raise RuntimeError('生成失败')
+        for i in range(5):
+            # 与Ollama客户端一样，等待片段超过截止时刻时抛出TimeoutError
+            if deadline is not None and time.monotonic() + self.delays[title] > deadline:
+                time.sleep(max(deadline - time.monotonic(), 0))
+                self.stopped[title] = time.monotonic()
+                raise TimeoutError()
+            time.sleep(self.delays[title])
+            self.chunks[title] = self.chunks.get(title, 0) + 1
+            yield f'{title}-{i} '
+
+
+def web_results(*titles):
+    return [{'title': title, 'content': f'{title}的内容', 'source': '网络'} for title in titles]
+
+
+class WebSummaryTestCase(unittest.TestCase):
+    """联网搜索结果并行总结测试类"""
+
+    def test_concurrent(self):
+        """测试多条结果并发总结（总耗时接近单条耗时）"""
+        client = SlowClient({'a': 0.05, 'b': 0.05, 'c': 0.05})
+        start = time.monotonic()
+        summaries = dict(summarize_web_results(client, '问题', web_results('a', 'b', 'c'), deadline=5))
+        self.assertLess(time.monotonic() - start, 0.6)
+        self.assertEqual(sorted(summaries), [0, 1, 2])
+        self.assertTrue(summaries[1].startswith('b-0'))
+
+    def test_deadline_and_failure(self):
+        """测试超时和失败的结果返回None，超时的生成提前停止"""
+        client = SlowClient({'fast': 0.01, 'slow': 0.2, 'broken': None})
+        start = time.monotonic()
+        summaries = list(summarize_web_results(client, '问题', web_results('fast', 'slow', 'broken'), deadline=0.3))
+        self.assertLess(time.monotonic() - start, 0.6)
+        self.assertEqual(dict(summaries), {0: 'fast-0 fast-1 fast-2 fast-3 fast-4 ', 1: None, 2: None})
+        self.assertEqual(summaries[-1], (1, None))
+        time.sleep(0.3)
+        self.assertLess(client.chunks['slow'], 5)
+
+    def test_stuck_before_first_chunk(self):
+        """测试一直等不到第一个片段的总结在截止时刻停止，不占用线程"""
+        client = SlowClient({'fast': 0.01, 'stuck': 60})
+        start = time.monotonic()
+        summaries = dict(summarize_web_results(client, '问题', web_results('fast', 'stuck'), deadline=0.2))
+        self.assertEqual(summaries[1], None)
+        time.sleep(0.1)
+        self.assertLess(client.stopped['stuck'] - start, 0.3)
+        self.assertNotIn('stuck', client.chunks)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,15 +1,94 @@
-"""联网搜索功能"""
+"""联网搜索功能
+
+各搜索源按统计的期望耗时（平均耗时 + 失败率 × 超时时间）排序后对冲（hedged）查询：
+先查询排在最前的搜索源，超过对冲延迟仍没有结果或它已失败时再查询下一个，
+第一个有结果的搜索源胜出（合并窗口内返回的其他搜索源结果一起合并），其余搜索源取消；
+整体有一个截止时间，一个失效的搜索源不再给每次联网搜索增加整个超时时间。
+取消在读取响应内容的下一个数据块处生效并关闭连接（建立连接和等待响应头期间只能等到超时）。
+"""
 import requests
 from bs4 import BeautifulSoup
 import logging
 import json
-import urllib.parse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from config import Config
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class WebSearcher:
+# 各搜索源统计的指数滑动平均系数
+EWMA_ALPHA = 0.3
+
+_executor = ThreadPoolExecutor(max_workers=Config.WEB_SEARCH_WORKERS, thread_name_prefix='web-search')
+
+
+class Cancelled(Exception):
+    """其他搜索源已经返回结果（或已到截止时间），本次查询不再需要"""
+
+
+class ProviderStats:
+    """单个搜索源的耗时与错误统计（线程安全）"""
+
     def __init__(self):
+        self.requests = 0
+        self.successes = 0
+        self.empty = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.latency = None
+        self.failure_rate = 0.0
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def record(self, outcome, elapsed, error=None):
+        """记录一次查询：outcome为 success/empty/error/cancelled"""
+        with self._lock:
+            self.requests += 1
+            if outcome == 'cancelled':
+                # 被取消时只知道耗时不少于elapsed，作为耗时样本的下界，不计入失败率
+                self.cancelled += 1
+                if self.latency is None or elapsed > self.latency:
+                    self.latency = self._ewma(self.latency, elapsed)
+                return
+            if outcome == 'success':
+                self.successes += 1
+            elif outcome == 'empty':
+                self.empty += 1
+            else:
+                self.errors += 1
+                self.last_error = error
+            self.latency = self._ewma(self.latency, elapsed)
+            self.failure_rate = self._ewma(self.failure_rate, 0.0 if outcome == 'success' else 1.0)
+
+    @staticmethod
+    def _ewma(average, sample):
+        return sample if average is None else average + EWMA_ALPHA * (sample - average)
+
+    def expected_latency(self, timeout):
+        """得到有效结果的期望耗时（没有查询过的搜索源为0，按配置顺序优先尝试）"""
+        with self._lock:
+            return (self.latency or 0.0) + self.failure_rate * timeout
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'successes': self.successes,
+                'empty': self.empty,
+                'errors': self.errors,
+                'cancelled': self.cancelled,
+                'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+                'failure_rate': round(self.failure_rate, 3),
+                'last_error': self.last_error,
+            }
+
+
+class WebSearcher:
+    def __init__(self, duckduckgo_url=None, baidu_url=None, timeout=None, deadline=None,
+                 hedge_delay=None, merge_window=None):
+        """搜索源地址和各时间参数（秒）默认取自Config，测试时可指向本地的模拟服务"""
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
@@ -19,151 +98,250 @@ class WebSearcher:
             'Connection': 'keep-alive',
             'Upgrade-Insecure-Requests': '1'
         })
-    
-    def search_duckduckgo(self, query, max_results=3):
-        """使用DuckDuckGo搜索（免费，无需API密钥）"""
+        self.duckduckgo_url = duckduckgo_url or Config.WEB_SEARCH_DUCKDUCKGO_URL
+        self.baidu_url = baidu_url or Config.WEB_SEARCH_BAIDU_URL
+        self.timeout = Config.WEB_SEARCH_TIMEOUT if timeout is None else timeout
+        self.deadline = Config.WEB_SEARCH_DEADLINE if deadline is None else deadline
+        self.hedge_delay = Config.WEB_SEARCH_HEDGE_DELAY if hedge_delay is None else hedge_delay
+        self.merge_window = Config.WEB_SEARCH_MERGE_WINDOW if merge_window is None else merge_window
+        # 搜索源名称 -> 查询函数（配置顺序即没有统计数据时的尝试顺序）
+        self.providers = {
+            'duckduckgo': self._query_duckduckgo,
+            'baidu': self._query_baidu,
+        }
+        self.stats = {name: ProviderStats() for name in self.providers}
+
+    def _fetch(self, url, params, cancelled):
+        """读取响应内容，每个数据块检查一次是否已被取消"""
+        response = self.session.get(url, params=params, timeout=self.timeout, stream=True)
         try:
-            # DuckDuckGo Instant Answer API
-            api_url = f"https://api.duckduckgo.com/?q={urllib.parse.quote(query)}&format=json&no_html=1&skip_disambig=1"
-            response = self.session.get(api_url, timeout=5)  # 减少超时时间到5秒
             response.raise_for_status()
-            data = response.json()
-            
-            results = []
-            
-            # 处理Instant Answer结果
-            if data.get('AbstractText'):
+            body = bytearray()
+            for chunk in response.iter_content(chunk_size=8192):
+                if cancelled.is_set():
+                    raise Cancelled()
+                body.extend(chunk)
+            if cancelled.is_set():
+                raise Cancelled()
+            return bytes(body)
+        finally:
+            response.close()
+    
+    def _query_duckduckgo(self, query, max_results, cancelled):
+        """DuckDuckGo查询，失败时抛出异常，没有结果时返回空列表"""
+        # DuckDuckGo Instant Answer API
+        params = {'q': query, 'format': 'json', 'no_html': 1, 'skip_disambig': 1}
+        data = json.loads(self._fetch(self.duckduckgo_url, params, cancelled))
+        
+        results = []
+        
+        # 处理Instant Answer结果
+        if data.get('AbstractText'):
+            results.append({
+                'title': data.get('Heading', query),
+                'content': data.get('AbstractText', ''),
+                'link': data.get('AbstractURL', ''),
+                'source': 'DuckDuckGo',
+                'rank': 1
+            })
+        
+        # 处理Related Topics
+        for idx, topic in enumerate(data.get('RelatedTopics', [])[:max_results-1], 2):
+            if isinstance(topic, dict) and 'Text' in topic:
                 results.append({
-                    'title': data.get('Heading', query),
-                    'content': data.get('AbstractText', ''),
-                    'link': data.get('AbstractURL', ''),
+                    'title': topic.get('FirstURL', '').split('/')[-1] if topic.get('FirstURL') else f'相关结果 {idx}',
+                    'content': topic.get('Text', ''),
+                    'link': topic.get('FirstURL', ''),
                     'source': 'DuckDuckGo',
-                    'rank': 1
+                    'rank': idx
                 })
-            
-            # 处理Related Topics
-            for idx, topic in enumerate(data.get('RelatedTopics', [])[:max_results-1], 2):
-                if isinstance(topic, dict) and 'Text' in topic:
-                    results.append({
-                        'title': topic.get('FirstURL', '').split('/')[-1] if topic.get('FirstURL') else f'相关结果 {idx}',
-                        'content': topic.get('Text', ''),
-                        'link': topic.get('FirstURL', ''),
-                        'source': 'DuckDuckGo',
-                        'rank': idx
-                    })
-            
+        
+        return results[:max_results]
+    
+    def search_duckduckgo(self, query, max_results=3):
+        """使用DuckDuckGo搜索（免费，无需API密钥）"""
+        try:
+            results = self._query_duckduckgo(query, max_results, threading.Event())
             if results:
                 logger.info(f"DuckDuckGo搜索成功，找到 {len(results)} 条结果")
-                return results[:max_results]
+                return results
         except Exception as e:
             logger.warning(f"DuckDuckGo搜索失败: {e}")
         
         return None
     
+    def _query_baidu(self, query, max_results, cancelled):
+        """百度搜索HTML解析，失败时抛出异常，没有结果时返回空列表"""
+        # 尝试使用百度搜索的公开接口
+        soup = BeautifulSoup(self._fetch(self.baidu_url, {'wd': query}, cancelled), 'html.parser')
+        results = []
+        
+        # 尝试多种可能的百度搜索结果选择器
+        # 百度搜索结果可能有不同的HTML结构
+        selectors = [
+            ('div', {'class': 'result'}),
+            ('div', {'class': 'c-container'}),
+            ('div', {'class': 'result-op'}),
+            ('div', {'id': lambda x: x and 'result' in x.lower()}),
+        ]
+        
+        result_divs = []
+        for tag, attrs in selectors:
+            result_divs = soup.find_all(tag, attrs)
+            if result_divs:
+                logger.info(f"使用选择器 {tag} {attrs} 找到 {len(result_divs)} 个结果")
+                break
+        
+        if not result_divs:
+            # 尝试更通用的方法：查找包含链接的div
+            result_divs = soup.find_all('div', class_=lambda x: x and ('result' in x.lower() or 'container' in x.lower()))
+        
+        for idx, div in enumerate(result_divs[:max_results], 1):
+            try:
+                # 尝试多种方式查找标题
+                title_elem = div.find('h3') or div.find('h2') or div.find('a', class_=lambda x: x and 'title' in x.lower())
+                if not title_elem:
+                    title_elem = div.find('a')
+                
+                # 尝试多种方式查找链接
+                link_elem = div.find('a', href=True)
+                if not link_elem and title_elem:
+                    link_elem = title_elem
+                
+                # 尝试多种方式查找内容摘要
+                content_elem = (
+                    div.find('span', class_=lambda x: x and ('abstract' in x.lower() or 'content' in x.lower())) or
+                    div.find('div', class_=lambda x: x and ('abstract' in x.lower() or 'content' in x.lower())) or
+                    div.find('p', class_=lambda x: x and ('abstract' in x.lower() or 'content' in x.lower()))
+                )
+                
+                title = title_elem.get_text().strip() if title_elem else f"搜索结果 {idx}"
+                link = link_elem.get('href', '') if link_elem else ''
+                content = content_elem.get_text().strip() if content_elem else ''
+                
+                # 如果没有内容，尝试从div中提取文本
+                if not content:
+                    all_text = div.get_text()
+                    if title_elem:
+                        title_text = title_elem.get_text()
+                        content = all_text.replace(title_text, '').strip()[:200]
+                
+                if title:
+                    results.append({
+                        'title': title,
+                        'content': content[:500] if content else f'关于"{query}"的搜索结果',
+                        'link': link,
+                        'source': '百度搜索',
+                        'rank': idx
+                    })
+            except Exception as e:
+                logger.warning(f"解析搜索结果项失败: {e}")
+                continue
+        
+        return results[:max_results]
+    
     def search_baidu_html(self, query, max_results=3):
         """使用百度搜索"""
         try:
-            # 尝试使用百度搜索的公开接口
-            search_url = f"https://www.baidu.com/s?wd={urllib.parse.quote(query)}"
-            response = self.session.get(search_url, timeout=5)  # 减少超时时间到5秒
-            response.raise_for_status()
-            
-            soup = BeautifulSoup(response.content, 'html.parser')
-            results = []
-            
-            # 尝试多种可能的百度搜索结果选择器
-            # 百度搜索结果可能有不同的HTML结构
-            selectors = [
-                ('div', {'class': 'result'}),
-                ('div', {'class': 'c-container'}),
-                ('div', {'class': 'result-op'}),
-                ('div', {'id': lambda x: x and 'result' in x.lower()}),
-            ]
-            
-            result_divs = []
-            for tag, attrs in selectors:
-                result_divs = soup.find_all(tag, attrs)
-                if result_divs:
-                    logger.info(f"使用选择器 {tag} {attrs} 找到 {len(result_divs)} 个结果")
-                    break
-            
-            if not result_divs:
-                # 尝试更通用的方法：查找包含链接的div
-                result_divs = soup.find_all('div', class_=lambda x: x and ('result' in x.lower() or 'container' in x.lower()))
-            
-            for idx, div in enumerate(result_divs[:max_results], 1):
-                try:
-                    # 尝试多种方式查找标题
-                    title_elem = div.find('h3') or div.find('h2') or div.find('a', class_=lambda x: x and 'title' in x.lower())
-                    if not title_elem:
-                        title_elem = div.find('a')
-                    
-                    # 尝试多种方式查找链接
-                    link_elem = div.find('a', href=True)
-                    if not link_elem and title_elem:
-                        link_elem = title_elem
-                    
-                    # 尝试多种方式查找内容摘要
-                    content_elem = (
-                        div.find('span', class_=lambda x: x and ('abstract' in x.lower() or 'content' in x.lower())) or
-                        div.find('div', class_=lambda x: x and ('abstract' in x.lower() or 'content' in x.lower())) or
-                        div.find('p', class_=lambda x: x and ('abstract' in x.lower() or 'content' in x.lower()))
-                    )
-                    
-                    title = title_elem.get_text().strip() if title_elem else f"搜索结果 {idx}"
-                    link = link_elem.get('href', '') if link_elem else ''
-                    content = content_elem.get_text().strip() if content_elem else ''
-                    
-                    # 如果没有内容，尝试从div中提取文本
-                    if not content:
-                        all_text = div.get_text()
-                        if title_elem:
-                            title_text = title_elem.get_text()
-                            content = all_text.replace(title_text, '').strip()[:200]
-                    
-                    if title:
-                        results.append({
-                            'title': title,
-                            'content': content[:500] if content else f'关于"{query}"的搜索结果',
-                            'link': link,
-                            'source': '百度搜索',
-                            'rank': idx
-                        })
-                except Exception as e:
-                    logger.warning(f"解析搜索结果项失败: {e}")
-                    continue
-            
+            results = self._query_baidu(query, max_results, threading.Event())
             if results:
                 logger.info(f"百度搜索HTML解析成功，找到 {len(results)} 条结果")
-                return results[:max_results]
+                return results
         except Exception as e:
             logger.warning(f"百度搜索HTML解析失败: {e}")
         
         return None
     
+    
+    def provider_order(self):
+        """按期望耗时从小到大排列的搜索源"""
+        return sorted(self.providers, key=lambda name: self.stats[name].expected_latency(self.timeout))
+    
+    def _run(self, name, query, max_results, cancelled):
+        """在线程池中查询一个搜索源并记录统计，失败、被取消或没有结果时返回None"""
+        start = time.monotonic()
+        try:
+            results = self.providers[name](query, max_results, cancelled)
+        except Cancelled:
+            self.stats[name].record('cancelled', time.monotonic() - start)
+            return None
+        except Exception as e:
+            self.stats[name].record('error', time.monotonic() - start, error=str(e))
+            logger.warning(f"❌ 搜索源 {name} 查询失败: {e}")
+            return None
+        self.stats[name].record('success' if results else 'empty', time.monotonic() - start)
+        return results or None
+    
+    @staticmethod
+    def _merge(results_by_provider, max_results):
+        """按搜索源顺序合并结果，去除链接（没有链接时为标题）重复的结果并重新编号"""
+        merged, seen = [], set()
+        for results in results_by_provider:
+            for result in results:
+                key = result.get('link') or result['title']
+                if key in seen:
+                    continue
+                seen.add(key)
+                merged.append(dict(result, rank=len(merged) + 1))
+        return merged[:max_results]
+    
     def search(self, query, max_results=3):
-        """通用搜索接口 - 优先使用真实搜索，失败则返回空列表（不返回虚拟内容）"""
+        """通用搜索接口 - 对冲查询各搜索源，全部失败则返回空列表（不返回虚拟内容）"""
         logger.info(f"🌐 开始联网搜索: query='{query}', max_results={max_results}")
+        waiting = self.provider_order()
+        launched = []
+        cancelled = threading.Event()
+        futures = {}
+        pending = set()
+        found = {}
+        start = time.monotonic()
+        end = start + self.deadline
+        hedge_at = start
+        merge_until = None
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= end or (found and now >= merge_until):
+                    break
+                # 还没有结果时，已启动的搜索源都失败了或已到对冲延迟，就启动下一个搜索源
+                if waiting and not found and (not pending or now >= hedge_at):
+                    name = waiting.pop(0)
+                    logger.info(f"🔍 查询搜索源: {name}")
+                    future = _executor.submit(self._run, name, query, max_results, cancelled)
+                    futures[future] = name
+                    launched.append(name)
+                    pending.add(future)
+                    hedge_at = now + self.hedge_delay
+                    continue
+                if not pending:
+                    break
+                wake = merge_until if found else (hedge_at if waiting else end)
+                done, pending = wait(pending, timeout=max(min(wake, end) - now, 0), return_when=FIRST_COMPLETED)
+                for future in done:
+                    results = future.result()
+                    if results:
+                        found[futures[future]] = results
+                        if merge_until is None:
+                            merge_until = time.monotonic() + self.merge_window
+                    else:
+                        # 失败的搜索源不再等待对冲延迟，立即启动下一个
+                        hedge_at = time.monotonic()
+        finally:
+            # 胜出或超时：未开始的查询取消，正在读取响应的查询在下一个数据块处停止
+            cancelled.set()
+            for future in pending:
+                future.cancel()
         
-        # 方法1: 尝试DuckDuckGo（免费API）
-        logger.info("🔍 尝试方法1: DuckDuckGo API")
-        results = self.search_duckduckgo(query, max_results)
-        if results:
-            logger.info(f"✅ DuckDuckGo搜索成功，找到 {len(results)} 条结果")
-            return results
-        else:
-            logger.warning("❌ DuckDuckGo搜索失败或无结果")
-        
-        # 方法2: 尝试百度HTML解析
-        logger.info("🔍 尝试方法2: 百度HTML解析")
-        results = self.search_baidu_html(query, max_results)
-        if results:
-            logger.info(f"✅ 百度搜索成功，找到 {len(results)} 条结果")
+        if found:
+            results = self._merge([found[name] for name in launched if name in found], max_results)
+            logger.info(f"✅ 联网搜索成功（{'、'.join(name for name in launched if name in found)}），"
+                        f"找到 {len(results)} 条结果，耗时 {time.monotonic() - start:.2f}秒")
             return results
-        else:
-            logger.warning("❌ 百度搜索失败或无结果")
         
         # 如果所有方法都失败，返回空列表（不返回虚拟内容）
         logger.warning(f"❌ 所有联网搜索方法都失败，返回空结果（不返回虚拟内容）")
         return []
-
+    
+    def get_stats(self):
+        """各搜索源的查询统计（按当前的查询顺序）"""
+        return {name: self.stats[name].to_dict() for name in self.provider_order()}
@@ -0,0 +1,75 @@
+"""联网搜索结果的并行总结
+
+知识库没有结果时，联网搜索的每条结果都要让Ollama总结一次。各条结果在线程池中并发总结
+（线程数即同时占用本地模型的请求上限，所有搜索请求共享），整体有一个截止时间：
+截止时间内完成的结果使用总结，其余结果直接使用原始摘要，不再拖慢响应。
+总结使用流式生成，等待文本片段（包括还没开始输出时）也以截止时间为上限，
+超时后关闭与Ollama的连接，释放模型和线程。
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from config import Config
+from context_builder import truncate_to_tokens
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=Config.WEB_SUMMARY_WORKERS, thread_name_prefix='web-summary')
+
+
+def _summarize(ollama_client, query, web_result, cancelled, end):
+    """总结一条联网搜索结果，被取消、超时、失败或没有生成内容时返回None
+
+    end: time.monotonic()的截止时刻，等待Ollama输出不会超过该时刻
+    """
+    if cancelled.is_set():
+        return None
+    context = truncate_to_tokens(f"标题：{web_result['title']}\n内容：{web_result['content']}", Config.CONTEXT_MAX_TOKENS)
+    chunks = ollama_client.answer_question_stream(question=query, context=context, deadline=end)
+    generated = []
+    try:
+        for chunk in chunks:
+            if cancelled.is_set():
+                return None
+            generated.append(chunk)
+    except TimeoutError:
+        return None
+    except Exception as e:
+        logger.error(f"Ollama处理搜索结果失败: {e}")
+        return None
+    finally:
+        chunks.close()
+    return ''.join(generated) or None
+
+
+def summarize_web_results(ollama_client, query, web_results, deadline=None):
+    """并发总结联网搜索结果，按完成顺序产出 (下标, 总结)
+
+    deadline: 截止时间（秒，默认Config.WEB_SUMMARY_DEADLINE）；截止时未完成、失败的结果产出 (下标, None)
+    """
+    deadline = Config.WEB_SUMMARY_DEADLINE if deadline is None else deadline
+    cancelled = threading.Event()
+    end = time.monotonic() + deadline
+    futures = {
+        _executor.submit(_summarize, ollama_client, query, web_result, cancelled, end): index
+        for index, web_result in enumerate(web_results)
+    }
+    pending = set(futures)
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=max(end - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                yield futures[future], future.result()
+    finally:
+        # 超时或调用方提前结束：未开始的任务取消，正在生成的任务在下一个片段处或截止时刻停止
+        cancelled.set()
+        for future in pending:
+            future.cancel()
+    if pending:
+        logger.warning(f"联网搜索结果总结超时（{deadline}秒），{len(pending)} 条结果使用原始摘要")
+        for future in sorted(pending, key=futures.get):
+            yield futures[future], None